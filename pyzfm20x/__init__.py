@@ -1,5 +1,5 @@
 #!/usr/bin/env python
 
-import pyzfm20x
+from . import pyzfm20x
 VERSION = '0.1'
 
@@ -0,0 +1,382 @@
+""" asyncio client for ZFM20x sensors (Python 3.5+)
+
+AsyncZFM20x provides awaitable versions of the ZFM20x commands, sharing its
+packet encoding (FramedTransport) and reply decoding. Serial ports are put in
+non-blocking mode and read when the event loop reports them readable, so any
+number of sensors can be served from one thread:
+
+    board = await AsyncZFM20x.open('/dev/ttyUSB0')
+    ack = await board.getImage(timeout=1.0)
+
+Every command takes an optional timeout in seconds. When a command times out,
+is cancelled half way through a reply or gets a corrupted frame (FrameError),
+pending input is flushed before the next command so the stream stays in sync.
+"""
+import asyncio
+
+from .commands import *
+from .packets import *
+from .pyzfm20x import ZFM20x
+from .results import *
+from .transport import FramedTransport, FrameError, openPort
+
+
+class AsyncFramedTransport(object):
+    """Non-blocking frame reads on top of FramedTransport"""
+
+    headerSize = FramedTransport.headerSize
+
+    def __init__(self, port, address=0xFFFFFFFF, pollInterval=0.005):
+        """ Ports that have a fileno are watched by the event loop, anything
+        else (e.g. ZFM20xSimulator) is polled every pollInterval seconds
+        """
+        self.framer = FramedTransport(port, address)
+        self.port = port
+        self.pollInterval = pollInterval
+        port.timeout = 0
+        try:
+            self._fd = port.fileno()
+        except Exception:
+            self._fd = None
+
+    @property
+    def address(self):
+        return self.framer.address
+
+    @address.setter
+    def address(self, address):
+        self.framer.address = address
+
+    def writePacket(self, packetType, packet):
+        self.framer.writePacket(packetType, packet)
+
+    def send(self, packet):
+        self.framer.send(packet)
+
+    def writeData(self, data, packetSize):
+        self.framer.writeData(data, packetSize)
+
+    async def _readable(self):
+        if self._fd is not None:
+            loop = asyncio.get_event_loop()
+            waiter = loop.create_future()
+            try:
+                loop.add_reader(self._fd, waiter.set_result, None)
+            except NotImplementedError:
+                self._fd = None
+            else:
+                try:
+                    await waiter
+                finally:
+                    loop.remove_reader(self._fd)
+                return
+        await asyncio.sleep(self.pollInterval)
+
+    async def read(self, size):
+        """ Read exactly size bytes, waiting on the event loop in between"""
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.port.read(size - len(data))
+            if chunk:
+                data.extend(chunk)
+            else:
+                await self._readable()
+        return data
+
+    async def readPacket(self):
+        """ Read one frame, resynchronizing and checking it like FramedTransport.readPacket"""
+        framer = self.framer
+        reply = await self.read(self.headerSize)
+        while not framer.validHeader(reply):
+            drop = framer.resyncOffset(reply)
+            framer.droppedBytes += drop
+            del reply[:drop]
+            reply.extend(await self.read(self.headerSize - len(reply)))
+        length = (reply[7] << 8) + reply[8]
+        reply.extend(await self.read(length))
+        framer.checkFrame(reply)
+        return reply
+
+    def flush(self):
+        """ Drop whatever is left of an abandoned reply"""
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+        else:
+            self.port.flushInput()
+
+
+class AsyncZFM20x(object):
+    """An asyncio fingerprint reader class"""
+
+    packageSizeDict = ZFM20x.packageSizeDict
+    imgBufferSize = ZFM20x.imgBufferSize
+    chrBufferSize = ZFM20x.chrBufferSize
+    notepadPageSize = ZFM20x.notepadPageSize
+
+    def __init__(self, port, baudrate=57600, name=None, address=0xFFFFFFFF, password=0x00000000,
+                 pollInterval=0.005, fingerPollInterval=0.05):
+        """ Use AsyncZFM20x.open to also read the device info like ZFM20x does"""
+        self.sp = openPort(port, baudrate)
+        self.transport = AsyncFramedTransport(self.sp, address, pollInterval)
+        self.name = name
+        if not self.name:
+            self.name = self.sp.port
+        self.password = password
+        self.fingerPollInterval = fingerPollInterval
+        self.packageSize = 2
+        self._lock = asyncio.Lock()
+        self._dirty = False
+
+    @classmethod
+    async def open(cls, port, *args, **kwargs):
+        board = cls(port, *args, **kwargs)
+        await board.connect()
+        return board
+
+    async def connect(self, timeout=None):
+        """ Read the device info, like the ZFM20x constructor"""
+        ack, info = await self.getHWinfo(timeout=timeout)
+        if ack != FINGERPRINT_OK:
+            raise IOError('%s did not send its device info (confirmation code %d)' % (self.name, ack))
+        self.databaseCount = info.fingerDatabase
+        self.secureLevel = info.secureLevel
+        self.packageSize = info.packageSize
+        self.productType = info.productType
+        self.version = info.version
+        self.manufacturer = info.manufacturer
+        self.sensor = info.sensor
+        self.baudrate = info.baudrate
+        return info
+
+    @property
+    def address(self):
+        return self.transport.address
+
+    @address.setter
+    def address(self, address):
+        self.transport.address = address
+
+    def exit(self):
+        """Call this to exit cleanly."""
+        self.sp.close()
+
+    def getPackageSizeBytes(self):
+        return self.packageSizeDict[self.packageSize]
+
+    async def _exchange(self, packet, dataPackets=0, timeout=None, data=None):
+        """ Send a command Packet and read its acknowledge, followed by dataPackets
+        data packets (-1 reads data packets up to the end packet). Returns the
+        acknowledge Reply and the list of data frames. data is sent in data
+        packets once the command is acknowledged.
+        """
+        async with self._lock:
+            if self._dirty:
+                self.transport.flush()
+                self._dirty = False
+            try:
+                return await asyncio.wait_for(self._transfer(packet, dataPackets, data), timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError, FrameError):
+                self._dirty = True
+                raise
+
+    async def _transfer(self, packet, dataPackets, outgoing):
+        self.transport.send(packet)
+        reply = Reply(await self.transport.readPacket())
+        data = []
+        if reply.ok and outgoing is not None:
+            self.transport.writeData(outgoing, self.getPackageSizeBytes())
+        if reply.ok:
+            while dataPackets < 0 or len(data) < dataPackets:
+                data.append(await self.transport.readPacket())
+                if dataPackets < 0 and data[-1][6] == FINGERPRINT_ENDDATAPACKET:
+                    break
+        return reply, data
+
+    async def _transact(self, layout, *values, timeout=None):
+        reply, _ = await self._exchange(Packet.command(layout, *values), timeout=timeout)
+        return reply
+
+    async def _command(self, layout, *values, timeout=None):
+        """ Commands only answered with a confirmation code"""
+        reply = await self._transact(layout, *values, timeout=timeout)
+        return reply.ack
+
+    async def verifyPassword(self, password, timeout=None):
+        return await self._command(COMMAND_WORD, FINGERPRINT_VERIFYPASSWORD, password & 0xFFFFFFFF, timeout=timeout)
+
+    async def setPassword(self, password, timeout=None):
+        """ Set a new password for the current device"""
+        return await self._command(COMMAND_WORD, FINGERPRINT_SETPASSWORD, password & 0xFFFFFFFF, timeout=timeout)
+
+    async def setAddress(self, newAddress, timeout=None):
+        """ Set a new address for the current device"""
+        reply = await self._transact(COMMAND_WORD, FINGERPRINT_SETADDR, newAddress & 0xFFFFFFFF, timeout=timeout)
+        result = AddressResult.fromReply(reply)
+        if result.ack == FINGERPRINT_OK:
+            self.address = result.address
+        return result
+
+    async def setSystemParameter(self, parameterNumber, content, timeout=None):
+        return await self._command(COMMAND_PARAMETER, FINGERPRINT_SETSYSPARA, parameterNumber, content, timeout=timeout)
+
+    async def readSystemParameters(self, timeout=None):
+        """ Read system parameters"""
+        reply = await self._transact(COMMAND, FINGERPRINT_READSYSPARA, timeout=timeout)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, SystemParameters.fromReply(reply))
+
+    async def readContList(self, indexPage=0, timeout=None):
+        """ Read one page of the index table, see ZFM20x.readContList"""
+        reply = await self._transact(COMMAND_BYTE, FINGERPRINT_READCONTLIST, indexPage, timeout=timeout)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, reply.data(32))
+
+    async def getTemplateCount(self, timeout=None):
+        """ Get the number of templates in flash"""
+        return CountResult.fromReply(await self._transact(COMMAND, FINGERPRINT_TEMPLATECOUNT, timeout=timeout))
+
+    async def getHWinfo(self, timeout=None):
+        """ Get Hardware information"""
+        packet = Packet.command(COMMAND_BYTE, FINGERPRINT_GETHWINFO, 0x00)
+        reply, data = await self._exchange(packet, dataPackets=4, timeout=timeout)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, HWInfo.fromFrame(data[0]))
+
+    async def getImage(self, timeout=None):
+        """ Get finger image and save to ImageBuffer in the module """
+        return await self._command(COMMAND, FINGERPRINT_GETIMAGE, timeout=timeout)
+
+    async def uploadImage(self, imgBuffer=None, timeout=None):
+        """ Upload image from ImageBuffer in module into imgBuffer, see ZFM20x.uploadImageInto"""
+        if imgBuffer is None:
+            imgBuffer = bytearray(self.imgBufferSize)
+        return await self._uploadInto(Packet.command(COMMAND, FINGERPRINT_UPIMG), imgBuffer, timeout)
+
+    async def _uploadInto(self, packet, buffer, timeout):
+        """ Send packet and copy the payloads of the data packets that follow into buffer"""
+        reply, data = await self._exchange(packet, dataPackets=-1, timeout=timeout)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        offset = 0
+        for frame in data:
+            payload = frame[9:-2]
+            buffer[offset:offset + len(payload)] = payload
+            offset += len(payload)
+        return DataResult(FINGERPRINT_OK, buffer)
+
+    async def downloadImage(self, data, timeout=None):
+        """ Download image from host to ImageBuffer in module
+        data holds the imgBufferSize bytes of a packed image, see ZFM20x.downloadImage
+        """
+        reply, _ = await self._exchange(Packet.command(COMMAND, FINGERPRINT_DOWNIMG), timeout=timeout, data=data)
+        return reply.ack
+
+    async def image2Tz(self, bufferID, timeout=None):
+        """ Generate a char file from finger image and store it in Charbuffer1/2"""
+        return await self._command(COMMAND_BYTE, FINGERPRINT_IMAGE2TZ, bufferID, timeout=timeout)
+
+    async def createModel(self, timeout=None):
+        """ Create a new model for the finger from CharBuffer1 and CharBuffer2"""
+        return await self._command(COMMAND, FINGERPRINT_REGMODEL, timeout=timeout)
+
+    async def uploadChar(self, bufferID, chrBuffer=None, timeout=None):
+        """ Upload a char file from bufferId in module into chrBuffer, see ZFM20x.uploadCharInto"""
+        if chrBuffer is None:
+            chrBuffer = bytearray(self.chrBufferSize)
+        packet = Packet.command(COMMAND_BYTE, FINGERPRINT_UPCHAR, bufferID)
+        return await self._uploadInto(packet, chrBuffer, timeout)
+
+    async def downloadChar(self, bufferID, data, timeout=None):
+        """ Download a char file (chrBufferSize bytes) from host to bufferID in module"""
+        packet = Packet.command(COMMAND_BYTE, FINGERPRINT_DOWNCHAR, bufferID)
+        reply, _ = await self._exchange(packet, timeout=timeout, data=data)
+        return reply.ack
+
+    async def store(self, pageID, timeout=None):
+        """ Store a finger model to flash with pageID"""
+        return await self._command(COMMAND_PAGE, FINGERPRINT_STORE, 0x01, pageID, timeout=timeout)
+
+    async def loadChar(self, bufferID, pageID, timeout=None):
+        """ Load char file from flash to bufferID"""
+        return await self._command(COMMAND_PAGE, FINGERPRINT_LOADCHAR, bufferID, pageID, timeout=timeout)
+
+    async def deleteChar(self, pageID, countBytes, timeout=None):
+        return await self._command(COMMAND_RANGE, FINGERPRINT_DELCHAR, pageID, countBytes, timeout=timeout)
+
+    async def empty(self, timeout=None):
+        """ Empty finger ID database"""
+        return await self._command(COMMAND, FINGERPRINT_EMPTY, timeout=timeout)
+
+    async def match(self, timeout=None):
+        """ Match two char files stored in CharBuffer1 and CharBuffer2"""
+        return MatchResult.fromReply(await self._transact(COMMAND, FINGERPRINT_MATCH, timeout=timeout))
+
+    async def _search(self, command, bufferID, startPage, pageNumber, timeout):
+        reply = await self._transact(COMMAND_SEARCH, command, bufferID, startPage, pageNumber, timeout=timeout)
+        return SearchResult.fromReply(reply)
+
+    async def search(self, bufferID, startPage, pageNumber, timeout=None):
+        return await self._search(FINGERPRINT_SEARCH, bufferID, startPage, pageNumber, timeout)
+
+    async def highSpeedSearch(self, bufferID, startPage, pageNumber, timeout=None):
+        return await self._search(FINGERPRINT_HISPEEDSEARCH, bufferID, startPage, pageNumber, timeout)
+
+    async def getRandomCode(self, timeout=None):
+        """ Get Random Code from device"""
+        return RandomCodeResult.fromReply(await self._transact(COMMAND, FINGERPRINT_GETRANDOMCODE, timeout=timeout))
+
+    async def writeNotepad(self, pageNumber, data, timeout=None):
+        """ Write up to notepadPageSize bytes to notepad page pageNumber, zero padded"""
+        if len(data) > self.notepadPageSize:
+            raise ValueError('A notepad page holds %d bytes' % self.notepadPageSize)
+        return await self._command(COMMAND_NOTEPAD, FINGERPRINT_WRITENOTE, pageNumber, bytes(bytearray(data)),
+                                   timeout=timeout)
+
+    async def readNotepad(self, pageNumber, timeout=None):
+        reply = await self._transact(COMMAND_BYTE, FINGERPRINT_READNOTE, pageNumber, timeout=timeout)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, reply.data(self.notepadPageSize))
+
+    ### High level libraries
+    async def searchFinger(self, timeout=None):
+        """ Convert the image in ImageBuffer and search for it in the database"""
+        return await asyncio.wait_for(self._searchFinger(), timeout)
+
+    async def _searchFinger(self):
+        ack = await self.image2Tz(0)
+        if ack != FINGERPRINT_OK:
+            return SearchResult(ack, 0, 0)
+        return await self.highSpeedSearch(0, 0x00, 0x03E9)
+
+    async def fingerPresent(self, timeout=None):
+        return await self.getImage(timeout) == FINGERPRINT_OK
+
+    async def _waitFinger(self, present):
+        """ Poll until a finger is (or is no longer) on the sensor, yielding to the loop in between"""
+        while await self.fingerPresent() != present:
+            await asyncio.sleep(self.fingerPollInterval)
+
+    async def fingerEnroll(self, fingerID, timeout=None):
+        """ Enroll a new finger with id = fingerID, see ZFM20x.fingerEnroll
+        timeout is the deadline for the whole enrollment, asyncio.TimeoutError
+        is raised when it passes.
+        """
+        return await asyncio.wait_for(self._fingerEnroll(fingerID), timeout)
+
+    async def _fingerEnroll(self, fingerID):
+        await self._waitFinger(True)
+        if await self.image2Tz(1) != FINGERPRINT_OK:
+            return -1
+        await self._waitFinger(False)
+        await self._waitFinger(True)
+        if await self.image2Tz(2) != FINGERPRINT_OK:
+            return -2
+        if await self.createModel() != FINGERPRINT_OK:
+            return -3
+        if await self.store(fingerID) != FINGERPRINT_OK:
+            return -4
+        return fingerID
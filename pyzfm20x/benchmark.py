@@ -0,0 +1,214 @@
+""" Benchmarks for command latency and bulk transfer throughput
+
+Runs against a ZFM20xSimulator (or a real sensor with --port) and prints the
+results as JSON, so they can be stored and compared between versions:
+
+    python -m pyzfm20x.benchmark --output results.json
+    python -m pyzfm20x.benchmark --compare results.json
+
+With --compare the exit status is 1 when any result got slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .commands import *
+from .pyzfm20x import ZFM20x
+from .simulator import ZFM20xSimulator
+from .transport import FramedTransport
+
+cpuTime = getattr(time, 'process_time', None) or time.clock
+
+
+class _ReplayPort(object):
+    """Port that discards writes and serves reads from a prefilled buffer"""
+
+    port = 'replay'
+
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.offset = 0
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        data = self.data[self.offset:self.offset + size]
+        self.offset += len(data)
+        return bytes(data)
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    count = len(samples)
+    return {'count': count,
+            'min': samples[0],
+            'median': samples[count // 2],
+            'p95': samples[min(count - 1, int(count * 0.95))],
+            'max': samples[-1],
+            'mean': sum(samples) / count}
+
+
+def _simulatedBoard(latency=None, throttle=False, baudMultiplier=6, packageSize=2):
+    sim = ZFM20xSimulator(baudrate=baudMultiplier * 9600, packageSize=packageSize,
+                          latency=latency, throttle=throttle)
+    board = ZFM20x(sim)
+    return sim, board
+
+
+def benchLatency(board, sim=None, repeat=50):
+    """ Round trip latency of the single packet commands, in seconds"""
+    if sim is not None:
+        sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+    board.getImage()
+    board.image2Tz(1)
+    # A template for search to find, on a free page so a real sensor keeps
+    # its library. It's deleted again at the end.
+    pageID = board.freePage()
+    if pageID != -1 and board.store(pageID) != FINGERPRINT_OK:
+        pageID = -1
+    commands = [('getImage', board.getImage),
+                ('image2Tz', lambda: board.image2Tz(1)),
+                ('search', lambda: board.search(1, 0, board.databaseCount)),
+                ('getTemplateCount', board.getTemplateCount)]
+    results = {}
+    try:
+        for name, command in commands:
+            samples = []
+            for _ in range(repeat):
+                start = time.time()
+                command()
+                samples.append(time.time() - start)
+            results[name] = _stats(samples)
+    finally:
+        if pageID != -1:
+            board.deleteChar(pageID, 1)
+    return results
+
+
+def benchThroughput(multipliers, imageMultipliers, repeat=1):
+    """ uploadImage/uploadChar throughput for every package size and baud multiplier
+    Replies are throttled to the simulated baud rate, so these numbers include
+    the time spent on the wire as well as the host side overhead.
+    """
+    results = []
+    for multiplier in multipliers:
+        for packageSize in range(len(ZFM20x.packageSizeDict)):
+            sim, board = _simulatedBoard(throttle=True, baudMultiplier=multiplier, packageSize=packageSize)
+            transfers = [('uploadChar', lambda: board.uploadChar(1), ZFM20x.chrBufferSize)]
+            if multiplier in imageMultipliers:
+                transfers.append(('uploadImage', board.uploadImage, ZFM20x.imgBufferSize))
+                transfers.append(('uploadImageInto', board.uploadImageInto, ZFM20x.imgBufferSize))
+            for name, transfer, size in transfers:
+                samples = []
+                for _ in range(repeat):
+                    start = time.time()
+                    transfer()
+                    samples.append(time.time() - start)
+                elapsed = min(samples)
+                results.append({'name': name,
+                                'baudrate': multiplier * 9600,
+                                'packageSize': ZFM20x.packageSizeDict[packageSize],
+                                'seconds': elapsed,
+                                'bytesPerSecond': size / elapsed})
+    return results
+
+
+def benchCodec(packets=2000):
+    """ Host CPU seconds per byte spent encoding and decoding packets"""
+    results = {}
+    for packageSize in ZFM20x.packageSizeDict:
+        payload = bytearray(range(256))[:packageSize]
+        transport = FramedTransport(_ReplayPort())
+        start = cpuTime()
+        for _ in range(packets):
+            transport.writePacket(FINGERPRINT_DATAPACKET, payload)
+        written = cpuTime() - start
+        frame = transport.encode(FINGERPRINT_DATAPACKET, payload)
+        transport.port = _ReplayPort(bytes(frame) * packets)
+        start = cpuTime()
+        for _ in range(packets):
+            transport.readPacket()
+        read = cpuTime() - start
+        total = float(len(frame) * packets)
+        results[str(packageSize)] = {'writePacket': written / total, 'getReply': read / total}
+    return results
+
+
+def runAll(args):
+    results = {'meta': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'time': time.time()}}
+    if args.port:
+        board = ZFM20x(args.port, baudrate=args.baudrate)
+        results['latency'] = benchLatency(board, repeat=args.repeat)
+        board.exit()
+    else:
+        latency = ZFM20xSimulator.typicalLatency if args.typical else None
+        sim, board = _simulatedBoard(latency=latency, throttle=args.typical)
+        results['latency'] = benchLatency(board, sim, repeat=args.repeat)
+        multipliers = range(1, 13)
+        imageMultipliers = multipliers if args.full else [6, 12]
+        results['throughput'] = benchThroughput(multipliers, imageMultipliers)
+    results['codec'] = benchCodec()
+    return results
+
+
+def _flatten(results):
+    """ Map every timing in results to a 'section/name/...' key"""
+    flat = {}
+    for name, stats in results.get('latency', {}).items():
+        flat['latency/%s' % name] = stats['median']
+    for entry in results.get('throughput', []):
+        flat['throughput/%s/%d/%d' % (entry['name'], entry['baudrate'], entry['packageSize'])] = entry['seconds']
+    for size, codec in results.get('codec', {}).items():
+        for name, value in codec.items():
+            flat['codec/%s/%s' % (size, name)] = value
+    return flat
+
+
+def compare(baseline, results, tolerance):
+    """ List the timings in results that are slower than baseline by more than tolerance"""
+    old = _flatten(baseline)
+    new = _flatten(results)
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if old[key] > 0 and new[key] > old[key] * (1 + tolerance):
+            regressions.append({'name': key, 'baseline': old[key], 'current': new[key]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ZFM20x library')
+    parser.add_argument('--port', help='Benchmark a real sensor on this port instead of the simulator')
+    parser.add_argument('--baudrate', type=int, default=57600)
+    parser.add_argument('--repeat', type=int, default=50, help='Samples per latency measurement')
+    parser.add_argument('--typical', action='store_true',
+                        help='Give the simulator the latency and baud rate limits of a real module')
+    parser.add_argument('--full', action='store_true', help='Benchmark image uploads at every baud rate')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    parser.add_argument('--compare', help='Baseline results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = runAll(args)
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            results['regressions'] = compare(json.load(f), results, args.tolerance)
+        status = 1 if results['regressions'] else 0
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
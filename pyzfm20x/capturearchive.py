@@ -0,0 +1,219 @@
+""" Append-only archive of raw finger images (Python 3)
+
+A CaptureArchive keeps every uploaded image as a fixed size record of
+imgBufferSize packed bytes, with a separate fixed size index of metadata
+(device, time, search result), so millions of captures can be scanned
+without opening a file per image:
+
+    with CaptureArchive('door.zfmc') as archive:
+        archive.appendUpload(board, board.searchFinger())
+    ...
+    with CaptureArchive('door.zfmc', readOnly=True) as archive:
+        for record, image in archive.iterRange(since=yesterday):
+            analyse(record.device, unpackImage(image))
+
+Images are served as memoryviews of a memory map of the data file, nothing
+is copied until they are decoded. asArray maps a range of images as one
+numpy array for bulk analysis.
+
+Files (little endian): 'name' holds a 16 byte header (magic 'ZFMC', format
+version, record size) followed by the images, 'name.idx' a 16 byte header
+(magic 'ZFMI', format version, record size) followed by one 64 byte record
+per image:
+
+    time (8 double) | crc32 of the image (4) | pageID (4, -1 if none) |
+    matchScore (2) | ack (1) | pad (1) | device (32, utf-8, zero padded) |
+    reserved (12)
+
+Records are only ever appended, the image is written before its index
+record so a crash can't leave an index record without its image.
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+from .commands import *
+from .pyzfm20x import ZFM20x
+
+
+class CaptureRecord(namedtuple('CaptureRecord', 'index time crc pageID matchScore ack device')):
+    """Metadata of one archived image"""
+    __slots__ = ()
+
+
+class CaptureArchive(object):
+    """Append-only, memory-mapped archive of raw images with a metadata index"""
+
+    dataMagic = b'ZFMC'
+    indexMagic = b'ZFMI'
+    formatVersion = 1
+    imageSize = ZFM20x.imgBufferSize
+    deviceSize = 32
+
+    _header = struct.Struct('<4sHxxI4x')
+    _record = struct.Struct('<dIiHBx32s12x')
+
+    def __init__(self, filename, readOnly=False):
+        """ Open the archive at filename (and filename.idx), creating it unless readOnly"""
+        self.filename = filename
+        self.indexFilename = filename + '.idx'
+        self.readOnly = readOnly
+        mode = 'rb' if readOnly else 'a+b'
+        if not readOnly and not os.path.exists(filename):
+            with open(filename, 'wb') as f:
+                f.write(self._header.pack(self.dataMagic, self.formatVersion, self.imageSize))
+            with open(self.indexFilename, 'wb') as f:
+                f.write(self._header.pack(self.indexMagic, self.formatVersion, self._record.size))
+        self._data = open(filename, mode)
+        self._index = open(self.indexFilename, mode)
+        self._check(self._data, self.dataMagic, self.imageSize)
+        self._check(self._index, self.indexMagic, self._record.size)
+        # Only whole records count, an image without its index record is dropped
+        images = (os.fstat(self._data.fileno()).st_size - self._header.size) // self.imageSize
+        records = (os.fstat(self._index.fileno()).st_size - self._header.size) // self._record.size
+        self._count = min(images, records)
+        if not readOnly:
+            self._data.truncate(self._header.size + self._count * self.imageSize)
+            self._index.truncate(self._header.size + self._count * self._record.size)
+        self._dataMap = self._indexMap = None
+        self._mapped = 0
+        self._scratch = None
+
+    def _check(self, f, magic, recordSize):
+        f.seek(0)
+        header = f.read(self._header.size)
+        if len(header) < self._header.size or self._header.unpack(header) != (magic, self.formatVersion, recordSize):
+            self.close()
+            raise ValueError('%s is not a version %d capture archive' % (f.name, self.formatVersion))
+
+    def __len__(self):
+        return self._count
+
+    ### Writing
+    def append(self, image, device='', pageID=-1, matchScore=0, ack=FINGERPRINT_OK, timestamp=None):
+        """ Archive one packed image (imgBufferSize bytes), returns its index"""
+        if self.readOnly:
+            raise IOError('%s is open read only' % self.filename)
+        if len(image) != self.imageSize:
+            raise ValueError('An image must be %d bytes' % self.imageSize)
+        if timestamp is None:
+            timestamp = time.time()
+        self._data.write(image)
+        self._data.flush()
+        self._index.write(self._record.pack(timestamp, zlib.crc32(image) & 0xFFFFFFFF, pageID, matchScore,
+                                            ack, device.encode('utf-8')[:self.deviceSize]))
+        self._index.flush()
+        self._count += 1
+        return self._count - 1
+
+    def appendUpload(self, board, result=None):
+        """ Upload the image in board's ImageBuffer and archive it
+        result is the SearchResult of that image, if it was searched. Returns
+        the index of the new record, or None if the upload failed.
+        """
+        if self._scratch is None:
+            self._scratch = board.newImageBuffer()
+        ack, image = board.uploadImageInto(self._scratch)
+        if ack != FINGERPRINT_OK:
+            return None
+        if result is None:
+            return self.append(image, device=board.name)
+        return self.append(image, device=board.name, pageID=result.pageID if result.ack == FINGERPRINT_OK else -1,
+                           matchScore=result.matchScore, ack=result.ack)
+
+    ### Reading
+    def _map(self):
+        """ (Re)map both files once they grew past the current mapping"""
+        if self._mapped < self._count:
+            # Views handed out keep the old maps alive, they're closed once unused
+            self._dataMap = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            self._indexMap = mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = self._count
+
+    def _position(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('Capture %d out of range, the archive holds %d' % (index, self._count))
+        self._map()
+        return index
+
+    def image(self, index):
+        """ Read only memoryview of the packed image at index"""
+        index = self._position(index)
+        offset = self._header.size + index * self.imageSize
+        return memoryview(self._dataMap)[offset:offset + self.imageSize]
+
+    def record(self, index):
+        """ CaptureRecord of the image at index"""
+        index = self._position(index)
+        return self._unpack(index)
+
+    def _unpack(self, index):
+        timestamp, crc, pageID, matchScore, ack, device = self._record.unpack_from(
+            self._indexMap, self._header.size + index * self._record.size)
+        return CaptureRecord(index, timestamp, crc, pageID, matchScore, ack, device.rstrip(b'\0').decode('utf-8'))
+
+    def verify(self, index):
+        """ Check the image at index against its crc"""
+        return zlib.crc32(self.image(index)) & 0xFFFFFFFF == self.record(index).crc
+
+    def records(self, start=0, stop=None):
+        """ CaptureRecords of the images start to stop - 1, read from the index only"""
+        stop = self._count if stop is None else min(stop, self._count)
+        if start >= stop:
+            return
+        self._map()
+        for index in range(start, stop):
+            yield self._unpack(index)
+
+    def iterRange(self, start=0, stop=None, device=None, since=None, until=None):
+        """ Yield (CaptureRecord, image memoryview) for the images start to stop - 1
+        Only the images of device and taken between since and until (times
+        in seconds since the epoch) are yielded, filtering reads the index only.
+        """
+        for record in self.records(start, stop):
+            if device is not None and record.device != device:
+                continue
+            if since is not None and record.time < since:
+                continue
+            if until is not None and record.time >= until:
+                continue
+            yield record, self.image(record.index)
+
+    def __iter__(self):
+        return self.iterRange()
+
+    def asArray(self, start=0, stop=None):
+        """ The packed images start to stop - 1 as a read only (n, imgBufferSize) numpy array, without copying"""
+        import numpy as np
+        stop = self._count if stop is None else min(stop, self._count)
+        count = max(0, stop - start)
+        if not count:
+            return np.empty((0, self.imageSize), dtype=np.uint8)
+        self._map()
+        return np.frombuffer(self._dataMap, dtype=np.uint8, count=count * self.imageSize,
+                             offset=self._header.size + start * self.imageSize).reshape(count, self.imageSize)
+
+    ### File handling
+    def flush(self):
+        if not self.readOnly:
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self._index.flush()
+            os.fsync(self._index.fileno())
+
+    def close(self):
+        self._dataMap = self._indexMap = None
+        for f in (getattr(self, '_data', None), getattr(self, '_index', None)):
+            if f is not None and not f.closed:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
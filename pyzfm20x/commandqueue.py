@@ -0,0 +1,225 @@
+""" Share one ZFM20x between threads through a prioritized command queue
+
+A ZFM20x must only be used from one thread at a time: two threads sending
+commands at once interleave their packets and corrupt the stream. A
+CommandQueue owns the board and runs every command on a single I/O thread,
+other threads submit commands and get futures back:
+
+    commands = CommandQueue(board)
+    count = commands.getTemplateCount().result().count
+    hit = commands.submit(lambda board: board.searchFinger(timeout=5))
+    ...
+    commands.close()
+
+Every method of the board can be called on the queue, it returns a future
+instead of the result. submit runs a function of the board, use it for
+sequences that must not be interleaved with other commands (getImage,
+image2Tz and search all share the module's buffers).
+
+Pending commands run by priority, then in submission order: identification
+(IDENTIFY) before everything else (NORMAL) before maintenance traffic such
+as template export or notepad writes (MAINTENANCE). A running command is
+never interrupted, so maintenance jobs should be submitted as short steps
+(one template at a time) rather than as one long function, letting
+identification through between them.
+"""
+import itertools
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
+
+IDENTIFY = 0
+NORMAL = 1
+MAINTENANCE = 2
+
+# Default priority of the board methods, anything else is NORMAL
+commandPriorities = {'getImage': IDENTIFY,
+                     'image2Tz': IDENTIFY,
+                     'match': IDENTIFY,
+                     'search': IDENTIFY,
+                     'highSpeedSearch': IDENTIFY,
+                     'searchFinger': IDENTIFY,
+                     'fingerPresent': IDENTIFY,
+                     'fingerFound': IDENTIFY,
+                     'uploadChar': MAINTENANCE,
+                     'uploadCharInto': MAINTENANCE,
+                     'downloadChar': MAINTENANCE,
+                     'uploadImage': MAINTENANCE,
+                     'uploadImageInto': MAINTENANCE,
+                     'downloadImage': MAINTENANCE,
+                     'readContList': MAINTENANCE,
+                     'loadOccupancy': MAINTENANCE,
+                     'writeNotepad': MAINTENANCE,
+                     'readNotepad': MAINTENANCE}
+
+
+if Future is None:
+    class Future(object):
+        """The part of concurrent.futures.Future used here, for Python 2 without the futures backport"""
+
+        def __init__(self):
+            self._done = threading.Event()
+            self._lock = threading.Lock()
+            self._state = 'pending'
+            self._result = None
+            self._exception = None
+            self._callbacks = []
+
+        def cancel(self):
+            with self._lock:
+                if self._state != 'pending':
+                    return self._state == 'cancelled'
+                self._state = 'cancelled'
+            self._finish()
+            return True
+
+        def cancelled(self):
+            return self._state == 'cancelled'
+
+        def running(self):
+            return self._state == 'running'
+
+        def done(self):
+            return self._done.is_set()
+
+        def set_running_or_notify_cancel(self):
+            with self._lock:
+                if self._state == 'cancelled':
+                    return False
+                self._state = 'running'
+                return True
+
+        def set_result(self, result):
+            self._result = result
+            self._state = 'finished'
+            self._finish()
+
+        def set_exception(self, exception):
+            self._exception = exception
+            self._state = 'finished'
+            self._finish()
+
+        def _finish(self):
+            self._done.set()
+            for callback in self._callbacks:
+                callback(self)
+
+        def add_done_callback(self, callback):
+            with self._lock:
+                if not self._done.is_set():
+                    self._callbacks.append(callback)
+                    return
+            callback(self)
+
+        def exception(self, timeout=None):
+            if not self._done.wait(timeout):
+                raise queue.Empty('Command still pending after %s seconds' % timeout)
+            if self._state == 'cancelled':
+                raise RuntimeError('Command cancelled')
+            return self._exception
+
+        def result(self, timeout=None):
+            exception = self.exception(timeout)
+            if exception is not None:
+                raise exception
+            return self._result
+
+
+class CommandQueue(object):
+    """Runs the commands of one board, submitted from any thread, on a single I/O thread"""
+
+    def __init__(self, board, priorities=None):
+        """ priorities overrides commandPriorities, by method name"""
+        self.board = board
+        self.priorities = dict(commandPriorities)
+        if priorities:
+            self.priorities.update(priorities)
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._closed = False
+        self._closeLock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='zfm20x-commands-%s' % board.name)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, function, *args, **kwargs):
+        """ Run function(board, *args, **kwargs) on the I/O thread at NORMAL priority, returns a future"""
+        return self.submitAt(NORMAL, function, *args, **kwargs)
+
+    def submitAt(self, priority, function, *args, **kwargs):
+        """ Run function(board, *args, **kwargs) on the I/O thread at priority, returns a future"""
+        future = Future()
+        with self._closeLock:
+            if self._closed:
+                raise RuntimeError('%s command queue is closed' % self.board.name)
+            self._queue.put((priority, next(self._sequence), future, function, args, kwargs))
+        return future
+
+    def call(self, method, *args, **kwargs):
+        """ Call board method (by name) on the I/O thread at its priority, returns a future"""
+        function = getattr(type(self.board), method)
+        return self.submitAt(self.priorities.get(method, NORMAL), function, *args, **kwargs)
+
+    def __getattr__(self, method):
+        # Looked up on the class: a property (info, databaseCount) read here
+        # would talk to the board outside of the I/O thread
+        board = self.__dict__.get('board')
+        if method.startswith('_') or not callable(getattr(type(board), method, None)):
+            raise AttributeError(method)
+
+        def command(*args, **kwargs):
+            return self.call(method, *args, **kwargs)
+        command.__name__ = method
+        return command
+
+    def pending(self):
+        """ Number of commands waiting for the I/O thread"""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            priority, sequence, future, function, args, kwargs = self._queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(self.board, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def close(self, cancelPending=False, wait=True):
+        """ Stop accepting commands and stop the I/O thread once the pending ones ran
+        With cancelPending the commands that didn't start yet are cancelled
+        instead. The board itself stays open.
+        """
+        with self._closeLock:
+            if not self._closed:
+                self._closed = True
+                if cancelPending:
+                    while True:
+                        try:
+                            entry = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        entry[2].cancel()
+                # After every other entry, whatever its priority
+                self._queue.put((float('inf'), next(self._sequence), None, None, None, None))
+        if wait and threading.current_thread() is not self._worker:
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -56,3 +56,8 @@ FINGERPRINT_READNOTE = 0x19
 FINGERPRINT_HISPEEDSEARCH = 0x1B
 FINGERPRINT_TEMPLATECOUNT = 0x1D
 FINGERPRINT_READCONTLIST = 0x1F
+
+# System parameters (setSystemParameter)
+FINGERPRINT_PARAM_BAUDRATE = 4
+FINGERPRINT_PARAM_SECURITYLEVEL = 5
+FINGERPRINT_PARAM_PACKAGESIZE = 6
@@ -0,0 +1,356 @@
+""" Share one open sensor between processes through a local daemon
+
+The daemon opens the sensor once (handshake and verifyPassword included) and
+serves its commands over a Unix socket. Every command from every client goes
+through one CommandQueue, so clients never interleave on the wire and
+identification runs before pending admin traffic:
+
+    python -m pyzfm20x.daemon --port /dev/ttyUSB0 --socket /run/zfm20x.sock
+
+SensorClient has the method surface of ZFM20x and returns the same results,
+each call is one round trip on an already open connection:
+
+    board = SensorClient('/run/zfm20x.sock')
+    print(board.getTemplateCount().count)
+    result = board.searchFinger(timeout=5)
+
+Protocol: every message is a 4 byte little endian length followed by the
+body. A request body is the method number (1 byte, its index in
+daemonMethods), the positional arguments and the keyword arguments. A reply
+body is a status byte (0 for a result, 1 for an error) and the result, or
+the error class name and message. Values are tagged with one byte:
+
+    n None | t True | f False | i int (8) | d double (8) | s utf-8 text |
+    b bytes | l list | m dict | r result (type name, fields)
+
+Text and bytes carry a 4 byte length, lists and dicts a 4 byte count.
+"""
+import argparse
+import numbers
+import os
+import socket
+import struct
+import sys
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .commandqueue import CommandQueue
+from .commands import *
+from .pyzfm20x import ZFM20x
+from . import results
+from .transport import FrameError, TransportTimeout
+
+# Methods served by the daemon, a request names them by index
+daemonMethods = ('verifyPassword', 'setPassword', 'setAddress', 'setSystemParameter', 'readSystemParameters',
+                 'getSystemParameters', 'readContList', 'loadOccupancy', 'freePage', 'occupiedCount',
+                 'getTemplateCount', 'getHWinfo', 'getImage', 'uploadImageInto', 'downloadImage', 'image2Tz',
+                 'createModel', 'uploadCharInto', 'downloadChar', 'store', 'loadChar', 'deleteChar', 'empty',
+                 'match', 'search', 'highSpeedSearch', 'getRandomCode', 'writeNotepad', 'readNotepad',
+                 'searchFinger', 'fingerPresent', 'fingerFound', 'fingerEnroll', 'invalidateInfo', 'info')
+_methodCodes = dict((name, code) for code, name in enumerate(daemonMethods))
+
+# Result types rebuilt by the client, by name
+_resultTypes = dict((cls.__name__, cls) for cls in (results.SearchResult, results.ShardSearchResult,
+                                                    results.MatchResult, results.CountResult,
+                                                    results.AddressResult, results.RandomCodeResult,
+                                                    results.DataResult, results.SystemParameters,
+                                                    results.HWInfo))
+# Errors raised again by the client with their own type
+_errorTypes = {'FrameError': FrameError, 'TransportTimeout': TransportTimeout, 'ValueError': ValueError}
+
+_length = struct.Struct('<I')
+_int = struct.Struct('<q')
+_double = struct.Struct('<d')
+# On Python 2 str is bytes, only unicode is sent as text
+_textType = type(u'')
+
+
+class DaemonError(IOError):
+    """An error raised by the daemon while running a command"""
+    pass
+
+
+def _encode(value, out):
+    """ Append the tagged encoding of value to bytearray out"""
+    if value is None:
+        out += b'n'
+    elif value is True:
+        out += b't'
+    elif value is False:
+        out += b'f'
+    elif isinstance(value, numbers.Integral):
+        out += b'i'
+        out += _int.pack(value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += _double.pack(value)
+    elif isinstance(value, _textType):
+        data = value.encode('utf-8')
+        out += b's'
+        out += _length.pack(len(data))
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out += b'b'
+        out += _length.pack(len(value))
+        out += value
+    elif isinstance(value, tuple) and type(value).__name__ in _resultTypes:
+        out += b'r'
+        _encode(type(value).__name__, out)
+        _encode(list(value), out)
+    elif isinstance(value, (list, tuple)):
+        out += b'l'
+        out += _length.pack(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out += b'm'
+        out += _length.pack(len(value))
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    else:
+        raise ValueError('Can not send a %s to the daemon' % type(value).__name__)
+    return out
+
+
+def _decode(data, offset=0):
+    """ Decode the value at offset, returns it and the offset after it"""
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'n':
+        return None, offset
+    if tag == b't':
+        return True, offset
+    if tag == b'f':
+        return False, offset
+    if tag == b'i':
+        return _int.unpack_from(data, offset)[0], offset + _int.size
+    if tag == b'd':
+        return _double.unpack_from(data, offset)[0], offset + _double.size
+    if tag in (b's', b'b', b'l', b'm'):
+        size = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        if tag == b's':
+            return bytes(data[offset:offset + size]).decode('utf-8'), offset + size
+        if tag == b'b':
+            return bytes(data[offset:offset + size]), offset + size
+        items = []
+        for _ in range(size * 2 if tag == b'm' else size):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        if tag == b'm':
+            return dict(zip(items[::2], items[1::2])), offset
+        return items, offset
+    if tag == b'r':
+        name, offset = _decode(data, offset)
+        fields, offset = _decode(data, offset)
+        return _resultTypes[name](*fields), offset
+    raise ValueError('Unknown value tag %r from the daemon' % tag)
+
+
+def _readMessage(sock):
+    """ Read one length prefixed message, None when the peer closed the connection"""
+    header = _recvExactly(sock, _length.size)
+    if header is None:
+        return None
+    body = _recvExactly(sock, _length.unpack(header)[0])
+    if body is None:
+        raise IOError('Connection closed in the middle of a message')
+    return body
+
+
+def _recvExactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _sendMessage(sock, body):
+    sock.sendall(bytes(_length.pack(len(body)) + body))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection, one at a time"""
+
+    def handle(self):
+        daemon = self.server.daemon
+        while True:
+            request = _readMessage(self.request)
+            if request is None:
+                return
+            reply = bytearray()
+            try:
+                method = daemonMethods[request[0]]
+                args, offset = _decode(request, 1)
+                kwargs, offset = _decode(request, offset)
+                result = daemon.call(method, args, kwargs)
+                reply += b'\x00'
+                _encode(result, reply)
+            except Exception as e:
+                reply = bytearray(b'\x01')
+                _encode(type(e).__name__, reply)
+                _encode(str(e), reply)
+            _sendMessage(self.request, reply)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SensorDaemon(object):
+    """Serves one board to local clients over a Unix socket"""
+
+    def __init__(self, board, path, mode=0o660):
+        """ The socket is created at path (a stale one is replaced) with permissions mode"""
+        self.board = board
+        self.path = path
+        self.commands = CommandQueue(board)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = _Server(path, _Handler)
+        self.server.daemon = self
+        os.chmod(path, mode)
+
+    def call(self, method, args, kwargs):
+        """ Run a board method on the command queue and wait for its result"""
+        if method == 'info':
+            return self.commands.submit(lambda board: dict(board.info)).result()
+        return self.commands.call(method, *args, **kwargs).result()
+
+    def serveForever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """ Serve from a background thread"""
+        thread = threading.Thread(target=self.serveForever, name='zfm20x-daemon')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self):
+        """ Stop serving, let the pending commands finish and remove the socket"""
+        self.server.shutdown()
+        self.server.server_close()
+        self.commands.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class SensorClient(object):
+    """ZFM20x look-alike that runs every command on a SensorDaemon
+
+    The connection is shared by the threads using the client, one command
+    at a time. Char and image buffers given to uploadCharInto and
+    uploadImageInto are filled in locally from the reply.
+    """
+
+    imgBufferSize = ZFM20x.imgBufferSize
+    chrBufferSize = ZFM20x.chrBufferSize
+
+    def __init__(self, path, timeout=None):
+        """ timeout is the socket timeout in seconds, None waits as long as the command takes"""
+        self.path = path
+        self.name = 'daemon://%s' % path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._lock = threading.Lock()
+        self._info = None
+
+    def call(self, method, *args, **kwargs):
+        """ Run a board method on the daemon and return its result"""
+        request = bytearray([_methodCodes[method]])
+        _encode(list(args), request)
+        _encode(kwargs, request)
+        with self._lock:
+            _sendMessage(self.sock, request)
+            reply = _readMessage(self.sock)
+        if reply is None:
+            raise IOError('%s closed the connection' % self.path)
+        value, offset = _decode(reply, 1)
+        if reply[0] == 0:
+            return value
+        message = _decode(reply, offset)[0]
+        raise _errorTypes.get(value, DaemonError)('%s on the daemon: %s' % (value, message))
+
+    def __getattr__(self, method):
+        if method not in _methodCodes:
+            raise AttributeError(method)
+
+        def command(*args, **kwargs):
+            return self.call(method, *args, **kwargs)
+        command.__name__ = method
+        return command
+
+    @property
+    def info(self):
+        """ Device info of the daemon's board, fetched once"""
+        if self._info is None:
+            self._info = self.call('info')
+        return self._info
+
+    @property
+    def databaseCount(self):
+        return self.info['fingerDatabase']
+
+    def newImageBuffer(self):
+        return bytearray(self.imgBufferSize)
+
+    def _into(self, result, buf):
+        if buf is None or result.data is None:
+            return result
+        buf[:len(result.data)] = result.data
+        return results.DataResult(result.ack, buf)
+
+    def uploadImageInto(self, imgBuffer=None):
+        return self._into(self.call('uploadImageInto'), imgBuffer)
+
+    def uploadCharInto(self, bufferID, chrBuffer=None):
+        return self._into(self.call('uploadCharInto', bufferID), chrBuffer)
+
+    def exit(self):
+        """ Close the connection, the daemon keeps the sensor open"""
+        self.sock.close()
+
+    close = exit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a ZFM20x sensor to local clients over a Unix socket')
+    parser.add_argument('--port', required=True, help='Serial port of the sensor')
+    parser.add_argument('--socket', required=True, help='Path of the Unix socket to create')
+    parser.add_argument('--baudrate', type=int, default=57600)
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=0xFFFFFFFF)
+    parser.add_argument('--password', type=lambda value: int(value, 0), default=0x00000000)
+    parser.add_argument('--timeout', type=float, default=2.0, help='Serial read timeout in seconds')
+    parser.add_argument('--mode', type=lambda value: int(value, 8), default=0o660,
+                        help='Permissions of the socket, in octal')
+    args = parser.parse_args(argv)
+
+    board = ZFM20x(args.port, baudrate=args.baudrate, address=args.address, password=args.password,
+                   timeout=args.timeout)
+    ack = board.verifyPassword(args.password)
+    if ack != FINGERPRINT_OK:
+        print('%s rejected the password (confirmation code %d)' % (args.port, ack))
+        return 1
+    daemon = SensorDaemon(board, args.socket, args.mode)
+    try:
+        daemon.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        board.exit()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+""" Finger detection with adaptive polling
+
+The module can only tell whether a finger is on the sensor by trying to
+capture an image (getImage), so detection means polling. FingerDetector
+polls fast right after something happened and backs off exponentially
+while the sensor sits idle, so an idle reader costs a few commands per
+second instead of a busy loop:
+
+    detector = FingerDetector(board, onPlaced=greet, onRemoved=bye)
+    if detector.waitPlaced(timeout=10):
+        board.searchFinger()
+
+Whenever a finger is reported as placed its image is already in the
+module's ImageBuffer, ready for image2Tz.
+"""
+import threading
+import time
+
+from .commands import *
+
+
+class FingerDetector(object):
+    """Tracks finger presence on one sensor"""
+
+    def __init__(self, board, fastInterval=0.02, idleInterval=0.5, backoff=1.5,
+                 onPlaced=None, onRemoved=None):
+        """
+        The poll interval starts at fastInterval after every change and grows
+        by backoff on every quiet poll, up to idleInterval. onPlaced(board) and
+        onRemoved(board) are called on every change.
+        """
+        self.board = board
+        self.fastInterval = fastInterval
+        self.idleInterval = idleInterval
+        self.backoff = backoff
+        self.onPlaced = onPlaced
+        self.onRemoved = onRemoved
+        self.present = False
+        self.interval = fastInterval
+        self.lastChange = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def activity(self):
+        """ Go back to fast polling, e.g. after prompting the user"""
+        self.interval = self.fastInterval
+
+    def poll(self):
+        """ Check the sensor once, firing the callbacks if the finger came or went"""
+        present = self.board.getImage() == FINGERPRINT_OK
+        if present != self.present:
+            self.present = present
+            self.lastChange = time.time()
+            self.interval = self.fastInterval
+            callback = self.onPlaced if present else self.onRemoved
+            if callback is not None:
+                callback(self.board)
+        else:
+            self.interval = min(self.interval * self.backoff, self.idleInterval)
+        return present
+
+    def waitFor(self, present, timeout=None):
+        """ Poll until the finger is present (or gone), False if timeout seconds pass first"""
+        deadline = None if timeout is None else time.time() + timeout
+        self.activity()
+        while self.poll() != present:
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+        return True
+
+    def waitPlaced(self, timeout=None):
+        return self.waitFor(True, timeout)
+
+    def waitRemoved(self, timeout=None):
+        return self.waitFor(False, timeout)
+
+    ### Background watching
+    def start(self):
+        """ Keep polling in a background thread, reporting changes through the callbacks
+        The board must not be used from other threads while it runs.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='zfm20x-detector-%s' % self.board.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
@@ -0,0 +1,80 @@
+""" Cache of device info, per port and address
+
+Reading the hardware info is the slowest part of connecting to a sensor. A
+DeviceInfoCache remembers it per (port, address), in memory and optionally
+in a JSON file so short lived processes can skip the exchange entirely:
+
+    ZFM20x.infoCache = DeviceInfoCache('/var/cache/zfm20x.json')
+
+ZFM20x keeps the cache up to date when it changes the settings through
+setSystemParameter or setAddress. Call invalidate when a different sensor is
+plugged into a port.
+"""
+import json
+import os
+import tempfile
+import threading
+
+# os.rename doesn't replace an existing file on Windows, os.replace is Python 3.3+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class DeviceInfoCache(object):
+    """Device info dicts by (port, address)"""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def _key(port, address):
+        return '%s|%08x' % (port, address & 0xFFFFFFFF)
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.filename and os.path.exists(self.filename):
+                try:
+                    with open(self.filename) as f:
+                        self._entries = json.load(f)
+                except (IOError, ValueError):
+                    self._entries = {}
+        return self._entries
+
+    def _save(self):
+        if not self.filename:
+            return
+        # A temp file of its own, other processes may be saving at the same time
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)),
+                                   prefix=os.path.basename(self.filename) + '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f)
+            _replace(tmp, self.filename)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def get(self, port, address):
+        """ A copy of the cached info, or None"""
+        with self._lock:
+            info = self._load().get(self._key(port, address))
+            return dict(info) if info is not None else None
+
+    def put(self, port, address, info):
+        with self._lock:
+            self._load()[self._key(port, address)] = dict(info)
+            self._save()
+
+    def invalidate(self, port, address=None):
+        """ Forget the info of port at address, or of every address on port"""
+        with self._lock:
+            entries = self._load()
+            if address is not None:
+                entries.pop(self._key(port, address), None)
+            else:
+                prefix = '%s|' % port
+                for key in [key for key in entries if key.startswith(prefix)]:
+                    del entries[key]
+            self._save()
@@ -0,0 +1,114 @@
+""" Continuous identification on one sensor
+
+IdentificationLoop keeps polling the sensor and identifies every finger
+once per touch, with the high speed search limited to the pages that hold
+templates:
+
+    loop = IdentificationLoop(board)
+    for result in loop:
+        if result.ack == FINGERPRINT_OK:
+            openDoor(result.pageID)
+        log(result.captureTime, result.extractTime, result.searchTime)
+
+or in the background, calling onResult(result) from its thread:
+
+    loop = IdentificationLoop(board, onResult=handle)
+    loop.start()
+
+Every result is an IdentifyResult with the time spent capturing the image
+(the getImage that saw the finger), extracting its features (image2Tz) and
+searching, and the page range searched. The range comes from the board's
+occupancy map (read once, then kept up to date by store, deleteChar and
+empty on this board): call refresh after templates were changed from
+somewhere else.
+"""
+import threading
+import time
+
+from .commands import *
+from .results import IdentifyResult
+
+
+class IdentificationLoop(object):
+    """Identifies every finger placed on a board"""
+
+    def __init__(self, board, onResult=None, bufferID=1):
+        """ onResult(result) is called with every IdentifyResult when running in the background"""
+        self.board = board
+        self.onResult = onResult
+        self.bufferID = bufferID
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """ Read the index table again, after templates were stored or deleted by another host"""
+        return self.board.loadOccupancy()
+
+    def identify(self, captureTime=0.0):
+        """ Identify the finger image already in ImageBuffer"""
+        board = self.board
+        started = time.time()
+        # When the finger was captured
+        captured = started - captureTime
+        ack = board.image2Tz(self.bufferID)
+        extracted = time.time()
+        if ack != FINGERPRINT_OK:
+            return IdentifyResult(ack, 0, 0, captured, captureTime, extracted - started, 0.0, 0, 0)
+        # Read once, then kept up to date by the board
+        board.getOccupancy()
+        startPage, pageNumber = board.searchRange()
+        if not pageNumber:
+            # Nothing enrolled, nothing to search
+            return IdentifyResult(FINGERPRINT_NOTFOUND, 0, 0, captured, captureTime, extracted - started, 0.0,
+                                  startPage, 0)
+        searchStarted = time.time()
+        ack, pageID, matchScore = board.highSpeedSearch(self.bufferID, startPage, pageNumber)
+        return IdentifyResult(ack, pageID, matchScore, captured, captureTime, extracted - started,
+                              time.time() - searchStarted, startPage, pageNumber)
+
+    def step(self):
+        """ Poll the sensor once, returns an IdentifyResult if a finger was just placed, None otherwise"""
+        detector = self.board.detector
+        wasPresent = detector.present
+        started = time.time()
+        present = detector.poll()
+        # Once per touch, not on every poll while the finger stays down
+        if not present or wasPresent:
+            return None
+        return self.identify(time.time() - started)
+
+    def run(self):
+        """ Yield an IdentifyResult for every touch until stop is called"""
+        while not self._stop.is_set():
+            result = self.step()
+            if result is not None:
+                yield result
+            else:
+                self._stop.wait(self.board.detector.interval)
+
+    def __iter__(self):
+        self._stop.clear()
+        return self.run()
+
+    ### Background identification
+    def start(self):
+        """ Run in a background thread, reporting results to onResult
+        The board must not be used from other threads while it runs.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='zfm20x-identify-%s' % self.board.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        for result in self.run():
+            if self.onResult is not None:
+                self.onResult(result)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
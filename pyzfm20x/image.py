@@ -0,0 +1,102 @@
+""" Finger image decoding and export
+
+The sensor sends its ImageBuffer as 4 bits per pixel, two pixels per byte with
+the high nibble first, row by row from the top left corner. An image upload is
+imgBufferSize (36864) bytes for a 256x288 image.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+IMAGE_WIDTH = 256
+IMAGE_HEIGHT = 288
+
+
+def unpackImage(payload, scale=True):
+    """ Unpack an image payload into a IMAGE_HEIGHT x IMAGE_WIDTH uint8 array
+    payload can be any buffer (bytearray, memoryview, bytes) holding the
+    image data as returned by ZFM20x.uploadImageInto. With scale the 16 grey
+    levels are stretched to 0-255, otherwise the raw 0-15 values are kept.
+    """
+    packed = np.frombuffer(payload, dtype=np.uint8, count=IMAGE_WIDTH * IMAGE_HEIGHT // 2)
+    img = np.empty((IMAGE_HEIGHT, IMAGE_WIDTH), dtype=np.uint8)
+    pixels = img.reshape(-1)
+    pixels[0::2] = packed >> 4
+    pixels[1::2] = packed & 0x0F
+    if scale:
+        img *= 17
+    return img
+
+
+def packImage(img, scaled=True):
+    """ Pack a IMAGE_HEIGHT x IMAGE_WIDTH array back into the 4 bit sensor format
+    This is the inverse of unpackImage, with scaled the values are taken
+    as 0-255 and reduced to 16 grey levels.
+    """
+    pixels = np.asarray(img, dtype=np.uint8).reshape(-1)
+    if pixels.size != IMAGE_WIDTH * IMAGE_HEIGHT:
+        raise ValueError('Expected a %dx%d image' % (IMAGE_WIDTH, IMAGE_HEIGHT))
+    if scaled:
+        pixels = pixels >> 4
+    return bytearray(((pixels[0::2] << 4) | (pixels[1::2] & 0x0F)).tobytes())
+
+
+def writeBMP(filename, img):
+    """ Write a 8 bit greyscale BMP file from an image array"""
+    img = np.asarray(img, dtype=np.uint8)
+    height, width = img.shape
+    rowSize = (width + 3) & ~3
+    palette = np.repeat(np.arange(256, dtype=np.uint8), 4).reshape(256, 4)
+    palette[:, 3] = 0
+    # BMP rows are stored bottom-up and padded to 4 bytes
+    rows = np.zeros((height, rowSize), dtype=np.uint8)
+    rows[:, :width] = img[::-1]
+    offset = 14 + 40 + palette.nbytes
+    size = offset + rows.nbytes
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<2sIHHI', b'BM', size, 0, 0, offset))
+        f.write(struct.pack('<IiiHHIIiiII', 40, width, height, 1, 8, 0, rows.nbytes, 2835, 2835, 256, 0))
+        f.write(palette.tobytes())
+        f.write(rows.tobytes())
+    return filename
+
+
+def readBMP(filename):
+    """ Read a 8 bit greyscale BMP file (as written by writeBMP) into an image array"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, _, _, _, offset = struct.unpack_from('<2sIHHI', data)
+    headerSize, width, height, _, bits, compression = struct.unpack_from('<IiiHHI', data, 14)
+    if magic != b'BM' or bits != 8 or compression != 0:
+        raise ValueError('%s is not an uncompressed 8 bit BMP file' % filename)
+    rowSize = (width + 3) & ~3
+    rows = np.frombuffer(data, dtype=np.uint8, count=rowSize * abs(height), offset=offset)
+    img = rows.reshape(abs(height), rowSize)[:, :width]
+    # Palette index to grey level, for palettes that aren't the identity
+    colors = (offset - 14 - headerSize) // 4
+    if colors:
+        palette = np.frombuffer(data, dtype=np.uint8, count=colors * 4, offset=14 + headerSize).reshape(colors, 4)
+        img = palette[:, 0][img]
+    # A positive height means the rows are stored bottom-up
+    return img[::-1] if height > 0 else img
+
+
+def _pngChunk(chunkType, data):
+    chunk = chunkType + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def writePNG(filename, img):
+    """ Write a 8 bit greyscale PNG file from an image array"""
+    img = np.asarray(img, dtype=np.uint8)
+    height, width = img.shape
+    # Every scanline starts with its filter type, 0 (None)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = img
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_pngChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        f.write(_pngChunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(_pngChunk(b'IEND', b''))
+    return filename
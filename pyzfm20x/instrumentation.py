@@ -0,0 +1,206 @@
+""" Per command latency and traffic statistics
+
+Instrumentation is off by default. Set an Instrumentation on a reader, or on
+the ZFM20x class to share one between every reader, and it records every
+command: wall latency, bytes sent and received, confirmation codes,
+retransmissions, timeouts and corrupted frames:
+
+    stats = Instrumentation()
+    ZFM20x.instrumentation = stats
+    ...
+    print(stats.snapshot()['search']['latency']['p95'])
+
+Latencies go into a fixed bucket histogram, so recording is a few additions
+and the percentiles in a snapshot are bucket upper bounds. Listeners are
+called after every command, to feed an external metrics system:
+
+    stats.addListener(lambda name, command, latency, sent, received, ack:
+                      statsd.timing('zfm20x.%s' % command, latency * 1000))
+
+When instrumentation is None the only cost is one attribute check per command.
+"""
+import bisect
+import threading
+import time
+
+from .commands import *
+from .transport import TransportTimeout
+
+commandNames = {FINGERPRINT_GETIMAGE: 'getImage',
+                FINGERPRINT_IMAGE2TZ: 'image2Tz',
+                FINGERPRINT_MATCH: 'match',
+                FINGERPRINT_SEARCH: 'search',
+                FINGERPRINT_REGMODEL: 'createModel',
+                FINGERPRINT_STORE: 'store',
+                FINGERPRINT_LOADCHAR: 'loadChar',
+                FINGERPRINT_UPCHAR: 'uploadChar',
+                FINGERPRINT_DOWNCHAR: 'downloadChar',
+                FINGERPRINT_UPIMG: 'uploadImage',
+                FINGERPRINT_DOWNIMG: 'downloadImage',
+                FINGERPRINT_DELCHAR: 'deleteChar',
+                FINGERPRINT_EMPTY: 'empty',
+                FINGERPRINT_SETSYSPARA: 'setSystemParameter',
+                FINGERPRINT_READSYSPARA: 'readSystemParameters',
+                FINGERPRINT_SETPASSWORD: 'setPassword',
+                FINGERPRINT_VERIFYPASSWORD: 'verifyPassword',
+                FINGERPRINT_GETRANDOMCODE: 'getRandomCode',
+                FINGERPRINT_SETADDR: 'setAddress',
+                FINGERPRINT_GETHWINFO: 'getHWinfo',
+                FINGERPRINT_WRITENOTE: 'writeNotepad',
+                FINGERPRINT_READNOTE: 'readNotepad',
+                FINGERPRINT_HISPEEDSEARCH: 'highSpeedSearch',
+                FINGERPRINT_TEMPLATECOUNT: 'getTemplateCount',
+                FINGERPRINT_READCONTLIST: 'readContList'}
+
+# Histogram bucket upper bounds, in seconds
+defaultBuckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class CommandStats(object):
+    """Counters and latency histogram of one command"""
+
+    __slots__ = ('count', 'failures', 'acks', 'retries', 'timeouts', 'corruptFrames',
+                 'bytesSent', 'bytesReceived', 'totalLatency', 'minLatency', 'maxLatency', 'histogram')
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.failures = 0
+        self.acks = {}
+        self.retries = 0
+        self.timeouts = 0
+        self.corruptFrames = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.totalLatency = 0.0
+        self.minLatency = None
+        self.maxLatency = 0.0
+        # One slot per bucket plus one for slower commands
+        self.histogram = [0] * (len(buckets) + 1)
+
+    def percentile(self, buckets, q):
+        """ Upper bound of the bucket holding the q-th percentile (0 to 100), None without samples"""
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= rank:
+                return buckets[i] if i < len(buckets) else self.maxLatency
+        return self.maxLatency
+
+    def asDict(self, buckets):
+        return {'count': self.count,
+                'failures': self.failures,
+                'acks': dict(self.acks),
+                'retries': self.retries,
+                'timeouts': self.timeouts,
+                'corruptFrames': self.corruptFrames,
+                'bytesSent': self.bytesSent,
+                'bytesReceived': self.bytesReceived,
+                'latency': {'total': self.totalLatency,
+                            'min': self.minLatency,
+                            'max': self.maxLatency,
+                            'mean': self.totalLatency / self.count if self.count else None,
+                            'p50': self.percentile(buckets, 50),
+                            'p95': self.percentile(buckets, 95),
+                            'p99': self.percentile(buckets, 99),
+                            'histogram': list(zip(list(buckets) + [None], self.histogram))}}
+
+
+class Instrumentation(object):
+    """Statistics of the commands sent by one or more readers"""
+
+    def __init__(self, buckets=defaultBuckets, clock=None):
+        """ buckets are the histogram upper bounds in seconds, clock the time source"""
+        self.buckets = tuple(buckets)
+        self.clock = clock or time.time
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def addListener(self, listener):
+        """ Call listener(boardName, commandName, latency, bytesSent, bytesReceived, ack) after every command
+        ack is None when the command raised. Listeners run on the thread that
+        sent the command, so they should be quick.
+        """
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        self.listeners.remove(listener)
+
+    def _get(self, command):
+        stats = self._stats.get(command)
+        if stats is None:
+            stats = self._stats[command] = CommandStats(self.buckets)
+        return stats
+
+    def call(self, board, command, operation, *args):
+        """ Run operation(*args) for command on board, recording its latency, traffic and ack"""
+        transport = board.transport
+        sent = transport.bytesSent
+        received = transport.bytesReceived
+        started = self.clock()
+        ack = None
+        try:
+            result = operation(*args)
+            ack = result.ack
+            return result
+        finally:
+            self.record(board.name, command, self.clock() - started,
+                        transport.bytesSent - sent, transport.bytesReceived - received, ack)
+
+    def record(self, boardName, command, latency, bytesSent, bytesReceived, ack):
+        """ Account one command, ack is None if it raised"""
+        with self._lock:
+            stats = self._get(command)
+            stats.count += 1
+            if ack is None:
+                stats.failures += 1
+            else:
+                stats.acks[ack] = stats.acks.get(ack, 0) + 1
+            stats.bytesSent += bytesSent
+            stats.bytesReceived += bytesReceived
+            stats.totalLatency += latency
+            if stats.minLatency is None or latency < stats.minLatency:
+                stats.minLatency = latency
+            if latency > stats.maxLatency:
+                stats.maxLatency = latency
+            stats.histogram[bisect.bisect_left(self.buckets, latency)] += 1
+        for listener in self.listeners:
+            listener(boardName, commandNames.get(command, command), latency, bytesSent, bytesReceived, ack)
+
+    def retried(self, command, error=None):
+        """ command is sent again, after error (None if the module rejected the packet)"""
+        with self._lock:
+            stats = self._get(command)
+            stats.retries += 1
+            self._error(stats, error)
+
+    def failed(self, command, error):
+        """ command gave up after error"""
+        with self._lock:
+            self._error(self._get(command), error)
+
+    @staticmethod
+    def _error(stats, error):
+        if isinstance(error, TransportTimeout):
+            stats.timeouts += 1
+        elif error is not None:
+            stats.corruptFrames += 1
+
+    def snapshot(self):
+        """ Statistics of every command seen so far, by command name"""
+        with self._lock:
+            return dict((commandNames.get(command, command), stats.asDict(self.buckets))
+                        for command, stats in self._stats.items())
+
+    def percentile(self, command, q):
+        """ q-th percentile latency of a command code, None until it was sent once"""
+        with self._lock:
+            stats = self._stats.get(command)
+            return stats.percentile(self.buckets, q) if stats is not None else None
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
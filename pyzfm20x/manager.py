@@ -0,0 +1,332 @@
+""" Run many ZFM20x sensors from a bounded pool of threads
+
+SensorManager opens a set of ports and keeps polling every device for
+fingers, identifying them against its library or running enrollments, and
+puts the results on a single event queue tagged with the device name:
+
+    manager = SensorManager({'front': '/dev/ttyUSB0', 'back': '/dev/ttyUSB1'})
+    manager.start()
+    for event in manager.iterEvents():
+        print(event)
+
+Every poll is a short task (one getImage, or one step of an enrollment) and
+ports are opened with a read timeout and no retries, so a slow or wedged
+sensor only ties up a worker for one read timeout before it is backed off.
+Degraded and offline sensors are polled by at most maxUnhealthyWorkers
+workers at a time (all but one by default), so the healthy ones are always
+served.
+"""
+import heapq
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .commands import *
+from .pyzfm20x import ZFM20x
+
+
+class SensorEvent(object):
+    """Something that happened on one sensor"""
+
+    IDENTIFIED = 'identified'
+    NOT_FOUND = 'notFound'
+    ENROLLED = 'enrolled'
+    ENROLL_FAILED = 'enrollFailed'
+    HEALTH = 'health'
+
+    __slots__ = ('name', 'kind', 'time', 'pageID', 'matchScore', 'ack', 'state', 'error')
+
+    def __init__(self, name, kind, pageID=None, matchScore=None, ack=None, state=None, error=None):
+        self.name = name
+        self.kind = kind
+        self.time = time.time()
+        self.pageID = pageID
+        self.matchScore = matchScore
+        self.ack = ack
+        self.state = state
+        self.error = error
+
+    def __repr__(self):
+        fields = ', '.join('%s=%r' % (field, getattr(self, field)) for field in self.__slots__
+                           if getattr(self, field) is not None)
+        return 'SensorEvent(%s)' % fields
+
+
+class _Enrollment(object):
+    """Enrollment of one finger, advanced one step per poll"""
+
+    # Steps, each waits for the finger to be present (True) or gone (False)
+    FIRST, REMOVE, SECOND = range(3)
+
+    def __init__(self, fingerID):
+        self.fingerID = fingerID
+        self.step = self.FIRST
+
+
+class _Device(object):
+    """A sensor and its health state, owned by whichever worker is polling it"""
+
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.board = None
+        self.state = SensorManager.CONNECTING
+        self.enrollments = []
+        self.consecutiveErrors = 0
+        self.lastError = None
+        self.lastSeen = None
+        self.polls = 0
+
+    def health(self):
+        return {'state': self.state,
+                'lastSeen': self.lastSeen,
+                'consecutiveErrors': self.consecutiveErrors,
+                'lastError': self.lastError,
+                'polls': self.polls,
+                'pendingEnrollments': len(self.enrollments)}
+
+
+class SensorManager(object):
+    """Polls a set of sensors with a bounded number of threads"""
+
+    CONNECTING = 'connecting'
+    OK = 'ok'
+    DEGRADED = 'degraded'
+    OFFLINE = 'offline'
+
+    def __init__(self, ports, baudrate=57600, maxWorkers=4, readTimeout=1.0, pollInterval=0.05,
+                 idleInterval=0.5, retryInterval=1.0, maxRetryInterval=30.0, offlineAfter=3, boardFactory=None,
+                 maxUnhealthyWorkers=None):
+        """
+        ports maps device names to ports (device names or port objects), a
+        list of ports is named after the ports themselves. Devices are polled
+        every pollInterval seconds after a finger comes or goes, backing off
+        to idleInterval while nothing happens (see FingerDetector). A device
+        is marked offline after offlineAfter consecutive errors and retried
+        with an exponential backoff from retryInterval up to maxRetryInterval.
+        boardFactory(name, port) can replace the default ZFM20x constructor.
+        maxUnhealthyWorkers bounds the workers busy with degraded or offline
+        devices, by default maxWorkers - 1 (at least 1).
+        """
+        if not isinstance(ports, dict):
+            ports = dict((getattr(port, 'port', port), port) for port in ports)
+        self.baudrate = baudrate
+        self.maxWorkers = maxWorkers
+        self.readTimeout = readTimeout
+        self.pollInterval = pollInterval
+        self.idleInterval = idleInterval
+        self.retryInterval = retryInterval
+        self.maxRetryInterval = maxRetryInterval
+        self.offlineAfter = offlineAfter
+        self.boardFactory = boardFactory or self._openBoard
+        if maxUnhealthyWorkers is None:
+            maxUnhealthyWorkers = max(1, maxWorkers - 1)
+        self.maxUnhealthyWorkers = maxUnhealthyWorkers
+        self.events = queue.Queue()
+        self.devices = dict((name, _Device(name, port)) for name, port in ports.items())
+
+        self._schedule = []
+        self._condition = threading.Condition()
+        self._workers = []
+        self._running = False
+        # Workers busy with a degraded or offline device
+        self._unhealthyBusy = 0
+
+    def _openBoard(self, name, port):
+        board = ZFM20x(port, baudrate=self.baudrate, name=name, timeout=self.readTimeout, handshake=False)
+        # A lost reply is retried on the next poll, after the backoff
+        board.retries = 0
+        board.info
+        board.detector.fastInterval = self.pollInterval
+        board.detector.idleInterval = self.idleInterval
+        return board
+
+    ### Lifecycle
+    def start(self):
+        """ Start the worker threads and begin polling every device"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            for name in self.devices:
+                heapq.heappush(self._schedule, (0, name))
+        for i in range(min(self.maxWorkers, len(self.devices)) or 1):
+            worker = threading.Thread(target=self._work, name='zfm20x-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=None):
+        """ Stop polling and close every port"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        for device in self.devices.values():
+            if device.board is not None:
+                device.board.exit()
+                device.board = None
+
+    ### Public API
+    def enroll(self, name, fingerID):
+        """ Queue an enrollment of fingerID on device name
+        The result is reported as an ENROLLED or ENROLL_FAILED event.
+        """
+        with self._condition:
+            self.devices[name].enrollments.append(_Enrollment(fingerID))
+
+    def health(self):
+        """ Health state of every device, by name"""
+        with self._condition:
+            return dict((name, device.health()) for name, device in self.devices.items())
+
+    def iterEvents(self, timeout=None):
+        """ Yield events as they arrive, stops after timeout seconds without one"""
+        while True:
+            try:
+                yield self.events.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+    ### Workers
+    def _unhealthy(self, device):
+        return device.state in (self.DEGRADED, self.OFFLINE)
+
+    def _next(self):
+        """ Take the next due device this worker may poll, returns its name and the time to wait if none"""
+        now = time.time()
+        skipped = []
+        name = None
+        while self._schedule and self._schedule[0][0] <= now:
+            entry = heapq.heappop(self._schedule)
+            if self._unhealthy(self.devices[entry[1]]) and self._unhealthyBusy >= self.maxUnhealthyWorkers:
+                # Left for a worker to finish with an unhealthy device
+                skipped.append(entry)
+                continue
+            name = entry[1]
+            break
+        for entry in skipped:
+            heapq.heappush(self._schedule, entry)
+        if name is not None:
+            return name, None
+        later = [due for due, _ in self._schedule if due > now]
+        return None, min(later) - now if later else None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                name = None
+                while self._running:
+                    name, wait = self._next()
+                    if name is not None:
+                        break
+                    self._condition.wait(wait)
+                if not self._running:
+                    return
+                device = self.devices[name]
+                unhealthy = self._unhealthy(device)
+                if unhealthy:
+                    self._unhealthyBusy += 1
+            delay = self._poll(device)
+            with self._condition:
+                if unhealthy:
+                    self._unhealthyBusy -= 1
+                heapq.heappush(self._schedule, (time.time() + delay, name))
+                # Skipped unhealthy devices may be taken now
+                self._condition.notify_all()
+
+    def _poll(self, device):
+        """ Do one short piece of work on device, returns the delay until the next one"""
+        try:
+            if device.board is None:
+                device.board = self.boardFactory(device.name, device.port)
+            if device.enrollments:
+                self._enrollStep(device)
+            else:
+                self._identifyStep(device)
+        except Exception as e:
+            return self._failed(device, e)
+        device.polls += 1
+        device.lastSeen = time.time()
+        if device.consecutiveErrors or device.state != self.OK:
+            device.consecutiveErrors = 0
+            self._setState(device, self.OK)
+        return device.board.detector.interval
+
+    def _failed(self, device, error):
+        device.consecutiveErrors += 1
+        device.lastError = repr(error)
+        if device.board is not None:
+            # The stream may be left half way through a reply
+            try:
+                device.board.sp.flushInput()
+            except Exception:
+                pass
+        if device.consecutiveErrors >= self.offlineAfter:
+            if device.board is not None:
+                try:
+                    device.board.exit()
+                except Exception:
+                    pass
+                device.board = None
+            self._setState(device, self.OFFLINE, error)
+        else:
+            self._setState(device, self.DEGRADED, error)
+        backoff = self.retryInterval * 2 ** max(0, device.consecutiveErrors - self.offlineAfter)
+        return min(backoff, self.maxRetryInterval)
+
+    def _setState(self, device, state, error=None):
+        if device.state != state:
+            device.state = state
+            self.events.put(SensorEvent(device.name, SensorEvent.HEALTH, state=state,
+                                        error=repr(error) if error is not None else None))
+
+    def _identifyStep(self, device):
+        board = device.board
+        wasPresent = board.detector.present
+        present = board.detector.poll()
+        # Identify once per touch, not on every poll while the finger stays down
+        if present and not wasPresent:
+            ack = board.image2Tz(1)
+            if ack != FINGERPRINT_OK:
+                self.events.put(SensorEvent(device.name, SensorEvent.NOT_FOUND, ack=ack))
+            else:
+                result = board.search(1, 0, board.databaseCount)
+                if result[0] == FINGERPRINT_OK:
+                    self.events.put(SensorEvent(device.name, SensorEvent.IDENTIFIED, pageID=result[1],
+                                                matchScore=result[2], ack=FINGERPRINT_OK))
+                else:
+                    self.events.put(SensorEvent(device.name, SensorEvent.NOT_FOUND, ack=result[0]))
+
+    def _enrollStep(self, device):
+        board = device.board
+        enrollment = device.enrollments[0]
+        present = board.detector.poll()
+        if enrollment.step == _Enrollment.REMOVE:
+            if not present:
+                enrollment.step = _Enrollment.SECOND
+            return
+        if not present:
+            return
+        if enrollment.step == _Enrollment.FIRST:
+            ack = board.image2Tz(1)
+            if ack == FINGERPRINT_OK:
+                enrollment.step = _Enrollment.REMOVE
+            return
+        ack = board.image2Tz(2)
+        if ack == FINGERPRINT_OK:
+            ack = board.createModel()
+        if ack == FINGERPRINT_OK:
+            ack = board.store(enrollment.fingerID)
+        with self._condition:
+            device.enrollments.pop(0)
+        if ack == FINGERPRINT_OK:
+            self.events.put(SensorEvent(device.name, SensorEvent.ENROLLED, pageID=enrollment.fingerID, ack=ack))
+        else:
+            self.events.put(SensorEvent(device.name, SensorEvent.ENROLL_FAILED, pageID=enrollment.fingerID, ack=ack))
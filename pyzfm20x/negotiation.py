@@ -0,0 +1,143 @@
+""" Link speed negotiation
+
+Bulk transfers (uploadImage, uploadChar) are bound by the baud rate and by
+the per packet overhead. negotiateLink raises the module's baud rate and data
+package size as far as the link carries them:
+
+    negotiateLink(board)
+
+Every step is checked with a handshake at the new setting and rolled back if
+it fails. The baud rate is a multiple of 9600 (system parameter 4, 1 to 12)
+and the package size one of ZFM20x.packageSizeDict (system parameter 6).
+Some modules only apply a new baud rate after a power cycle, negotiation
+then simply keeps the current rate. A module that did switch to a rate the
+cable can't carry at all may only answer again after a power cycle, so the
+baud rate goes up one step at a time from the current one and stops at the
+first step that fails: at worst the module is lost one step above the
+fastest rate that works, and LinkLost says so.
+"""
+from .commands import *
+from .transport import FrameError, TransportTimeout
+
+
+class LinkLost(IOError):
+    """Raised when the module no longer answers at any baud rate after a failed switch"""
+    pass
+
+
+def _setHostBaudrate(board, baudrate):
+    """ Reconfigure the host side of the port, dropping anything received at the old rate"""
+    board.sp.baudrate = baudrate
+    board.sp.flushInput()
+
+
+def handshake(board, timeout=0.5):
+    """ Check the link by reading the system parameters, returns them or None"""
+    try:
+        with board.deadline(timeout):
+            ack, sysPara = board.readSystemParameters()
+    except (IOError, IndexError, ValueError):
+        board.sp.flushInput()
+        return None
+    if ack != FINGERPRINT_OK:
+        return None
+    return sysPara
+
+
+def _setParameter(board, parameterNumber, content, timeout):
+    """ setSystemParameter within timeout, None if the module didn't answer"""
+    try:
+        with board.deadline(timeout):
+            return board.setSystemParameter(parameterNumber, content)
+    except (TransportTimeout, FrameError):
+        return None
+
+
+def findBaudrate(board, multipliers=range(12, 0, -1), timeout=0.5):
+    """ Find the rate the module talks at by trying every multiplier, None if it doesn't answer"""
+    for multiplier in multipliers:
+        _setHostBaudrate(board, multiplier * 9600)
+        if handshake(board, timeout) is not None:
+            board.baudrate = multiplier
+            return multiplier
+    return None
+
+
+def setBaudrate(board, multiplier, timeout=0.5):
+    """ Switch module and host to multiplier * 9600 baud
+    If the module doesn't answer at the new rate both ends go back to the old
+    one (or wherever findBaudrate finds the module), and
+    FINGERPRINT_PACKETRESPONSEFAIL is returned. LinkLost is raised if it
+    can't be found at all, with the host back on the old rate and the cached
+    device info dropped.
+    """
+    oldRate = board.sp.baudrate
+    ack = _setParameter(board, FINGERPRINT_PARAM_BAUDRATE, multiplier, timeout)
+    if ack is not None and ack != FINGERPRINT_OK:
+        return ack
+    if ack == FINGERPRINT_OK:
+        _setHostBaudrate(board, multiplier * 9600)
+        sysPara = handshake(board, timeout)
+        if sysPara is not None and sysPara.baudRate == multiplier * 9600:
+            board.baudrate = multiplier
+            return FINGERPRINT_OK
+        # Ask for the old rate, the module may still understand us
+        _setParameter(board, FINGERPRINT_PARAM_BAUDRATE, oldRate // 9600, timeout)
+
+    # Without an acknowledge the module may or may not have switched
+    _setHostBaudrate(board, oldRate)
+    if handshake(board, timeout) is not None:
+        board.baudrate = oldRate // 9600
+        return FINGERPRINT_PACKETRESPONSEFAIL
+    if findBaudrate(board, timeout=timeout) is None:
+        _setHostBaudrate(board, oldRate)
+        board.invalidateInfo()
+        raise LinkLost('%s does not answer at any baud rate since switching to %d, power cycle it'
+                       % (board.name, multiplier * 9600))
+    return FINGERPRINT_PACKETRESPONSEFAIL
+
+
+def setPackageSize(board, packageSize, timeout=0.5):
+    """ Switch the data package size (index into packageSizeDict)
+    The new size is checked with a char file upload, the old one is restored
+    if it fails.
+    """
+    oldSize = board.packageSize
+    ack = _setParameter(board, FINGERPRINT_PARAM_PACKAGESIZE, packageSize, timeout)
+    if ack is None:
+        return FINGERPRINT_PACKETRESPONSEFAIL
+    if ack != FINGERPRINT_OK:
+        return ack
+    board.packageSize = packageSize
+    try:
+        with board.deadline(timeout):
+            ok = board.uploadCharInto(1).ack == FINGERPRINT_OK
+    except (IOError, IndexError, ValueError):
+        board.sp.flushInput()
+        ok = False
+    if ok:
+        return FINGERPRINT_OK
+    _setParameter(board, FINGERPRINT_PARAM_PACKAGESIZE, oldSize, timeout)
+    board.packageSize = oldSize
+    return FINGERPRINT_PACKETRESPONSEFAIL
+
+
+def negotiateLink(board, multipliers=(1, 2, 4, 6, 8, 10, 12), packageSizes=(3, 2, 1, 0), timeout=0.5):
+    """ Raise baud rate and package size as far as they work
+    The baud rate steps up through the multipliers above the current rate
+    and stops at the first one that fails, the package size goes to the
+    largest one that works. Returns the resulting baud rate and package size
+    in bytes. LinkLost is raised if a failed step loses the module.
+    """
+    for multiplier in sorted(multipliers):
+        if multiplier * 9600 <= board.sp.baudrate:
+            continue
+        if setBaudrate(board, multiplier, timeout) != FINGERPRINT_OK:
+            break
+    current = board.packageSize
+    for packageSize in sorted(packageSizes, reverse=True):
+        if packageSize <= current:
+            break
+        if setPackageSize(board, packageSize, timeout) == FINGERPRINT_OK:
+            break
+    return {'baudrate': board.sp.baudrate, 'packageSize': board.getPackageSizeBytes()}
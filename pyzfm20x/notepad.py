@@ -0,0 +1,233 @@
+""" Key-value store in the module's notepad
+
+The notepad is 16 pages of 32 bytes of flash on the module. A NotepadStore
+keeps small settings there (site config, sync watermarks...) with a host
+side copy of the pages, so reading a field costs nothing once the store is
+loaded and changes go out in one batch:
+
+    settings = NotepadStore(board)
+    site = settings.get('site', 'default')
+    settings['watermark'] = 1234
+    settings.flush()
+
+load reads only the pages in use, flush only writes the pages whose bytes
+changed. Keys are text (up to 63 bytes), values are ints, floats, text or
+bytes (up to 255 bytes).
+
+Layout: an 8 byte header (magic 'ZN', length of the entries, crc32 of the
+entries) followed by the entries, each one a byte holding the value type
+(2 high bits) and key length (6 low bits), a byte holding the value length,
+the key and the value. Ints are stored little endian in as few bytes as
+they fit in.
+"""
+import numbers
+import struct
+import zlib
+
+from .commands import *
+
+BYTES = 0
+TEXT = 1
+INT = 2
+FLOAT = 3
+
+_header = struct.Struct('<2sHI')
+_double = struct.Struct('<d')
+magic = b'ZN'
+_textType = type(u'')
+
+
+def _encodeValue(value):
+    if isinstance(value, bool):
+        raise ValueError('Notepad values are ints, floats, text or bytes')
+    if isinstance(value, numbers.Integral):
+        size = 1
+        while not -(1 << (8 * size - 1)) <= value < 1 << (8 * size - 1):
+            size += 1
+        data = bytearray((value >> (8 * i)) & 0xFF for i in range(size))
+        return INT, data
+    if isinstance(value, float):
+        return FLOAT, bytearray(_double.pack(value))
+    if isinstance(value, _textType):
+        return TEXT, bytearray(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return BYTES, bytearray(value)
+    raise ValueError('Notepad values are ints, floats, text or bytes, not %s' % type(value).__name__)
+
+
+def _decodeValue(valueType, data):
+    if valueType == INT:
+        value = 0
+        for i, byte in enumerate(data):
+            value |= byte << (8 * i)
+        if data and data[-1] & 0x80:
+            value -= 1 << (8 * len(data))
+        return value
+    if valueType == FLOAT:
+        return _double.unpack(bytes(data))[0]
+    if valueType == TEXT:
+        return bytes(data).decode('utf-8')
+    return bytes(data)
+
+
+def encodeEntries(entries):
+    """ Encode a dict of key: value into the notepad layout"""
+    body = bytearray()
+    for key, value in sorted(entries.items()):
+        keyData = key.encode('utf-8')
+        if not 0 < len(keyData) < 64:
+            raise ValueError('Notepad keys must be 1 to 63 bytes: %r' % key)
+        valueType, data = _encodeValue(value)
+        if len(data) > 255:
+            raise ValueError('Notepad value of %r is over 255 bytes' % key)
+        body.append(valueType << 6 | len(keyData))
+        body.append(len(data))
+        body.extend(keyData)
+        body.extend(data)
+    return bytearray(_header.pack(magic, len(body), zlib.crc32(bytes(body)) & 0xFFFFFFFF)) + body
+
+
+def decodeEntries(data):
+    """ Decode the entries of a notepad image, None if it doesn't hold a store"""
+    fileMagic, length, crc = _header.unpack_from(bytes(data[:_header.size]))
+    body = data[_header.size:_header.size + length]
+    if fileMagic != magic:
+        return None
+    if len(body) != length or zlib.crc32(bytes(body)) & 0xFFFFFFFF != crc:
+        raise ValueError('The notepad store is corrupted')
+    entries = {}
+    offset = 0
+    while offset < length:
+        valueType, keySize = body[offset] >> 6, body[offset] & 0x3F
+        valueSize = body[offset + 1]
+        offset += 2
+        key = bytes(body[offset:offset + keySize]).decode('utf-8')
+        offset += keySize
+        entries[key] = _decodeValue(valueType, body[offset:offset + valueSize])
+        offset += valueSize
+    return entries
+
+
+class NotepadStore(object):
+    """Dict-like settings kept in the notepad pages of a board"""
+
+    def __init__(self, board, firstPage=0, pageCount=None):
+        """ The store uses pageCount pages (all of them by default) from firstPage on"""
+        self.board = board
+        self.pageSize = board.notepadPageSize
+        self.firstPage = firstPage
+        self.pageCount = board.notepadPages - firstPage if pageCount is None else pageCount
+        self.capacity = self.pageCount * self.pageSize
+        # Last known contents of every page on the module, None until read
+        self._pages = [None] * self.pageCount
+        self._entries = None
+        self._dirty = False
+
+    def _readPage(self, page):
+        ack, data = self.board.readNotepad(self.firstPage + page)
+        if ack != FINGERPRINT_OK:
+            raise IOError('Could not read notepad page %d (confirmation code %d)' % (self.firstPage + page, ack))
+        self._pages[page] = bytes(data)
+        return data
+
+    def load(self):
+        """ Read the store from the module, only the pages it spans
+        A notepad that doesn't hold a store yet loads as an empty store,
+        a damaged one raises ValueError (clear and flush to start over).
+        """
+        image = bytearray(self._readPage(0))
+        fileMagic, length = _header.unpack_from(bytes(image[:_header.size]))[:2]
+        if fileMagic != magic:
+            # Unformatted, the other pages hold nothing of ours
+            self._entries = {}
+            self._dirty = False
+            return self
+        length += _header.size
+        for page in range(1, min(self.pageCount, (length + self.pageSize - 1) // self.pageSize)):
+            image.extend(self._readPage(page))
+        entries = decodeEntries(image)
+        self._entries = {} if entries is None else entries
+        self._dirty = False
+        return self
+
+    def _loaded(self):
+        if self._entries is None:
+            self.load()
+        return self._entries
+
+    @property
+    def dirty(self):
+        """ Whether there are changes that weren't flushed yet"""
+        return self._dirty
+
+    def get(self, key, default=None):
+        return self._loaded().get(key, default)
+
+    def __getitem__(self, key):
+        return self._loaded()[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        del self._loaded()[key]
+        self._dirty = True
+
+    def __contains__(self, key):
+        return key in self._loaded()
+
+    def __len__(self):
+        return len(self._loaded())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self._loaded().keys())
+
+    def items(self):
+        return list(self._loaded().items())
+
+    def update(self, values):
+        entries = dict(self._loaded())
+        entries.update(values)
+        # Fail now rather than on flush when it doesn't fit
+        if len(encodeEntries(entries)) > self.capacity:
+            raise ValueError('The notepad store is full (%d bytes)' % self.capacity)
+        self._entries = entries
+        self._dirty = True
+
+    def clear(self):
+        """ Drop every entry, including a damaged store that didn't load"""
+        self._entries = {}
+        self._dirty = True
+
+    def flush(self):
+        """ Write the pages that changed since they were last read or written
+        Pages that were never read are written unless they're past the end of
+        the store. Returns the confirmation code of the first failed write.
+        """
+        if not self._dirty:
+            return FINGERPRINT_OK
+        image = encodeEntries(self._entries)
+        image.extend(bytearray(-len(image) % self.pageSize))
+        # The header goes last, so an interrupted flush fails its crc check
+        for page in list(range(1, len(image) // self.pageSize)) + [0]:
+            data = bytes(image[page * self.pageSize:(page + 1) * self.pageSize])
+            if data == self._pages[page]:
+                continue
+            ack = self.board.writeNotepad(self.firstPage + page, data)
+            if ack != FINGERPRINT_OK:
+                self._pages[page] = None
+                return ack
+            self._pages[page] = data
+        self._dirty = False
+        return FINGERPRINT_OK
+
+    def __enter__(self):
+        self._loaded()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        if excType is None:
+            self.flush()
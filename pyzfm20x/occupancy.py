@@ -0,0 +1,89 @@
+""" Host side copy of the module's index table
+
+The module keeps one bit per page of its finger library (READCONTLIST reads
+it 256 pages at a time). OccupancyMap mirrors it on the host so free pages
+can be found and templates counted without asking the module every time.
+"""
+import heapq
+
+
+class OccupancyMap(object):
+    """Bitmap of the used pages of a finger library"""
+
+    pagesPerIndex = 256
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.bitmap = bytearray((capacity + 7) // 8)
+        self.count = 0
+        # Min-heap of candidate free pages. Pages that got used since they
+        # were pushed, or pushed twice, are dropped when they reach the top.
+        self._free = list(range(capacity))
+
+    def loadIndex(self, indexPage, table):
+        """ Fill in 256 pages from one READCONTLIST table (32 bytes, LSB first)"""
+        first = indexPage * self.pagesPerIndex // 8
+        table = bytearray(table)[:len(self.bitmap) - first]
+        old = self.bitmap[first:first + len(table)]
+        self.bitmap[first:first + len(table)] = table
+        self.count += self._bits(table) - self._bits(old)
+        self._rebuildFree()
+
+    def _rebuildFree(self):
+        self._free = [pageID for pageID in range(self.capacity) if not self.isUsed(pageID)]
+
+    @staticmethod
+    def _bits(data):
+        return sum(bin(byte).count('1') for byte in data)
+
+    def isUsed(self, pageID):
+        return bool(self.bitmap[pageID >> 3] & (1 << (pageID & 7)))
+
+    def mark(self, pageID):
+        """ A template was stored at pageID"""
+        if not self.isUsed(pageID):
+            self.bitmap[pageID >> 3] |= 1 << (pageID & 7)
+            self.count += 1
+
+    def clear(self, pageID, count=1):
+        """ count templates starting at pageID were deleted"""
+        for page in range(pageID, min(pageID + count, self.capacity)):
+            if self.isUsed(page):
+                self.bitmap[page >> 3] &= ~(1 << (page & 7)) & 0xFF
+                self.count -= 1
+                heapq.heappush(self._free, page)
+
+    def clearAll(self):
+        """ The library was emptied"""
+        self.bitmap[:] = bytearray(len(self.bitmap))
+        self.count = 0
+        self._free = list(range(self.capacity))
+
+    def nextFree(self):
+        """ The lowest free page ID, or None when the library is full
+        Amortized O(log n): every entry is dropped from the candidate heap
+        once, when it comes up used or twice.
+        """
+        free = self._free
+        # A copy of the top entry is one of its children
+        while free and (self.isUsed(free[0]) or free[0] in free[1:3]):
+            heapq.heappop(free)
+        return free[0] if free else None
+
+    def span(self):
+        """ (startPage, pageNumber) of the smallest page range holding every template, (0, 0) if none"""
+        bitmap = self.bitmap
+        first = next((i for i in range(len(bitmap)) if bitmap[i]), None)
+        if first is None:
+            return 0, 0
+        last = next(i for i in range(len(bitmap) - 1, -1, -1) if bitmap[i])
+        startPage = first * 8 + (bitmap[first] & -bitmap[first]).bit_length() - 1
+        endPage = last * 8 + bitmap[last].bit_length()
+        return startPage, endPage - startPage
+
+    def usedPages(self):
+        """ Page IDs holding a template, in order"""
+        return [pageID for pageID in range(self.capacity) if self.isUsed(pageID)]
+
+    def __len__(self):
+        return self.count
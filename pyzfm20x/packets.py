@@ -0,0 +1,118 @@
+""" Packets sent to and replies read from the module
+
+Commands are packed and replies decoded with precompiled struct layouts
+instead of building and indexing lists of ints:
+
+    packet = Packet.command(COMMAND_SEARCH, FINGERPRINT_SEARCH, 1, 0, 1000)
+    reply = Reply(frame)
+    if reply.ok:
+        ack, pageID, matchScore = reply.unpack(SEARCH_HIT)
+
+A Reply only keeps a reference to the frame it was read into, every field is
+decoded when asked for. It can still be indexed like the frame itself.
+"""
+import struct
+
+from .commands import *
+
+# Command payloads: instruction code followed by its parameters
+COMMAND = struct.Struct('>B')
+COMMAND_BYTE = struct.Struct('>BB')         # image2Tz, upChar, readNotepad...
+COMMAND_WORD = struct.Struct('>BI')         # verifyPassword, setPassword, setAddress
+COMMAND_PARAMETER = struct.Struct('>BBB')   # setSystemParameter
+COMMAND_PAGE = struct.Struct('>BBH')        # store, loadChar
+COMMAND_RANGE = struct.Struct('>BHH')       # deleteChar
+COMMAND_SEARCH = struct.Struct('>BBHH')     # search, highSpeedSearch
+COMMAND_NOTEPAD = struct.Struct('>BB32s')   # writeNotepad, data is zero padded
+
+# Reply data: the confirmation code and what follows it
+SEARCH_HIT = struct.Struct('>BHH')
+CODE_WORD = struct.Struct('>BH')
+CODE_DWORD = struct.Struct('>BI')
+SYSTEM_PARAMETERS = struct.Struct('>xHHHHIHH')
+# First data packet after the getHWinfo acknowledge, from offset 13 of the frame
+HW_INFO = struct.Struct('>HHIHH12x8s8s8s8s')
+
+
+class Packet(object):
+    """A packet to send: packet id and payload"""
+
+    __slots__ = ('packetType', 'payload')
+
+    def __init__(self, packetType, payload):
+        self.packetType = packetType
+        self.payload = payload
+
+    @classmethod
+    def command(cls, layout, *values):
+        """ A command packet with its payload packed by layout"""
+        return cls(FINGERPRINT_COMMANDPACKET, layout.pack(*values))
+
+    def __repr__(self):
+        return 'Packet(0x%02x, %r)' % (self.packetType, bytes(self.payload))
+
+
+class Reply(object):
+    """A frame read from the module"""
+
+    __slots__ = ('frame',)
+
+    header = struct.Struct('>HIBH')
+    checksumLayout = struct.Struct('>H')
+    dataOffset = 10
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    @property
+    def packetType(self):
+        return self.frame[6]
+
+    @property
+    def address(self):
+        return self.header.unpack_from(self.frame)[1]
+
+    @property
+    def length(self):
+        return self.header.unpack_from(self.frame)[3]
+
+    @property
+    def payload(self):
+        """ Packet data without header and checksum, as a memoryview of the frame"""
+        return memoryview(self.frame)[9:-2]
+
+    @property
+    def checksum(self):
+        return self.checksumLayout.unpack_from(self.frame, len(self.frame) - 2)[0]
+
+    @property
+    def ack(self):
+        """ Confirmation code, FINGERPRINT_OK only if it comes in an acknowledge packet"""
+        code = self.frame[9]
+        if code == FINGERPRINT_OK and self.frame[6] != FINGERPRINT_ACKPACKET:
+            return FINGERPRINT_PACKETRECIEVEERR
+        return code
+
+    @property
+    def ok(self):
+        return self.frame[6] == FINGERPRINT_ACKPACKET and self.frame[9] == FINGERPRINT_OK
+
+    def unpack(self, layout):
+        """ Decode the confirmation code and the data that follows it"""
+        return layout.unpack_from(self.frame, 9)
+
+    def data(self, size):
+        """ size bytes of data after the confirmation code"""
+        return self.frame[self.dataOffset:self.dataOffset + size]
+
+    def __getitem__(self, index):
+        return self.frame[index]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __iter__(self):
+        return iter(self.frame)
+
+    def __repr__(self):
+        return 'Reply(0x%02x, %r)' % (self.frame[6], bytes(self.frame[9:-2]))
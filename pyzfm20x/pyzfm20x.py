@@ -1,32 +1,138 @@
-import serial
-from commands import *
+import contextlib
+import time
+
+from .commands import *
+from .detection import FingerDetector
+from .deviceinfo import DeviceInfoCache
+from .occupancy import OccupancyMap
+from .packets import *
+from .results import *
+from .transport import DeadlineExceeded, FramedTransport, FrameError, TransportTimeout, openPort
+
+class _InfoField(object):
+    """ Attribute backed by the device info, see ZFM20x.info"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, board, owner):
+        if board is None:
+            return self
+        return board.info[self.key]
+
+    def __set__(self, board, value):
+        board.info[self.key] = value
+        board._cacheInfo()
+
 
 class ZFM20x(object):
     """A fingerprint reader class"""
 
-    packageSizeDict = [32, 64, 128, 256]
+    packageSizeDict = packageSizes
     imgBufferSize = 36864
     chrBufferSize = 512
-
-    def __init__(self, port, baudrate=57600, name=None, address=0xFFFFFFFF, password=0x00000000):
-        self.sp = serial.Serial(port, baudrate)
+    notepadPages = 16
+    notepadPageSize = 32
+
+    # Shared by every reader opened by port name, set to None to disable
+    infoCache = DeviceInfoCache()
+    # setSystemParameter numbers that change a device info field
+    _infoParameters = {FINGERPRINT_PARAM_BAUDRATE: 'baudrate',
+                       FINGERPRINT_PARAM_SECURITYLEVEL: 'secureLevel',
+                       FINGERPRINT_PARAM_PACKAGESIZE: 'packageSize'}
+
+    # Commands that can safely be sent again when their reply is lost or corrupted
+    idempotentCommands = frozenset([FINGERPRINT_VERIFYPASSWORD, FINGERPRINT_GETIMAGE, FINGERPRINT_IMAGE2TZ,
+                                    FINGERPRINT_MATCH, FINGERPRINT_SEARCH, FINGERPRINT_HISPEEDSEARCH,
+                                    FINGERPRINT_STORE, FINGERPRINT_LOADCHAR, FINGERPRINT_UPCHAR,
+                                    FINGERPRINT_UPIMG, FINGERPRINT_DELCHAR, FINGERPRINT_EMPTY,
+                                    FINGERPRINT_READSYSPARA, FINGERPRINT_WRITENOTE, FINGERPRINT_READNOTE,
+                                    FINGERPRINT_TEMPLATECOUNT, FINGERPRINT_GETHWINFO, FINGERPRINT_READCONTLIST])
+    # How many times they are sent again
+    retries = 1
+    # An Instrumentation recording every command, see instrumentation.py
+    instrumentation = None
+    # A TimeoutPolicy giving every command its own read timeout, see timeouts.py
+    timeoutPolicy = None
+
+    databaseCount = _InfoField('fingerDatabase')
+    secureLevel = _InfoField('secureLevel')
+    packageSize = _InfoField('packageSize')
+    productType = _InfoField('productType')
+    version = _InfoField('version')
+    manufacturer = _InfoField('manufacturer')
+    sensor = _InfoField('sensor')
+    baudrate = _InfoField('baudrate')
+
+    def __init__(self, port, baudrate=57600, name=None, address=0xFFFFFFFF, password=0x00000000, timeout=2.0,
+                 handshake=True, infoCache=None):
+        """ port is either a serial device name or an open serial-like object
+        (see transport.openPort), e.g. a ZFM20xSimulator. timeout is the read
+        timeout in seconds: a missing reply raises TransportTimeout, and a
+        frame cut short by a dropped byte is resynchronized on, instead of
+        blocking. None blocks until the bytes arrive.
+        The device info is read (or taken from infoCache, by default the shared
+        ZFM20x.infoCache) right away, unless handshake is False: then nothing
+        is sent to the device until the first command or info attribute access.
+        """
+        self.sp = openPort(port, baudrate, timeout)
+        self.timeout = timeout
+        self._readTimeout = timeout
+        self._deadline = None
+        self._abandoned = False
+        # Command code and send time of the command waiting for its acknowledge
+        self._sent = None
+        self.transport = FramedTransport(self.sp, address)
         self.name = name
         if not self.name:
-            self.name = port
-        self.address = address
+            self.name = self.sp.port
         self.password = password
-        info = self.getHWinfo()
-        self.databaseCount = info['fingerDatabase']
-        self.secureLevel = info['secureLevel']
-        self.packageSize = info['packageSize']
-        self.productType = info['productType']
-        self.version = info['version']
-        self.manufacturer = info['manufacturer']
-        self.sensor = info['sensor']
-        self.baudrate = info['baudrate']
+        self.occupancy = None
+        self.detector = FingerDetector(self)
+        self.retransmissions = 0
+        if infoCache is not None:
+            self.infoCache = infoCache
+        # Port objects (e.g. simulators) don't identify a device, only cache by name
+        self._cacheable = not hasattr(port, 'read')
+        self._info = None
+        self._sysPara = None
+        if handshake:
+            self.info
+
+    @property
+    def info(self):
+        """ Device info from getHWinfo, read on first use and cached per port and address"""
+        if self._info is None:
+            info = None
+            if self._cacheable and self.infoCache is not None:
+                info = self.infoCache.get(self.sp.port, self.address)
+            if info is None:
+                ack, hwInfo = self.getHWinfo()
+                if ack != FINGERPRINT_OK:
+                    raise IOError('%s did not send its device info (confirmation code %d)' % (self.name, ack))
+                self._info = dict(hwInfo._asdict())
+                # Only what came from the device, a cache hit is there already
+                self._cacheInfo()
+            else:
+                self._info = info
+        return self._info
+
+    def _cacheInfo(self):
+        if self._cacheable and self.infoCache is not None and self._info is not None:
+            self.infoCache.put(self.sp.port, self.address, self._info)
+
+    def invalidateInfo(self):
+        """ Forget the cached device info and system parameters, they're read again when needed"""
+        self._info = None
+        self._sysPara = None
+        if self._cacheable and self.infoCache is not None:
+            self.infoCache.invalidate(self.sp.port, self.address)
 
     def __str__(self):
-        ack, templateCount = self.getTemplateCount()
+        if self.occupancy is not None:
+            templateCount = self.occupancy.count
+        else:
+            ack, templateCount = self.getTemplateCount()
         return "Fingerprint reader %s on %s\
         \r\nFinger Database: %d\
         \r\nDatabase used: %d\
@@ -39,6 +145,14 @@ class ZFM20x(object):
         \r\nManufacturer: %s\
         \r\nSensor: %s\r\n" % (self.name, self.sp.port, self.databaseCount, templateCount, self.secureLevel, hex(self.address), self.packageSizeDict[self.packageSize], self.baudrate*9600, self.productType, self.version, self.manufacturer, self.sensor)
 
+    @property
+    def address(self):
+        return self.transport.address
+
+    @address.setter
+    def address(self, address):
+        self.transport.address = address
+
     def bytes_available(self):
         return self.sp.inWaiting()
 
@@ -49,393 +163,452 @@ class ZFM20x(object):
 
     def read(self):
         """ Read one byte from the device """
-        return ord(self.sp.read())
+        return self.transport.read(1)[0]
 
     def write(self, data):
         """ Write one byte to the device """
-        self.sp.write(chr(data & 0xFF))
+        self.transport._write(bytearray([data & 0xFF]))
 
     def writePacket(self, packetType, packet):
         """ Write a packet to the sensor """
-        message = []
-        length = len(packet) + 2
-
-        message.append((FINGERPRINT_STARTCODE >> 8) & 0xFF)
-        message.append((FINGERPRINT_STARTCODE) & 0xFF)
-        message.append((self.address >> 24) & 0xFF)
-        message.append((self.address >> 16) & 0xFF)
-        message.append((self.address >> 8) & 0xFF)
-        message.append((self.address) & 0xFF)
-        message.append((packetType) & 0xFF)
-        message.append((length >> 8) & 0xFF)
-        message.append((length) & 0xFF)
-
-        chksum = message[6] + message[7] + message[8]
-        for i in range(length - 2):
-            message.append(packet[i] & 0xFF)
-            chksum = chksum + packet[i]
-
-        message.append((chksum >> 8) & 0xFF)
-        message.append((chksum) & 0xFF)
-
-        for data in message:
-            self.write(data)
+        self.transport.writePacket(packetType, packet)
 
     def getReply(self):
         """ Get a reply from the sensor """
-        reply = []
-        # Header (2) + Address (4) + Pkg id (1) + Length (2)
-        for _ in range(9):
-            reply.append(self.read())
-
-        length = (reply[7] << 8) + reply[8] - 2
-        # Data (length bytes)
-        for _ in range(length):
-            reply.append(self.read())
+        return Reply(self.transport.readPacket())
 
-        # Checksum (2 bytes)
-        for _ in range(2):
-            reply.append(self.read())
-
-        return reply
+    def _readAck(self):
+        """ Read the acknowledge of a command, skipping data packets left over from an abandoned transfer
+        The data packets that may follow are then read with the data timeout.
+        """
+        frame = self.transport.readPacket()
+        while frame[6] != FINGERPRINT_ACKPACKET:
+            self.transport.droppedBytes += len(frame)
+            frame = self.transport.readPacket()
+        if self._sent is not None:
+            command, sentAt = self._sent
+            self._sent = None
+            if self.timeoutPolicy is not None:
+                self.timeoutPolicy.record(command, time.time() - sentAt)
+                self._setReadTimeout(self.timeoutPolicy.dataBudget(self._dataFrameSize(), self.sp.baudrate))
+        return Reply(frame)
+
+    def _dataFrameSize(self):
+        """ Bytes in a full data packet, the largest package size until the device info is known"""
+        # Not self.packageSize: reading the info from here would recurse into getHWinfo
+        packageBytes = max(self.packageSizeDict) if self._info is None else self.getPackageSizeBytes()
+        return packageBytes + FramedTransport.headerSize + 2
+
+    def _retrying(self, command, operation):
+        """ Call operation(), which sends command and reads the reply
+        Idempotent commands are sent again up to retries times when the reply
+        is corrupted (FrameError), doesn't come (TransportTimeout) or the
+        module didn't get the command right (FINGERPRINT_PACKETRECIEVEERR).
+        Pending input is dropped before every retry.
+        """
+        if self.instrumentation is not None:
+            return self.instrumentation.call(self, command, self._attempts, command, operation)
+        return self._attempts(command, operation)
+
+    def _attempts(self, command, operation):
+        attempts = self.retries + 1 if command in self.idempotentCommands else 1
+        if self._abandoned:
+            # Drop the late reply of a command that timed out, if it came by now
+            self._abandoned = False
+            self.transport.discardInput()
+        for attempt in range(attempts, 0, -1):
+            error = None
+            self._applyTimeout(command)
+            self._sent = (command, time.time())
+            try:
+                result = operation()
+                if result.ack != FINGERPRINT_PACKETRECIEVEERR or attempt == 1:
+                    return result
+            except (FrameError, TransportTimeout) as e:
+                # No retry once the deadline passed
+                expired = self._deadline is not None and time.time() >= self._deadline
+                if self._sent is not None and self.timeoutPolicy is not None:
+                    if isinstance(e, TransportTimeout) and not expired:
+                        # The acknowledge didn't come within its budget
+                        self.timeoutPolicy.timedOut(command, self._readTimeout)
+                self._sent = None
+                if attempt == 1 or expired:
+                    self._abandoned = True
+                    if self.instrumentation is not None:
+                        self.instrumentation.failed(command, e)
+                    if expired and not isinstance(e, DeadlineExceeded):
+                        raise DeadlineExceeded('%s did not answer command 0x%02x before the deadline'
+                                               % (self.name, command))
+                    raise
+                error = e
+            self.retransmissions += 1
+            if self.instrumentation is not None:
+                self.instrumentation.retried(command, error)
+            self.transport.discardInput()
+
+    def _applyTimeout(self, command):
+        """ Set the port read timeout for command, from timeoutPolicy and the deadline"""
+        if self._deadline is not None and self._deadline <= time.time():
+            raise DeadlineExceeded('Deadline passed before %s was sent command 0x%02x' % (self.name, command))
+        timeout = self.timeout
+        if self.timeoutPolicy is not None:
+            timeout = self.timeoutPolicy.budget(command)
+        self._setReadTimeout(timeout)
+
+    def _setReadTimeout(self, timeout):
+        """ Set the port read timeout, cut to what is left of the deadline"""
+        if self._deadline is not None:
+            remaining = max(0, self._deadline - time.time())
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        if timeout != self._readTimeout:
+            self.sp.timeout = timeout
+            self._readTimeout = timeout
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """ Bound every command sent in the block to seconds from now
+        Read timeouts are cut to the time left, retries stop once it has
+        passed and DeadlineExceeded (a TransportTimeout) is raised instead of
+        waiting any longer. Nested deadlines keep the earliest one, None
+        doesn't set one.
+        """
+        previous = self._deadline
+        if seconds is not None:
+            deadline = time.time() + seconds
+            if previous is None or deadline < previous:
+                self._deadline = deadline
+        try:
+            yield
+        finally:
+            self._deadline = previous
+
+    def _transact(self, layout, *values):
+        """ Send a command packed with layout and read its acknowledge"""
+        packet = Packet.command(layout, *values)
+
+        def exchange():
+            self.transport.send(packet)
+            return self._readAck()
+        return self._retrying(values[0], exchange)
+
+    def _uploadInto(self, command, buf, *args):
+        """ Send command and read the data packets that follow its acknowledge into buf"""
+        packet = Packet.command(COMMAND_BYTE if args else COMMAND, command, *args)
+
+        def exchange():
+            self.transport.send(packet)
+            reply = self._readAck()
+            if not reply.ok:
+                return DataResult(reply.ack, None)
+            self._readDataInto(buf)
+            return DataResult(FINGERPRINT_OK, buf)
+        return self._retrying(command, exchange)
+
+    def _command(self, layout, *values):
+        """ Commands only answered with a confirmation code"""
+        return self._transact(layout, *values).ack
 
     def getPackageSizeBytes(self):
         return self.packageSizeDict[self.packageSize]
 
     def verifyPassword(self, password):
-        packet = [FINGERPRINT_VERIFYPASSWORD]
-        for i in range(4):
-            packet.append((password >> (3 - i)) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND_WORD, FINGERPRINT_VERIFYPASSWORD, password & 0xFFFFFFFF)
 
     def setPassword(self, password):
         """ Set a new password for the current device"""
-        packet = [FINGERPRINT_SETPASSWORD]
-        for i in range(4):
-            packet.append((password >> (8 * (3 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-
         #TODO Test without breaking the module
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND_WORD, FINGERPRINT_SETPASSWORD, password & 0xFFFFFFFF)
 
     def setAddress(self, newAddress):
         """ Set a new address for the current device"""
-        packet = [FINGERPRINT_SETADDR]
-        for i in range(4):
-            packet.append((newAddress >> (8 * (3 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        newAddress = (reply[10] << 24) + (reply[11] << 16) + (reply[12] << 8) + reply[13]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            self.address = newAddress
-            return FINGERPRINT_OK, newAddress
-        else:
-            return reply[9]
+        result = AddressResult.fromReply(self._transact(COMMAND_WORD, FINGERPRINT_SETADDR, newAddress & 0xFFFFFFFF))
+        if result.ack == FINGERPRINT_OK:
+            info = self._info
+            self.invalidateInfo()
+            self.address = result.address
+            if info is not None:
+                info['address'] = result.address
+                self._info = info
+                self._cacheInfo()
+        return result
 
     def setSystemParameter(self, parameterNumber, content):
-        packet = [FINGERPRINT_SETSYSPARA, parameterNumber, content]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        ack = self._command(COMMAND_PARAMETER, FINGERPRINT_SETSYSPARA, parameterNumber, content)
+        if ack == FINGERPRINT_OK:
+            # Keep the cached info in line with the new setting
+            self._sysPara = None
+            key = self._infoParameters.get(parameterNumber)
+            if key is not None and self._info is not None:
+                self._info[key] = content
+                self._cacheInfo()
+            elif self._cacheable and self.infoCache is not None:
+                self.infoCache.invalidate(self.sp.port, self.address)
+        return ack
 
     def readSystemParameters(self):
-        """ Read system parameters"""
-        packet = [FINGERPRINT_READSYSPARA]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        sysPara = {'statusRegister':((reply[10] << 8) + reply[11]),
-                   'sysIdentifier':((reply[12] << 8) + reply[13]),
-                   'fingerLibSize':((reply[14] << 8) + reply[15]),
-                   'securityLevel':((reply[16] << 8) + reply[17]),
-                   'deviceAddress':hex((reply[18] << 24) + (reply[19] << 16) + (reply[20] << 8) + reply[21]),
-                   'dataPacketSize':self.packageSizeDict[(reply[22] << 8) + reply[23]],
-                   'baudRate':((reply[24] << 8) + reply[25])*9600}
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, sysPara
-        else:
-            return reply[9], {}
+        """ Read system parameters, returns a DataResult holding SystemParameters"""
+        reply = self._transact(COMMAND, FINGERPRINT_READSYSPARA)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        self._sysPara = SystemParameters.fromReply(reply)
+        return DataResult(FINGERPRINT_OK, self._sysPara)
+
+    def getSystemParameters(self):
+        """ System parameters, only read from the device when they may have changed"""
+        if self._sysPara is None:
+            return self.readSystemParameters()
+        return DataResult(FINGERPRINT_OK, self._sysPara)
+
+    def readContList(self, indexPage=0):
+        """ Read one page of the index table, which flags the used pages of the library
+        Every index page covers 256 library pages with a 32 byte bitmap, least
+        significant bit first.
+        """
+        reply = self._transact(COMMAND_BYTE, FINGERPRINT_READCONTLIST, indexPage)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, reply.data(32))
+
+    def loadOccupancy(self):
+        """ Read the whole index table into self.occupancy
+        From then on it is kept up to date by store, deleteChar and empty.
+        """
+        occupancy = OccupancyMap(self.databaseCount)
+        for indexPage in range((self.databaseCount + 255) // 256):
+            ack, table = self.readContList(indexPage)
+            if ack != FINGERPRINT_OK:
+                return ack
+            occupancy.loadIndex(indexPage, table)
+        self.occupancy = occupancy
+        return FINGERPRINT_OK
+
+    def getOccupancy(self):
+        """ The occupancy map of the library, read from the module the first time"""
+        if self.occupancy is None:
+            ack = self.loadOccupancy()
+            if ack != FINGERPRINT_OK:
+                return None
+        return self.occupancy
+
+    def freePage(self):
+        """ A free page of the library to store a new template, -1 if it's full"""
+        occupancy = self.getOccupancy()
+        if occupancy is None:
+            return -1
+        pageID = occupancy.nextFree()
+        if pageID is None:
+            return -1
+        return pageID
 
-    def readContList(self):
-        packet = [FINGERPRINT_READCONTLIST]
-        pass
+    def occupiedCount(self):
+        """ Number of templates in the library, from the occupancy map"""
+        occupancy = self.getOccupancy()
+        if occupancy is None:
+            return -1
+        return occupancy.count
 
     def getTemplateCount(self):
         """ Get the number of templates in flash"""
-        packet = [FINGERPRINT_TEMPLATECOUNT]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        templateCount = (reply[10] << 8) + reply[11]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, templateCount
-        else:
-            return reply[9]
+        return CountResult.fromReply(self._transact(COMMAND, FINGERPRINT_TEMPLATECOUNT))
 
     def getHWinfo(self):
-        """ Get Hardware information"""
-        data = []
-        packet = [FINGERPRINT_GETHWINFO, 0x00]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-
-        for _ in range(4):
-            data.append(self.getReply())
-
-        fingerDatabase = (data[0][13] << 8) + data[0][14]
-        secureLevel = (data[0][15] << 8) + data[0][16]
-        address = hex((data[0][17] << 24) + (data[0][18] << 16) + (data[0][19] << 8) + data[0][20])
-        packageSize = ((data[0][21] << 8) + data[0][22])
-        baudrate = ((data[0][23] << 8) + data[0][24])
-        productType = ''
-        version = ''
-        manufacturer = ''
-        sensor = ''
-
-        for i in range(37,45):
-            productType = productType + chr(data[0][i])
-        for i in range(45,53):
-            version = version + chr(data[0][i])
-        for i in range(53,61):
-            manufacturer = manufacturer + chr(data[0][i])
-        for i in range(61,69):
-            sensor = sensor + chr(data[0][i])
-
-        info = {'fingerDatabase':fingerDatabase,
-                'secureLevel':secureLevel,
-                'address':address,
-                'packageSize':packageSize,
-                'baudrate':baudrate,
-                'productType':productType,
-                'version':version,
-                'manufacturer':manufacturer,
-                'sensor':sensor
-                }
-
-        return info
-
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, info
-        else:
-            return reply[9]
+        """ Get Hardware information, returns a DataResult holding HWInfo"""
+        packet = Packet.command(COMMAND_BYTE, FINGERPRINT_GETHWINFO, 0x00)
+
+        def exchange():
+            self.transport.send(packet)
+            reply = self._readAck()
+            if not reply.ok:
+                return DataResult(reply.ack, None)
+            # The info comes in 4 data packets, only the first one is used
+            data = [self.transport.readPacket() for _ in range(4)]
+            return DataResult(FINGERPRINT_OK, HWInfo.fromFrame(data[0]))
+        return self._retrying(FINGERPRINT_GETHWINFO, exchange)
 
     def getImage(self):
         """ Get finger image and save to ImageBuffer in the module """
-        packet = [FINGERPRINT_GETIMAGE]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND, FINGERPRINT_GETIMAGE)
 
     def uploadImage(self):
         """ Upload image from ImageBugffer in module to host
         The module sends the image divided in packages of packageSize. By default it
         sends 288 packages of 128 bytes (plus the header for each one)
         """
-        packet = [FINGERPRINT_UPIMG]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            fingerImg = []
-            # TODO change static 288 to depend on packageSize
-            for _ in range(self.imgBufferSize/self.getPackageSizeBytes()):
-                # TODO add a timeout
-                fingerImg.append(self.getReply())
-            return FINGERPRINT_OK, fingerImg
-        else:
-            return reply[9]
-
-    def downloadImage(self):
-        """ Download image from host to ImageBugffer in module """
-        packet = [FINGERPRINT_DOWNIMG]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        reply = self._transact(COMMAND, FINGERPRINT_UPIMG)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        fingerImg = []
+        # Each packet waits at most the data timeout, see TimeoutPolicy.dataBudget
+        for _ in range(self.imgBufferSize // self.getPackageSizeBytes()):
+            fingerImg.append(self.getReply())
+        return DataResult(FINGERPRINT_OK, fingerImg)
+
+    def newImageBuffer(self):
+        """ Allocate a buffer that can hold a full image, to be reused with uploadImageInto"""
+        return bytearray(self.imgBufferSize)
+
+    def uploadImageInto(self, imgBuffer=None):
+        """ Upload image from ImageBuffer in module straight into imgBuffer
+        Only the packet payloads are copied, headers and checksums are dropped.
+        imgBuffer must hold at least imgBufferSize bytes, if it's None a new
+        one is allocated. Pass the same buffer on every capture to reuse it.
+        """
+        if imgBuffer is None:
+            imgBuffer = self.newImageBuffer()
+        return self._uploadInto(FINGERPRINT_UPIMG, imgBuffer)
+
+    def _readDataInto(self, buf):
+        """ Read data packets up to the end packet, copying their payloads into buf"""
+        view = memoryview(buf)
+        offset = 0
+        packetType = FINGERPRINT_DATAPACKET
+        while packetType != FINGERPRINT_ENDDATAPACKET:
+            packetType, size = self.transport.readPacketInto(view[offset:])
+            offset += size
+        return offset
+
+    def uploadImageStream(self):
+        """ Upload image from ImageBuffer in module one packet at a time
+        Returns the ack and a generator that yields the payload of every data
+        packet as it arrives, so the image can be processed before the last
+        packet is received. The generator must be consumed before sending
+        another command.
+        """
+        reply = self._transact(COMMAND, FINGERPRINT_UPIMG)
+        if not reply.ok:
+            return DataResult(reply.ack, iter(()))
+        return DataResult(FINGERPRINT_OK, self._iterPayloads())
+
+    def _iterPayloads(self):
+        packetType = FINGERPRINT_DATAPACKET
+        while packetType != FINGERPRINT_ENDDATAPACKET:
+            frame = self.transport.readPacket()
+            packetType = frame[6]
+            yield frame[9:-2]
+
+    def downloadImage(self, data):
+        """ Download image from host to ImageBugffer in module
+        data holds the imgBufferSize bytes of a packed image (see
+        image.packImage), it is sent in packages of packageSize once the
+        module acknowledges the command.
+        """
+        packet = Packet.command(COMMAND, FINGERPRINT_DOWNIMG)
+
+        def exchange():
+            self.transport.send(packet)
+            reply = self._readAck()
+            if reply.ok:
+                self.transport.writeData(data, self.getPackageSizeBytes())
+            return reply
+        return self._retrying(FINGERPRINT_DOWNIMG, exchange).ack
 
     def image2Tz(self, bufferID):
         """ Generate a char file from finger image and store it in Charbuffer1/2"""
-        packet = [FINGERPRINT_IMAGE2TZ, bufferID]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND_BYTE, FINGERPRINT_IMAGE2TZ, bufferID)
 
     def createModel(self):
         """ Create a new model for the finger
         Get two char images stored in charBuffer1 and CharBuffer2,
         generate a model and store it bith in Charbuffer1 and CharBuffer2
         """
-        packet = [FINGERPRINT_REGMODEL]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND, FINGERPRINT_REGMODEL)
 
     def uploadChar(self, bufferID):
         """ Upload a char file from bufferId in module to host
         The module sends the char file divided in packages of packageSize. By default it
         sends 4 packages of 128 bytes (plus the header for each one)
         """
-        packet = [FINGERPRINT_UPCHAR, bufferID]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            chrFile = []
-            for _ in range(self.charBufferSize/self.getPackageSizeBytes()):
-                chrFile.append(self.getReply())
-            return FINGERPRINT_OK, chrFile
-        else:
-            return reply[9]
-
-    def downloadChar(self, bufferID):
-        packet = [FINGERPRINT_DOWNCHAR, bufferID]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        reply = self._transact(COMMAND_BYTE, FINGERPRINT_UPCHAR, bufferID)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        chrFile = []
+        for _ in range(self.chrBufferSize // self.getPackageSizeBytes()):
+            chrFile.append(self.getReply())
+        return DataResult(FINGERPRINT_OK, chrFile)
+
+    def uploadCharInto(self, bufferID, chrBuffer=None):
+        """ Upload a char file from bufferId in module straight into chrBuffer
+        Like uploadImageInto, only the payloads are copied. chrBuffer must hold
+        chrBufferSize bytes, it can be a memoryview into a larger buffer.
+        """
+        if chrBuffer is None:
+            chrBuffer = bytearray(self.chrBufferSize)
+        return self._uploadInto(FINGERPRINT_UPCHAR, chrBuffer, bufferID)
+
+    def downloadChar(self, bufferID, data):
+        """ Download a char file from host to bufferID in module
+        data holds the chrBufferSize bytes of the char file, it is sent in
+        packages of packageSize once the module acknowledges the command.
+        """
+        packet = Packet.command(COMMAND_BYTE, FINGERPRINT_DOWNCHAR, bufferID)
+
+        def exchange():
+            self.transport.send(packet)
+            reply = self._readAck()
+            if reply.ok:
+                self.transport.writeData(data, self.getPackageSizeBytes())
+            return reply
+        return self._retrying(FINGERPRINT_DOWNCHAR, exchange).ack
 
     def store(self, pageID):
         """ Store a finger model to flash with pageID"""
-        packet = [FINGERPRINT_STORE, 0x01]
-        for i in range(2):
-            packet.append((pageID >> (8 * (1 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        ack = self._command(COMMAND_PAGE, FINGERPRINT_STORE, 0x01, pageID)
+        if ack == FINGERPRINT_OK and self.occupancy is not None:
+            self.occupancy.mark(pageID)
+        return ack
 
     def loadChar(self, bufferID, pageID):
         """ Load char file from flash to bufferID"""
-        packet = [FINGERPRINT_LOADCHAR, bufferID]
-        for i in range(2):
-            packet.append((pageID >> (8 * (1 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        return self._command(COMMAND_PAGE, FINGERPRINT_LOADCHAR, bufferID, pageID)
 
     def deleteChar(self, pageID, countBytes):
-        packet = [FINGERPRINT_DELCHAR]
-        for i in range(2):
-            packet.append((pageID >> (8 * (1 - i))) & 0xFF)
-        for i in range(2):
-            packet.append((countBytes >> (8 * (1 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        ack = self._command(COMMAND_RANGE, FINGERPRINT_DELCHAR, pageID, countBytes)
+        if ack == FINGERPRINT_OK and self.occupancy is not None:
+            self.occupancy.clear(pageID, countBytes)
+        return ack
 
     def empty(self):
         """ Empty finger ID database"""
-        packet = [FINGERPRINT_EMPTY]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        ack = self._command(COMMAND, FINGERPRINT_EMPTY)
+        if ack == FINGERPRINT_OK and self.occupancy is not None:
+            self.occupancy.clearAll()
+        return ack
 
     def match(self):
         """ Match two char files stored in CharBuffer1 and CharBuffer2"""
-        packet = [FINGERPRINT_MATCH]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        matchScore = (reply[10] << 8) + reply[11]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, matchScore
-        else:
-            return reply[9]
+        return MatchResult.fromReply(self._transact(COMMAND, FINGERPRINT_MATCH))
 
     def search(self, bufferID, startPage, pageNumber):
-        packet = [FINGERPRINT_SEARCH, bufferID]
-        for i in range(2):
-            packet.append((startPage >> (8 * (1 - i))) & 0xFF)
-        for i in range(2):
-            packet.append((pageNumber >> (8 * (1 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        pageID = (reply[10] << 8) + reply[11]
-        matchScore = (reply[12] << 8) + reply[13]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, pageID, matchScore
-        else:
-            return reply[9]
+        return SearchResult.fromReply(self._transact(COMMAND_SEARCH, FINGERPRINT_SEARCH, bufferID, startPage, pageNumber))
 
     def highSpeedSearch(self, bufferID, startPage, pageNumber):
-        packet = [FINGERPRINT_SEARCH, bufferID]
-        for i in range(2):
-            packet.append((startPage >> (8 * (1 - i))) & 0xFF)
-        for i in range(2):
-            packet.append((pageNumber >> (8 * (1 - i))) & 0xFF)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        pageID = (reply[10] << 8) + reply[11]
-        matchScore = (reply[12] << 8) + reply[13]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, pageID, matchScore
-        else:
-            return reply[9], 0, 0
+        return SearchResult.fromReply(self._transact(COMMAND_SEARCH, FINGERPRINT_HISPEEDSEARCH, bufferID, startPage,
+                                                     pageNumber))
+
+    def searchRange(self):
+        """ (startPage, pageNumber) covering every template, from the occupancy map if it's loaded
+        Without one the whole library is searched.
+        """
+        if self.occupancy is None:
+            return 0x00, 0x03E9
+        return self.occupancy.span()
 
     def getRandomCode(self):
         """ Get Random Code from device"""
-        packet = [FINGERPRINT_GETRANDOMCODE]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        randomNumber = (reply[10] << 24) + (reply[11] << 16) + (reply[12] << 8) + reply[13]
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, randomNumber
-        else:
-            return reply[9], -1
+        return RandomCodeResult.fromReply(self._transact(COMMAND, FINGERPRINT_GETRANDOMCODE))
 
     def writeNotepad(self, pageNumber, data):
-        packet = [FINGERPRINT_WRITENOTE]
-        for byte in data:
-            packet.append(byte)
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK
-        else:
-            return reply[9]
+        """ Write up to notepadPageSize bytes to notepad page pageNumber, zero padded"""
+        if len(data) > self.notepadPageSize:
+            raise ValueError('A notepad page holds %d bytes' % self.notepadPageSize)
+        return self._command(COMMAND_NOTEPAD, FINGERPRINT_WRITENOTE, pageNumber, bytes(bytearray(data)))
 
     def readNotepad(self, pageNumber):
-        packet = [FINGERPRINT_READNOTE, pageNumber]
-        self.writePacket(FINGERPRINT_COMMANDPACKET, packet)
-        reply = self.getReply()
-        data = []
-        for i in range(10, 42):
-            data.append(reply[i])
-        if reply[6] == FINGERPRINT_ACKPACKET and reply[9] == FINGERPRINT_OK:
-            return FINGERPRINT_OK, data
-        else:
-            return reply[9]
+        reply = self._transact(COMMAND_BYTE, FINGERPRINT_READNOTE, pageNumber)
+        if not reply.ok:
+            return DataResult(reply.ack, None)
+        return DataResult(FINGERPRINT_OK, reply.data(self.notepadPageSize))
 
     def intToHexList(self, intList):
         response = []
@@ -444,21 +617,28 @@ class ZFM20x(object):
         return response
 
     ### High level libraries
-    def searchFinger(self):
-        """ Wrapper function that gets a finger image and search for it in the database"""
-        # First we get the image
-        #ack = self.getImage()
-        #if ack != FINGERPRINT_OK:
-        #    return ack
-        # Convert image to char
-        ack = self.image2Tz(0)
-        if ack != FINGERPRINT_OK:
-            return ack
-        # Start a highspeed search
-        ack, pageID, matchScore = self.highSpeedSearch(0, 0x00, 0x03E9)
-        if ack != FINGERPRINT_OK:
-            return ack
-        return pageID, matchScore
+    def searchFinger(self, timeout=None, deadline=None):
+        """ Wrapper function that gets a finger image and search for it in the database
+        Without a timeout the image already in ImageBuffer is searched. With
+        one, it first waits up to timeout seconds for a finger to be placed
+        and FINGERPRINT_NOFINGER is reported if none shows up. Returns a
+        SearchResult. deadline bounds the whole call in seconds, waiting
+        included: DeadlineExceeded is raised if the module hasn't answered by
+        then.
+        """
+        with self.deadline(deadline):
+            # First we get the image
+            if timeout is not None and not self.detector.waitPlaced(timeout):
+                return SearchResult(FINGERPRINT_NOFINGER, 0, 0)
+            # Convert image to char
+            ack = self.image2Tz(0)
+            if ack != FINGERPRINT_OK:
+                return SearchResult(ack, 0, 0)
+            # Start a highspeed search over the pages in use
+            startPage, pageNumber = self.searchRange()
+            if not pageNumber:
+                return SearchResult(FINGERPRINT_NOTFOUND, 0, 0)
+            return self.highSpeedSearch(0, startPage, pageNumber)
 
     def fingerPresent(self):
         ack = self.getImage()
@@ -470,13 +650,16 @@ class ZFM20x(object):
         ack = self.image2Tz(0)
         if ack != FINGERPRINT_OK:
             return ack
-        # Start a highspeed search
-        ack, pageID, matchScore = self.highSpeedSearch(0, 0x00, 0x03E9)
+        # Start a highspeed search over the pages in use
+        startPage, pageNumber = self.searchRange()
+        if not pageNumber:
+            return -1
+        ack, pageID, matchScore = self.highSpeedSearch(0, startPage, pageNumber)
         if ack != FINGERPRINT_OK:
             return -1
         return pageID
 
-    def fingerEnroll(self, fingerID):
+    def fingerEnroll(self, fingerID, timeout=None, deadline=None):
         """
         Enroll a new finger with id = fingerID
         ### Process to enroll a finger
@@ -488,43 +671,46 @@ class ZFM20x(object):
         5- image2Tz(buffer2)
         6- createModel
         7- storeModel
+        Like searchFinger, timeout is how long to wait for the finger to be
+        placed or removed at each step, -5 is returned if it doesn't happen in
+        time. deadline bounds the whole call in seconds, waiting included:
+        DeadlineExceeded is raised if the module hasn't answered by then.
         """
+        with self.deadline(deadline):
+            return self._fingerEnroll(fingerID, timeout)
 
-        print 'Enrolling..'
+    def _fingerEnroll(self, fingerID, timeout):
+        print('Enrolling..')
 
-        print 'Waiting for valid finger...'
-        while not self.fingerPresent():
-            # TODO add a timeout
-            continue
+        print('Waiting for valid finger...')
+        if not self.detector.waitPlaced(timeout):
+            return -5
 
         # 2- image2Tz(buffer1)
         if self.image2Tz(1) != FINGERPRINT_OK:
             return -1
 
         # 3- getImage (until no finger present)
-        print 'Please remove your finger...'
-        while self.fingerPresent():
-            # TODO add a timeout
-            continue
+        print('Please remove your finger...')
+        if not self.detector.waitRemoved(timeout):
+            return -5
 
         # 4- getImage (again same finger)
-        print 'Please put the same finger...'
-        while not self.fingerPresent():
-            # TODO add a timeout
-            continue
+        print('Please put the same finger...')
+        if not self.detector.waitPlaced(timeout):
+            return -5
 
         # 5- image2Tz(buffer2)
         if self.image2Tz(2) != FINGERPRINT_OK:
             return -2
 
         # 6- createModel
-        print 'Creating a model...'
+        print('Creating a model...')
         if self.createModel() != FINGERPRINT_OK:
-            # TODO add a timeout
             return -3
 
         # 7- storeModel
-        print 'Storing model...'
+        print('Storing model...')
         if self.store(fingerID) != FINGERPRINT_OK:
             return -4
 
@@ -0,0 +1,153 @@
+""" Regenerate templates from archived finger images
+
+After a firmware or security level change the templates in the library have
+to be generated again. Instead of making every user scan their finger
+again, archived captures can be sent back to the module (downloadImage) and
+run through the enrollment steps (image2Tz, createModel, store):
+
+    acks = reenrollDirectory(board, '/srv/captures', progress=report)
+
+Images are packed sensor images (imgBufferSize bytes, '.raw') or 8 bit
+greyscale BMP files ('.bmp', needs numpy), named after their page ID:
+'<pageID>.raw', or '<pageID>-1.bmp' and '<pageID>-2.bmp' for the two
+captures of an enrollment. With a single capture it is used for both char
+buffers.
+
+Images are read and packed in a background thread, a few templates ahead
+of the sensor, so file I/O and decoding overlap with the serial transfers
+and the module's processing.
+"""
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .commands import *
+from .pyzfm20x import ZFM20x
+
+imageExtensions = ('.raw', '.bmp')
+
+
+def loadImage(filename):
+    """ Read an image file as a packed sensor image (imgBufferSize bytes)"""
+    if filename.lower().endswith('.bmp'):
+        from .image import readBMP, packImage
+        return packImage(readBMP(filename))
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) != ZFM20x.imgBufferSize:
+        raise ValueError('%s holds %d bytes, expected a %d byte image' % (filename, len(data), ZFM20x.imgBufferSize))
+    return data
+
+
+def _load(image):
+    """ A packed image as is, anything else is taken as a file name"""
+    if isinstance(image, (bytearray, memoryview)) or len(image) == ZFM20x.imgBufferSize:
+        return image
+    return loadImage(image)
+
+
+def imageDirectory(path):
+    """ The images in directory path as (pageID, [filenames]) by page ID, at most 2 per page"""
+    pages = {}
+    for name in os.listdir(path):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in imageExtensions:
+            continue
+        pageID, _, capture = stem.partition('-')
+        try:
+            key = (int(pageID), int(capture or 0))
+        except ValueError:
+            continue
+        pages.setdefault(key[0], []).append((key[1], os.path.join(path, name)))
+    return [(pageID, [filename for _, filename in sorted(files)[:2]]) for pageID, files in sorted(pages.items())]
+
+
+def reenrollImages(board, pageID, images):
+    """ Generate a template from one or two packed images and store it at pageID
+    Returns the confirmation code of the first step that fails.
+    """
+    for bufferID, image in enumerate(images[:2], 1):
+        ack = board.downloadImage(image)
+        if ack == FINGERPRINT_OK:
+            ack = board.image2Tz(bufferID)
+        if ack != FINGERPRINT_OK:
+            return ack
+    if len(images) == 1:
+        # The single capture is still in ImageBuffer
+        ack = board.image2Tz(2)
+        if ack != FINGERPRINT_OK:
+            return ack
+    ack = board.createModel()
+    if ack != FINGERPRINT_OK:
+        return ack
+    return board.store(pageID)
+
+
+def reenroll(board, items, progress=None, prefetch=4):
+    """ Regenerate the template of every (pageID, images) in items
+    images are packed images or file names (see loadImage). Up to prefetch
+    templates worth of images are loaded ahead. progress(pageID, ack, done,
+    total) is called after every template, total is None when items has no
+    length. An image that can't be read counts as FINGERPRINT_INVALIDIMAGE.
+    Returns the acks by page ID.
+    """
+    total = len(items) if hasattr(items, '__len__') else None
+    loaded = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load():
+        try:
+            for pageID, images in items:
+                try:
+                    images = [_load(image) for image in images]
+                except (IOError, ValueError):
+                    images = None
+                if not put((pageID, images)):
+                    return
+        except Exception as e:
+            # Reraised by the consumer
+            put(e)
+            return
+        put(None)
+
+    loader = threading.Thread(target=load, name='zfm20x-reenroll-loader')
+    loader.daemon = True
+    loader.start()
+    acks = {}
+    try:
+        while True:
+            item = loaded.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            pageID, images = item
+            if not images:
+                ack = FINGERPRINT_INVALIDIMAGE
+            else:
+                ack = reenrollImages(board, pageID, images)
+            acks[pageID] = ack
+            if progress is not None:
+                progress(pageID, ack, len(acks), total)
+    finally:
+        stop.set()
+        loader.join()
+    return acks
+
+
+def reenrollDirectory(board, path, progress=None, prefetch=4):
+    """ reenroll every image in directory path, see imageDirectory"""
+    return reenroll(board, imageDirectory(path), progress, prefetch)
@@ -0,0 +1,171 @@
+""" Replicate templates from one sensor to many
+
+A Replicator fetches each template once from the source (loadChar +
+uploadCharInto) and fans it out to every target (downloadChar + store) with
+one thread per target, so a new template reaches all the doors in about the
+time it takes to write it to the slowest one:
+
+    replicator = Replicator([door1, door2, door3])
+    replicator.replicate(enrollBoard, [pageID])
+    replicator.sync(enrollBoard)   # push whatever each target is missing
+
+Fetching is pipelined with pushing: targets start writing the first template
+while the following ones are still being read from the source.
+"""
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .commands import *
+
+
+def fetchTemplate(board, pageID):
+    """ Read the template at pageID from the board's library, None if it can't be read"""
+    if board.loadChar(1, pageID) != FINGERPRINT_OK:
+        return None
+    ack, data = board.uploadCharInto(1)
+    if ack != FINGERPRINT_OK:
+        return None
+    return bytes(data)
+
+
+def occupiedPages(board, pages=None):
+    """ Page IDs in pages (default the whole library) that hold a template
+    None if the board's index table can't be read.
+    """
+    occupancy = board.getOccupancy()
+    if occupancy is None:
+        return None
+    if pages is None:
+        return set(occupancy.usedPages())
+    return set(pageID for pageID in pages if occupancy.isUsed(pageID))
+
+
+class Replicator(object):
+    """Pushes templates to a set of target sensors concurrently"""
+
+    OK = 'ok'
+    RETRY = 'retry'
+    FAILED = 'failed'
+
+    def __init__(self, targets, retries=2, progress=None):
+        """
+        targets are ZFM20x objects, each is only ever used from its own
+        worker thread while a replication runs. A failed push is retried up to
+        retries times. progress(name, pageID, status, attempt) is called from
+        the worker threads after every push attempt, and with pageID None and
+        FAILED for a target whose index table sync couldn't read.
+        """
+        self.targets = list(targets)
+        self.retries = retries
+        self.progress = progress
+
+    def _report(self, target, pageID, status, attempt):
+        if self.progress is not None:
+            self.progress(target.name, pageID, status, attempt)
+
+    def pushTemplate(self, target, pageID, template):
+        """ Download template to target and store it at pageID, with retries"""
+        ack = None
+        for attempt in range(self.retries + 1):
+            try:
+                ack = target.downloadChar(1, template)
+                if ack == FINGERPRINT_OK:
+                    ack = target.store(pageID)
+            except Exception:
+                ack = None
+                # Drop what's left of an interrupted reply before retrying
+                try:
+                    target.sp.flushInput()
+                except Exception:
+                    pass
+            if ack == FINGERPRINT_OK:
+                self._report(target, pageID, self.OK, attempt)
+                return ack
+            if attempt < self.retries:
+                self._report(target, pageID, self.RETRY, attempt)
+        self._report(target, pageID, self.FAILED, self.retries)
+        return ack
+
+    def push(self, pageID, template):
+        """ Push one template to every target at once, returns the acks by target name and page"""
+        return self._run(None, dict((target.name, [pageID]) for target in self.targets), {pageID: template})
+
+    def replicate(self, source, pages):
+        """ Copy pages from source to every target, returns the acks by target name and page"""
+        pages = list(pages)
+        return self._run(source, dict((target.name, pages) for target in self.targets))
+
+    def sync(self, source, pages=None):
+        """ Push to each target only the pages it is missing
+        The index tables of source and targets are read first, every target
+        then only gets the templates it doesn't have. A target whose table
+        can't be read is reported and skipped, IOError is raised if the
+        source's can't be read.
+        """
+        wanted = occupiedPages(source, pages)
+        if wanted is None:
+            raise IOError('Could not read the index table of %s' % source.name)
+        plan = {}
+        results = [None] * len(self.targets)
+
+        def probe(i, target):
+            try:
+                results[i] = occupiedPages(target, sorted(wanted))
+            except Exception:
+                pass
+            if results[i] is None:
+                # Taking it for empty would overwrite the templates it has
+                self._report(target, None, self.FAILED, 0)
+
+        threads = [threading.Thread(target=probe, args=(i, target)) for i, target in enumerate(self.targets)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for target, present in zip(self.targets, results):
+            if present is not None:
+                plan[target.name] = sorted(wanted - present)
+        return self._run(source, plan)
+
+    def _run(self, source, plan, templates=None):
+        """ Fetch every planned page once and feed it to the targets that need it"""
+        plan = dict((name, set(pages)) for name, pages in plan.items())
+        queues = dict((target.name, queue.Queue()) for target in self.targets)
+        acks = dict((target.name, {}) for target in self.targets)
+
+        def work(target):
+            while True:
+                item = queues[target.name].get()
+                if item is None:
+                    return
+                pageID, template = item
+                if template is None:
+                    acks[target.name][pageID] = FINGERPRINT_UPLOADFEATUREFAIL
+                    self._report(target, pageID, self.FAILED, 0)
+                else:
+                    acks[target.name][pageID] = self.pushTemplate(target, pageID, template)
+
+        workers = [threading.Thread(target=work, args=(target,)) for target in self.targets]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            pages = sorted(set().union(*plan.values()))
+            for pageID in pages:
+                if templates is not None:
+                    template = templates[pageID]
+                else:
+                    template = fetchTemplate(source, pageID)
+                for target in self.targets:
+                    if pageID in plan.get(target.name, ()):
+                        queues[target.name].put((pageID, template))
+        finally:
+            for target in self.targets:
+                queues[target.name].put(None)
+            for worker in workers:
+                worker.join()
+        return acks
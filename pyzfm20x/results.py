@@ -0,0 +1,131 @@
+""" Typed command results
+
+Commands that return more than a confirmation code return one of these.
+They are tuples with the confirmation code first, so they unpack like plain
+tuples, and their fields can be read by name:
+
+    ack, pageID, matchScore = board.search(1, 0, board.databaseCount)
+    hit = board.search(1, 0, board.databaseCount)
+    if hit.ack == FINGERPRINT_OK:
+        print(hit.pageID)
+
+A result has the same shape whatever the outcome, on error its fields hold
+their defaults (0, -1 or None).
+"""
+from collections import namedtuple
+
+from .commands import *
+from .packets import SEARCH_HIT, CODE_WORD, CODE_DWORD, SYSTEM_PARAMETERS, HW_INFO
+
+packageSizes = [32, 64, 128, 256]
+
+# Build results straight from the unpacked fields, skipping the namedtuple __new__
+_new = tuple.__new__
+
+
+def _text(data):
+    """ Fixed size string field, as str on Python 2 and 3"""
+    return data if isinstance(data, str) else data.decode('latin-1')
+
+
+class SearchResult(namedtuple('SearchResult', 'ack pageID matchScore')):
+    """search / highSpeedSearch: the best matching page and its score"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply.ok:
+            return _new(cls, reply.unpack(SEARCH_HIT))
+        return _new(cls, (reply.ack, 0, 0))
+
+
+class ShardSearchResult(namedtuple('ShardSearchResult', 'ack pageID matchScore shard')):
+    """ShardedLibrary searches: the best match over every shard, with the name of its shard"""
+    __slots__ = ()
+
+
+class IdentifyResult(namedtuple('IdentifyResult', 'ack pageID matchScore time captureTime extractTime '
+                                'searchTime startPage pageNumber')):
+    """IdentificationLoop: a search hit with the seconds spent on capture (getImage), feature
+    extraction (image2Tz) and search, and the page range that was searched"""
+    __slots__ = ()
+
+    @property
+    def totalTime(self):
+        return self.captureTime + self.extractTime + self.searchTime
+
+
+class MatchResult(namedtuple('MatchResult', 'ack matchScore')):
+    """match: score of CharBuffer1 against CharBuffer2"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply.ok:
+            return _new(cls, reply.unpack(CODE_WORD))
+        return _new(cls, (reply.ack, 0))
+
+
+class CountResult(namedtuple('CountResult', 'ack count')):
+    """getTemplateCount: number of templates in the library"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply.ok:
+            return _new(cls, reply.unpack(CODE_WORD))
+        return _new(cls, (reply.ack, 0))
+
+
+class AddressResult(namedtuple('AddressResult', 'ack address')):
+    """setAddress: the address the module now answers to, None on error"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply.ok:
+            return _new(cls, reply.unpack(CODE_DWORD))
+        return _new(cls, (reply.ack, None))
+
+
+class RandomCodeResult(namedtuple('RandomCodeResult', 'ack randomNumber')):
+    """getRandomCode: 32 bit random number, -1 on error"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply.ok:
+            return _new(cls, reply.unpack(CODE_DWORD))
+        return _new(cls, (reply.ack, -1))
+
+
+class DataResult(namedtuple('DataResult', 'ack data')):
+    """Commands returning data (images, char files, tables, parameters), None on error"""
+    __slots__ = ()
+
+
+class SystemParameters(namedtuple('SystemParameters', 'statusRegister sysIdentifier fingerLibSize '
+                                  'securityLevel deviceAddress dataPacketSize baudRate')):
+    """readSystemParameters: dataPacketSize in bytes, baudRate in bauds"""
+    __slots__ = ()
+
+    @classmethod
+    def fromReply(cls, reply):
+        (statusRegister, sysIdentifier, fingerLibSize, securityLevel,
+         deviceAddress, packageSize, baudMultiplier) = reply.unpack(SYSTEM_PARAMETERS)
+        return cls(statusRegister, sysIdentifier, fingerLibSize, securityLevel,
+                   deviceAddress, packageSizes[packageSize], baudMultiplier * 9600)
+
+
+class HWInfo(namedtuple('HWInfo', 'fingerDatabase secureLevel address packageSize baudrate '
+                        'productType version manufacturer sensor')):
+    """getHWinfo: packageSize is an index into ZFM20x.packageSizeDict, baudrate a multiple of 9600"""
+    __slots__ = ()
+
+    offset = 13
+
+    @classmethod
+    def fromFrame(cls, frame):
+        """ Decode the first data packet sent after the getHWinfo acknowledge"""
+        fields = HW_INFO.unpack_from(frame, cls.offset)
+        return cls(*(fields[:5] + tuple(_text(field) for field in fields[5:])))
@@ -0,0 +1,182 @@
+""" Identify fingers against a library split across several sensors
+
+One module holds about a thousand templates and its search time grows with
+the number it holds. A ShardedLibrary spreads one logical library over the
+flash of several sensors, each shard holding a range of its pages, and
+searches all of them at once:
+
+    library = ShardedLibrary([door, spare1, spare2])
+    result = library.searchFinger(door, timeout=10)
+    if result.ack == FINGERPRINT_OK:
+        print(result.pageID, result.matchScore, result.shard)
+
+The char file of the capture is uploaded once from the capturing sensor and
+pushed to every shard with downloadChar. Each shard then searches its own
+page range in its own thread and the best matchScore wins. Page IDs are
+global: shard i covers the pages after those of shards 0 to i-1.
+"""
+import threading
+
+from .commands import *
+from .results import SearchResult, ShardSearchResult
+
+
+class Shard(object):
+    """A range of the library stored on one sensor"""
+
+    def __init__(self, board, startPage=0, pageCount=None, offset=0):
+        """ pages startPage to startPage + pageCount - 1 of board (all of its
+        library by default) hold global pages offset onwards
+        """
+        self.board = board
+        self.startPage = startPage
+        self.pageCount = board.databaseCount - startPage if pageCount is None else pageCount
+        self.offset = offset
+
+    @property
+    def name(self):
+        return self.board.name
+
+    def contains(self, pageID):
+        return self.offset <= pageID < self.offset + self.pageCount
+
+    def localPage(self, pageID):
+        return pageID - self.offset + self.startPage
+
+    def globalPage(self, localPage):
+        return localPage - self.startPage + self.offset
+
+
+class ShardedLibrary(object):
+    """A finger library partitioned across the flash of several sensors"""
+
+    def __init__(self, shards):
+        """ shards are ZFM20x objects, or (board, startPage, pageCount) tuples
+        to only use part of a sensor's library. Each board must only be used
+        from one thread at a time: during a search every shard is driven
+        from its own thread.
+        """
+        self.shards = []
+        offset = 0
+        for shard in shards:
+            if isinstance(shard, tuple):
+                shard = Shard(*shard, offset=offset)
+            else:
+                shard = Shard(shard, offset=offset)
+            self.shards.append(shard)
+            offset += shard.pageCount
+        self.capacity = offset
+
+    def shardFor(self, pageID):
+        """ The shard holding global pageID, None if it's out of range"""
+        for shard in self.shards:
+            if shard.contains(pageID):
+                return shard
+        return None
+
+    ### Templates
+    def store(self, pageID, template):
+        """ Store a char file at global pageID, on the shard that holds it"""
+        shard = self.shardFor(pageID)
+        if shard is None:
+            return FINGERPRINT_BADLOCATION
+        ack = shard.board.downloadChar(1, template)
+        if ack != FINGERPRINT_OK:
+            return ack
+        return shard.board.store(shard.localPage(pageID))
+
+    def delete(self, pageID):
+        shard = self.shardFor(pageID)
+        if shard is None:
+            return FINGERPRINT_BADLOCATION
+        return shard.board.deleteChar(shard.localPage(pageID), 1)
+
+    def freePage(self):
+        """ A free global page, from the shard with the fewest templates, -1 if all are full"""
+        best = None
+        for shard in self.shards:
+            occupancy = shard.board.getOccupancy()
+            if occupancy is None:
+                continue
+            used = sum(1 for page in range(shard.startPage, shard.startPage + shard.pageCount)
+                       if occupancy.isUsed(page))
+            if used < shard.pageCount and (best is None or used < best[0]):
+                best = (used, shard, occupancy)
+        if best is None:
+            return -1
+        used, shard, occupancy = best
+        for page in range(shard.startPage, shard.startPage + shard.pageCount):
+            if not occupancy.isUsed(page):
+                return shard.globalPage(page)
+        return -1
+
+    ### Identification
+    def _searchShard(self, shard, template, source):
+        board = shard.board
+        # The capturing sensor already has the char file in CharBuffer1
+        if board is not source:
+            ack = board.downloadChar(1, template)
+            if ack != FINGERPRINT_OK:
+                return SearchResult(ack, 0, 0)
+        return board.highSpeedSearch(1, shard.startPage, shard.pageCount)
+
+    def searchTemplate(self, template, source=None):
+        """ Search every shard for template (a chrBufferSize char file) at once
+        Returns a ShardSearchResult with the global page ID and the name of the
+        shard of the best match. Shards that fail (an error ack or an
+        exception) are left out, if none of them answers the error of the
+        first one is returned. source is a board that already holds template
+        in CharBuffer1, it isn't sent to it again.
+        """
+        results = [None] * len(self.shards)
+
+        def search(i, shard):
+            try:
+                results[i] = self._searchShard(shard, template, source)
+            except Exception:
+                # Any failure only takes this shard out of the search
+                results[i] = SearchResult(FINGERPRINT_PACKETRESPONSEFAIL, 0, 0)
+
+        threads = [threading.Thread(target=search, args=(i, self.shards[i])) for i in range(1, len(self.shards))]
+        for thread in threads:
+            thread.start()
+        # The first shard is searched from the calling thread
+        if self.shards:
+            search(0, self.shards[0])
+        for thread in threads:
+            thread.join()
+        return self._best(results)
+
+    def _best(self, results):
+        best = None
+        error = None
+        # A shard whose search never finished has no result
+        answered = [(shard, result) for shard, result in zip(self.shards, results) if result is not None]
+        for shard, result in answered:
+            if result.ack == FINGERPRINT_OK:
+                if best is None or result.matchScore > best.matchScore:
+                    best = ShardSearchResult(FINGERPRINT_OK, shard.globalPage(result.pageID),
+                                             result.matchScore, shard.name)
+            elif result.ack != FINGERPRINT_NOTFOUND and error is None:
+                error = result.ack
+        if best is not None:
+            return best
+        if error is not None and all(result.ack != FINGERPRINT_NOTFOUND for shard, result in answered):
+            return ShardSearchResult(error, 0, 0, None)
+        return ShardSearchResult(FINGERPRINT_NOTFOUND, 0, 0, None)
+
+    def searchFinger(self, board, timeout=None):
+        """ Capture a finger on board and search the whole library for it
+        board is the sensor the finger is placed on, it may be one of the
+        shards. With a timeout it waits up to timeout seconds for the finger
+        first (FINGERPRINT_NOFINGER if none shows up), like ZFM20x.searchFinger.
+        """
+        if timeout is not None and not board.detector.waitPlaced(timeout):
+            return ShardSearchResult(FINGERPRINT_NOFINGER, 0, 0, None)
+        ack = board.image2Tz(1)
+        if ack != FINGERPRINT_OK:
+            return ShardSearchResult(ack, 0, 0, None)
+        ack, template = board.uploadCharInto(1)
+        if ack != FINGERPRINT_OK:
+            return ShardSearchResult(ack, 0, 0, None)
+        return self.searchTemplate(bytes(template), source=board)
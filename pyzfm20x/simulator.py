@@ -0,0 +1,478 @@
+""" In-process ZFM20x device simulator
+
+ZFM20xSimulator speaks the packet protocol in commands.py and looks like a
+serial port, so it can be passed to ZFM20x (or anything else taking a port)
+in place of a real sensor:
+
+    sim = ZFM20xSimulator()
+    board = ZFM20x(sim)
+    sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+    board.getImage()
+
+Templates are derived from the image contents, so the same finger image
+always generates the same char file and matches it with a perfect score.
+"""
+import hashlib
+import random
+import struct
+import threading
+import time
+
+from .commands import *
+from .transport import FramedTransport
+
+
+class ZFM20xSimulator(object):
+    """A simulated fingerprint reader with a serial port interface"""
+
+    packageSizeDict = [32, 64, 128, 256]
+    imgBufferSize = 36864
+    chrBufferSize = 512
+    notepadPages = 16
+    notepadPageSize = 32
+
+    # Rough command latencies of a real module, in seconds
+    typicalLatency = {FINGERPRINT_GETIMAGE: 0.2,
+                      FINGERPRINT_IMAGE2TZ: 0.3,
+                      FINGERPRINT_REGMODEL: 0.1,
+                      FINGERPRINT_SEARCH: 0.3,
+                      FINGERPRINT_HISPEEDSEARCH: 0.1,
+                      FINGERPRINT_STORE: 0.05,
+                      FINGERPRINT_EMPTY: 0.1,
+                      FINGERPRINT_DELCHAR: 0.02,
+                      FINGERPRINT_WRITENOTE: 0.02}
+
+    def __init__(self, port='sim://zfm20x', baudrate=57600, address=0xFFFFFFFF, password=0x00000000,
+                 librarySize=1000, securityLevel=3, packageSize=2, latency=None, throttle=False,
+                 maxLinkBaudrate=None, lineNoise=0.0, productType='ZFM-20', version='V1.0', manufacturer='ZhiAnTec',
+                 sensor='SIM'):
+        """
+        latency maps command codes to extra seconds before the acknowledge,
+        e.g. typicalLatency. With throttle, replies arrive no faster than the
+        device baud rate allows (10 bits per byte). maxLinkBaudrate models a
+        cable that can't carry faster rates: above it every frame is lost.
+        lineNoise is the probability that a frame sent to the host gets a byte
+        flipped or dropped on the way.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = None
+        self.is_open = True
+        self.address = address
+        self.password = password
+        self.verified = password == 0
+        self.librarySize = librarySize
+        self.securityLevel = securityLevel
+        self.packageSize = packageSize
+        self.baudMultiplier = baudrate // 9600
+        self.statusRegister = 0
+        self.sysIdentifier = 0x0009
+        self.productType = productType
+        self.version = version
+        self.manufacturer = manufacturer
+        self.sensor = sensor
+        self.latency = dict(latency or {})
+        self.throttle = throttle
+        self.maxLinkBaudrate = maxLinkBaudrate
+        self.lineNoise = lineNoise
+
+        self.finger = None
+        self.imageBuffer = bytearray(self.imgBufferSize)
+        self.charBuffers = {1: bytearray(self.chrBufferSize), 2: bytearray(self.chrBufferSize)}
+        self.library = {}
+        self.notepad = [bytearray(self.notepadPageSize) for _ in range(self.notepadPages)]
+
+        self._lock = threading.Lock()
+        # Notified when a reply is queued or the port closes
+        self._replied = threading.Condition(self._lock)
+        self._framer = FramedTransport(None, address)
+        self._rx = bytearray()
+        self._tx = []
+        self._txReady = 0
+        self._delay = 0
+        self._download = None
+        self._random = random.Random(0x1F)
+        self._noise = random.Random(0x2E)
+
+        self._handlers = {FINGERPRINT_GETIMAGE: self._getImage,
+                          FINGERPRINT_IMAGE2TZ: self._image2Tz,
+                          FINGERPRINT_MATCH: self._match,
+                          FINGERPRINT_SEARCH: self._search,
+                          FINGERPRINT_HISPEEDSEARCH: self._search,
+                          FINGERPRINT_REGMODEL: self._createModel,
+                          FINGERPRINT_STORE: self._store,
+                          FINGERPRINT_LOADCHAR: self._loadChar,
+                          FINGERPRINT_UPCHAR: self._uploadChar,
+                          FINGERPRINT_DOWNCHAR: self._downloadChar,
+                          FINGERPRINT_UPIMG: self._uploadImage,
+                          FINGERPRINT_DOWNIMG: self._downloadImage,
+                          FINGERPRINT_DELCHAR: self._deleteChar,
+                          FINGERPRINT_EMPTY: self._empty,
+                          FINGERPRINT_SETSYSPARA: self._setSystemParameter,
+                          FINGERPRINT_READSYSPARA: self._readSystemParameters,
+                          FINGERPRINT_SETPASSWORD: self._setPassword,
+                          FINGERPRINT_VERIFYPASSWORD: self._verifyPassword,
+                          FINGERPRINT_GETRANDOMCODE: self._getRandomCode,
+                          FINGERPRINT_SETADDR: self._setAddress,
+                          FINGERPRINT_GETHWINFO: self._getHWinfo,
+                          FINGERPRINT_WRITENOTE: self._writeNotepad,
+                          FINGERPRINT_READNOTE: self._readNotepad,
+                          FINGERPRINT_TEMPLATECOUNT: self._getTemplateCount,
+                          FINGERPRINT_READCONTLIST: self._readContList}
+
+    ### Finger handling
+    @staticmethod
+    def makeFinger(seed):
+        """ Generate a repeatable pseudo random finger image for seed"""
+        rng = random.Random(seed)
+        return bytearray(rng.getrandbits(8) for _ in range(ZFM20xSimulator.imgBufferSize))
+
+    def placeFinger(self, image):
+        """ Put a finger on the sensor, image is a imgBufferSize packed image"""
+        if len(image) != self.imgBufferSize:
+            raise ValueError('A finger image must be %d bytes' % self.imgBufferSize)
+        self.finger = bytearray(image)
+
+    def removeFinger(self):
+        self.finger = None
+
+    ### Serial port interface
+    @property
+    def deviceBaudrate(self):
+        return self.baudMultiplier * 9600
+
+    @property
+    def in_waiting(self):
+        now = time.time()
+        with self._lock:
+            return sum(len(chunk) for ready, chunk in self._tx if ready <= now)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self._lock:
+            self.is_open = False
+            self._replied.notify_all()
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._tx = []
+
+    flushInput = reset_input_buffer
+
+    def write(self, data):
+        if not self.is_open:
+            raise IOError('Port %s is closed' % self.port)
+        with self._lock:
+            # Both ends must agree on the baud rate to understand each other
+            if self.baudrate == self.deviceBaudrate and self._linkOk():
+                self._rx.extend(bytearray(data))
+                self._process()
+        return len(data)
+
+    def _linkOk(self):
+        return self.maxLinkBaudrate is None or self.deviceBaudrate <= self.maxLinkBaudrate
+
+    def read(self, size=1):
+        """ Read up to size bytes, waiting for replies that are still in flight
+        Like a serial port: with a timeout it returns fewer bytes when no more
+        data shows up in time, with timeout 0 it returns what is there, and
+        with no timeout it blocks until size bytes arrived.
+        """
+        if not self.is_open:
+            raise IOError('Port %s is closed' % self.port)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        data = bytearray()
+        with self._lock:
+            while True:
+                now = time.time()
+                while self._tx and self._tx[0][0] <= now and len(data) < size:
+                    ready, chunk = self._tx[0]
+                    take = size - len(data)
+                    data.extend(chunk[:take])
+                    if take >= len(chunk):
+                        self._tx.pop(0)
+                    else:
+                        self._tx[0] = (ready, chunk[take:])
+                if len(data) >= size or (deadline is not None and now >= deadline):
+                    break
+                if not self.is_open:
+                    raise IOError('Port %s was closed' % self.port)
+                # Until the next reply is due, the deadline or a new reply
+                wait = self._tx[0][0] - now if self._tx else None
+                if deadline is not None and (wait is None or deadline - now < wait):
+                    wait = deadline - now
+                self._replied.wait(wait)
+        return bytes(data)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    ### Protocol
+    def _process(self):
+        """ Handle every complete frame received so far"""
+        rx = self._rx
+        while True:
+            start = rx.find(b'\xef\x01')
+            if start < 0:
+                del rx[:max(0, len(rx) - 1)]
+                return
+            del rx[:start]
+            if len(rx) < 9:
+                return
+            length = (rx[7] << 8) + rx[8]
+            if len(rx) < 9 + length:
+                return
+            frame = rx[:9 + length]
+            del rx[:9 + length]
+            address = struct.unpack('>I', bytes(frame[2:6]))[0]
+            if address != self.address:
+                continue
+            chksum = (frame[-2] << 8) + frame[-1]
+            if sum(frame[6:-2]) & 0xFFFF != chksum:
+                self._ack(FINGERPRINT_PACKETRECIEVEERR)
+                continue
+            self._handleFrame(frame[6], frame[9:-2])
+
+    def _handleFrame(self, packetType, payload):
+        if self._download is not None:
+            if packetType in (FINGERPRINT_DATAPACKET, FINGERPRINT_ENDDATAPACKET):
+                target, offset = self._download
+                target[offset:offset + len(payload)] = payload
+                self._download = (target, offset + len(payload))
+                if packetType == FINGERPRINT_ENDDATAPACKET:
+                    self._download = None
+                return
+            self._download = None
+        if packetType != FINGERPRINT_COMMANDPACKET or not payload:
+            return
+        command = payload[0]
+        self._delay = self.latency.get(command, 0)
+        handler = self._handlers.get(command)
+        if handler is None:
+            self._ack(FINGERPRINT_PACKETRECIEVEERR)
+        elif not self.verified and command not in (FINGERPRINT_VERIFYPASSWORD, FINGERPRINT_GETHWINFO):
+            self._ack(FINGERPRINT_PASSVERIFY)
+        else:
+            handler(payload[1:])
+
+    def _send(self, packetType, payload):
+        frame = self._framer.encode(packetType, payload)
+        if self.lineNoise and self._noise.random() < self.lineNoise:
+            self._damage(frame)
+        now = time.time()
+        ready = max(now, self._txReady) + self._delay
+        self._delay = 0
+        if self.throttle:
+            ready += len(frame) * 10.0 / self.deviceBaudrate
+        self._txReady = ready
+        self._tx.append((ready, frame))
+        self._replied.notify_all()
+
+    def _damage(self, frame):
+        """ Flip one bit or drop one byte of frame"""
+        offset = self._noise.randrange(len(frame))
+        if self._noise.random() < 0.5:
+            frame[offset] ^= 1 << self._noise.randrange(8)
+        else:
+            del frame[offset]
+
+    def _ack(self, code, data=b''):
+        self._send(FINGERPRINT_ACKPACKET, bytearray([code]) + bytearray(data))
+
+    def _sendData(self, data):
+        """ Send data split in packets of the current package size"""
+        size = self.packageSizeDict[self.packageSize]
+        for offset in range(0, len(data), size):
+            last = offset + size >= len(data)
+            self._send(FINGERPRINT_ENDDATAPACKET if last else FINGERPRINT_DATAPACKET, data[offset:offset + size])
+
+    def _charBuffer(self, bufferID):
+        return self.charBuffers[bufferID if bufferID in self.charBuffers else 1]
+
+    def _features(self, image):
+        """ A char file derived only from the image contents"""
+        digest = b''
+        for i in range(self.chrBufferSize // 64):
+            digest += hashlib.sha512(bytes(image) + bytes(bytearray([i]))).digest()
+        return bytearray(digest)
+
+    @staticmethod
+    def _word(data, offset):
+        return (data[offset] << 8) + data[offset + 1]
+
+    ### Command handlers
+    def _getImage(self, args):
+        if self.finger is None:
+            self._ack(FINGERPRINT_NOFINGER)
+            return
+        self.imageBuffer[:] = self.finger
+        self._ack(FINGERPRINT_OK)
+
+    def _image2Tz(self, args):
+        if not any(self.imageBuffer):
+            self._ack(FINGERPRINT_FEATUREFAIL)
+            return
+        self._charBuffer(args[0])[:] = self._features(self.imageBuffer)
+        self._ack(FINGERPRINT_OK)
+
+    def _match(self, args):
+        if self.charBuffers[1] == self.charBuffers[2]:
+            self._ack(FINGERPRINT_OK, struct.pack('>H', 200))
+        else:
+            self._ack(FINGERPRINT_NOMATCH, struct.pack('>H', 0))
+
+    def _search(self, args):
+        template = self._charBuffer(args[0])
+        startPage = self._word(args, 1)
+        pageNumber = self._word(args, 3)
+        for pageID in sorted(self.library):
+            if startPage <= pageID < startPage + pageNumber and self.library[pageID] == template:
+                self._ack(FINGERPRINT_OK, struct.pack('>HH', pageID, 200))
+                return
+        self._ack(FINGERPRINT_NOTFOUND, struct.pack('>HH', 0, 0))
+
+    def _createModel(self, args):
+        if self.charBuffers[1] != self.charBuffers[2]:
+            self._ack(FINGERPRINT_ENROLLMISMATCH)
+            return
+        self._ack(FINGERPRINT_OK)
+
+    def _store(self, args):
+        pageID = self._word(args, 1)
+        if pageID >= self.librarySize:
+            self._ack(FINGERPRINT_BADLOCATION)
+            return
+        self.library[pageID] = bytearray(self._charBuffer(args[0]))
+        self._ack(FINGERPRINT_OK)
+
+    def _loadChar(self, args):
+        pageID = self._word(args, 1)
+        if pageID >= self.librarySize:
+            self._ack(FINGERPRINT_BADLOCATION)
+        elif pageID not in self.library:
+            self._ack(FINGERPRINT_DBRANGEFAIL)
+        else:
+            self._charBuffer(args[0])[:] = self.library[pageID]
+            self._ack(FINGERPRINT_OK)
+
+    def _uploadChar(self, args):
+        self._ack(FINGERPRINT_OK)
+        self._sendData(self._charBuffer(args[0]))
+
+    def _downloadChar(self, args):
+        self._download = (self._charBuffer(args[0]), 0)
+        self._ack(FINGERPRINT_OK)
+
+    def _uploadImage(self, args):
+        self._ack(FINGERPRINT_OK)
+        self._sendData(self.imageBuffer)
+
+    def _downloadImage(self, args):
+        self._download = (self.imageBuffer, 0)
+        self._ack(FINGERPRINT_OK)
+
+    def _deleteChar(self, args):
+        pageID = self._word(args, 0)
+        count = self._word(args, 2)
+        if pageID + count > self.librarySize:
+            self._ack(FINGERPRINT_DELETEFAIL)
+            return
+        for page in range(pageID, pageID + count):
+            self.library.pop(page, None)
+        self._ack(FINGERPRINT_OK)
+
+    def _empty(self, args):
+        self.library.clear()
+        self._ack(FINGERPRINT_OK)
+
+    def _setSystemParameter(self, args):
+        parameter, content = args[0], args[1]
+        if parameter == FINGERPRINT_PARAM_BAUDRATE and 1 <= content <= 12:
+            # The acknowledge still goes out at the old baud rate
+            self._ack(FINGERPRINT_OK)
+            self.baudMultiplier = content
+        elif parameter == FINGERPRINT_PARAM_SECURITYLEVEL and 1 <= content <= 5:
+            self.securityLevel = content
+            self._ack(FINGERPRINT_OK)
+        elif parameter == FINGERPRINT_PARAM_PACKAGESIZE and 0 <= content <= 3:
+            self.packageSize = content
+            self._ack(FINGERPRINT_OK)
+        else:
+            self._ack(FINGERPRINT_INVALIDREG)
+
+    def _systemParameters(self):
+        return struct.pack('>HHHHIHH', self.statusRegister, self.sysIdentifier, self.librarySize,
+                           self.securityLevel, self.address, self.packageSize, self.baudMultiplier)
+
+    def _readSystemParameters(self, args):
+        self._ack(FINGERPRINT_OK, self._systemParameters())
+
+    def _setPassword(self, args):
+        self.password = struct.unpack('>I', bytes(args[:4]))[0]
+        self._ack(FINGERPRINT_OK)
+
+    def _verifyPassword(self, args):
+        if struct.unpack('>I', bytes(args[:4]))[0] == self.password:
+            self.verified = True
+            self._ack(FINGERPRINT_OK)
+        else:
+            self._ack(FINGERPRINT_PASSFAIL)
+
+    def _getRandomCode(self, args):
+        self._ack(FINGERPRINT_OK, struct.pack('>I', self._random.getrandbits(32)))
+
+    def _setAddress(self, args):
+        newAddress = struct.unpack('>I', bytes(args[:4]))[0]
+        # Acknowledged from the old address
+        self._ack(FINGERPRINT_OK, struct.pack('>I', newAddress))
+        self.address = newAddress
+        self._framer.address = newAddress
+
+    def _getHWinfo(self, args):
+        info = bytearray(self._systemParameters())
+        info.extend(bytearray(28 - len(info)))
+        for text in (self.productType, self.version, self.manufacturer, self.sensor):
+            info.extend(bytearray(text[:8].ljust(8).encode('ascii')))
+        info.extend(bytearray(512 - len(info)))
+        self._ack(FINGERPRINT_OK)
+        for offset in range(0, 512, 128):
+            last = offset + 128 >= 512
+            self._send(FINGERPRINT_ENDDATAPACKET if last else FINGERPRINT_DATAPACKET, info[offset:offset + 128])
+
+    def _writeNotepad(self, args):
+        pageNumber = args[0]
+        if pageNumber >= self.notepadPages:
+            self._ack(FINGERPRINT_INVALIDREG)
+            return
+        data = args[1:1 + self.notepadPageSize]
+        self.notepad[pageNumber][:] = data + bytearray(self.notepadPageSize - len(data))
+        self._ack(FINGERPRINT_OK)
+
+    def _readNotepad(self, args):
+        pageNumber = args[0]
+        if pageNumber >= self.notepadPages:
+            self._ack(FINGERPRINT_INVALIDREG, bytearray(self.notepadPageSize))
+            return
+        self._ack(FINGERPRINT_OK, self.notepad[pageNumber])
+
+    def _getTemplateCount(self, args):
+        self._ack(FINGERPRINT_OK, struct.pack('>H', len(self.library)))
+
+    def _readContList(self, args):
+        """ Index table: one bit per page, 256 pages per index page"""
+        first = args[0] * 256
+        table = bytearray(32)
+        for pageID in self.library:
+            if first <= pageID < first + 256:
+                table[(pageID - first) // 8] |= 1 << ((pageID - first) % 8)
+        self._ack(FINGERPRINT_OK, table)
@@ -0,0 +1,198 @@
+""" Host side template store (Python 3)
+
+A TemplateStore is a memory-mapped file of fixed size records, one per page
+ID of the finger library, each holding a chrBufferSize char file and a bit
+of metadata. Records are read and written in place, so exporting a whole
+library streams every char file from the sensor straight into the file:
+
+    with TemplateStore('site.zfmt', capacity=board.databaseCount) as store:
+        exportLibrary(board, store)
+    ...
+    with TemplateStore('site.zfmt') as store:
+        importLibrary(newBoard, store)
+
+File layout (little endian): a 16 byte header (magic 'ZFMT', format version,
+capacity, record size) followed by capacity records of
+
+    used (1) | pad (3) | crc32 of the template (4) | stored time (8 double) |
+    label (32, utf-8, zero padded) | template (chrBufferSize)
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from .commands import *
+from .pyzfm20x import ZFM20x
+
+
+class TemplateStore(object):
+    """Fixed record, memory-mapped store of char files indexed by page ID"""
+
+    magic = b'ZFMT'
+    formatVersion = 1
+    templateSize = ZFM20x.chrBufferSize
+    labelSize = 32
+
+    _header = struct.Struct('<4sHHI4x')
+    _recordHeader = struct.Struct('<B3xId32s')
+
+    def __init__(self, filename, capacity=1000):
+        """ Open filename, creating it with room for capacity templates if it doesn't exist"""
+        self.filename = filename
+        self.recordSize = self._recordHeader.size + self.templateSize
+        if not os.path.exists(filename):
+            with open(filename, 'wb') as f:
+                f.write(self._header.pack(self.magic, self.formatVersion, 0, self.recordSize))
+                f.truncate(self._header.size + capacity * self.recordSize)
+            self._file = open(filename, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self.capacity = capacity
+            self._writeHeader()
+        else:
+            self._file = open(filename, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, version, self.capacity, recordSize = self._header.unpack_from(self._map, 0)
+            if magic != self.magic or version != self.formatVersion or recordSize != self.recordSize:
+                self.close()
+                raise ValueError('%s is not a version %d template store' % (filename, self.formatVersion))
+        self._view = memoryview(self._map)
+
+    def _writeHeader(self):
+        self._header.pack_into(self._map, 0, self.magic, self.formatVersion, self.capacity, self.recordSize)
+
+    def _offset(self, pageID):
+        if not 0 <= pageID < self.capacity:
+            raise IndexError('Page %d out of range, capacity is %d' % (pageID, self.capacity))
+        return self._header.size + pageID * self.recordSize
+
+    ### Records
+    def templateView(self, pageID):
+        """ Writable memoryview of the template bytes of pageID, backed by the file"""
+        offset = self._offset(pageID) + self._recordHeader.size
+        return self._view[offset:offset + self.templateSize]
+
+    def put(self, pageID, template=None, label='', stored=None):
+        """ Mark pageID used and record its metadata
+        template is copied into the record, leave it None when it was already
+        written through templateView.
+        """
+        view = self.templateView(pageID)
+        if template is not None:
+            if len(template) != self.templateSize:
+                raise ValueError('A template must be %d bytes' % self.templateSize)
+            view[:] = bytes(bytearray(template))
+        if stored is None:
+            stored = time.time()
+        crc = zlib.crc32(view.tobytes()) & 0xFFFFFFFF
+        self._recordHeader.pack_into(self._map, self._offset(pageID), 1, crc, stored,
+                                     label.encode('utf-8')[:self.labelSize])
+
+    def get(self, pageID):
+        """ The template stored at pageID as bytes, or None if the page is empty"""
+        if pageID not in self:
+            return None
+        return self.templateView(pageID).tobytes()
+
+    def meta(self, pageID):
+        """ Metadata of pageID as a dict, or None if the page is empty"""
+        used, crc, stored, label = self._recordHeader.unpack_from(self._map, self._offset(pageID))
+        if not used:
+            return None
+        return {'pageID': pageID,
+                'crc': crc,
+                'stored': stored,
+                'label': label.rstrip(b'\0').decode('utf-8')}
+
+    def verify(self, pageID):
+        """ Check the template at pageID against its stored crc"""
+        meta = self.meta(pageID)
+        return meta is not None and zlib.crc32(self.templateView(pageID).tobytes()) & 0xFFFFFFFF == meta['crc']
+
+    def delete(self, pageID):
+        offset = self._offset(pageID)
+        self._map[offset:offset + self.recordSize] = b'\0' * self.recordSize
+
+    def pages(self):
+        """ Page IDs of the used records, in order"""
+        for pageID in range(self.capacity):
+            if self._used(pageID):
+                yield pageID
+
+    def _used(self, pageID):
+        return self._map[self._offset(pageID)] not in (0, b'\0')
+
+    def __contains__(self, pageID):
+        return 0 <= pageID < self.capacity and self._used(pageID)
+
+    def __len__(self):
+        return sum(1 for _ in self.pages())
+
+    ### File handling
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._view = None
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def exportLibrary(board, store, pages=None, progress=None):
+    """ Copy every template in the board's flash library into store
+    pages limits the export to those page IDs, by default every used page of
+    the library is exported. Pages that turn out to be empty are cleared in
+    the store. Each char file is uploaded straight into its record.
+    progress(pageID, ack) is called after each page. Returns the number of
+    templates exported.
+    """
+    if pages is None:
+        occupancy = board.getOccupancy()
+        if occupancy is None:
+            pages = range(min(board.databaseCount, store.capacity))
+        else:
+            pages = [pageID for pageID in occupancy.usedPages() if pageID < store.capacity]
+    count = 0
+    for pageID in pages:
+        ack = board.loadChar(1, pageID)
+        if ack == FINGERPRINT_OK:
+            ack = board.uploadCharInto(1, store.templateView(pageID)).ack
+        if ack == FINGERPRINT_OK:
+            store.put(pageID, label=board.name)
+            count += 1
+        elif pageID in store:
+            store.delete(pageID)
+        if progress is not None:
+            progress(pageID, ack)
+    store.flush()
+    return count
+
+
+def importLibrary(board, store, pages=None, progress=None):
+    """ Write the templates in store to the board's flash library
+    Every used record (or only pages) is downloaded to CharBuffer1 and
+    stored at its page ID. progress(pageID, ack) is called after each page.
+    Returns the number of templates imported.
+    """
+    if pages is None:
+        pages = store.pages()
+    count = 0
+    for pageID in pages:
+        ack = board.downloadChar(1, store.templateView(pageID))
+        if ack == FINGERPRINT_OK:
+            ack = board.store(pageID)
+        if ack == FINGERPRINT_OK:
+            count += 1
+        if progress is not None:
+            progress(pageID, ack)
+    return count
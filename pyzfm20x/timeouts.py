@@ -0,0 +1,111 @@
+""" Per command read timeouts learned from observed latency
+
+A reply that never comes blocks a port opened without a timeout forever,
+and a single timeout for every command is either too short for getImage and
+search or far too long for getTemplateCount. A TimeoutPolicy gives every
+command its own budget: a default until enough replies were seen, then a
+high percentile of the observed latency times a margin:
+
+    ZFM20x.timeoutPolicy = TimeoutPolicy()
+
+ZFM20x sets the port read timeout to the budget of each command before
+sending it, and within a deadline (see ZFM20x.deadline) to whatever is
+left of the deadline if that is shorter. What is learned is the time from
+sending a command to its acknowledge, the same for every command. The data
+packets that follow (uploadImage, uploadChar, getHWinfo) are read with a
+data budget computed from the size of a packet and the baud rate instead,
+so transfers keep working when the acknowledge budget is short. An
+acknowledge that timed out counts as a reply that took the whole budget:
+when a command starts taking longer, its budget grows back.
+"""
+import bisect
+import threading
+
+from .commands import *
+from .instrumentation import CommandStats, defaultBuckets
+
+# Budgets in seconds until a command has been seen minSamples times
+defaultBudgets = {FINGERPRINT_GETIMAGE: 1.0,
+                  FINGERPRINT_IMAGE2TZ: 1.0,
+                  FINGERPRINT_MATCH: 1.0,
+                  FINGERPRINT_SEARCH: 2.0,
+                  FINGERPRINT_HISPEEDSEARCH: 1.0,
+                  FINGERPRINT_REGMODEL: 1.0,
+                  FINGERPRINT_STORE: 1.0,
+                  FINGERPRINT_EMPTY: 2.0,
+                  FINGERPRINT_DELCHAR: 1.0,
+                  FINGERPRINT_UPIMG: 2.0,
+                  FINGERPRINT_DOWNIMG: 2.0,
+                  FINGERPRINT_UPCHAR: 1.0,
+                  FINGERPRINT_DOWNCHAR: 1.0,
+                  FINGERPRINT_WRITENOTE: 1.0}
+defaultBudget = 0.5
+# Seconds added to the time a data packet takes on the wire
+defaultDataSlack = 0.1
+# Bits on the wire per byte, start and stop bits included
+bitsPerByte = 10
+
+
+class TimeoutPolicy(object):
+    """Read timeout budgets per command code"""
+
+    def __init__(self, percentile=99, margin=2.0, minimum=0.05, maximum=10.0, minSamples=20,
+                 budgets=None, buckets=defaultBuckets, dataSlack=defaultDataSlack):
+        """
+        Once a command was seen minSamples times its budget is the percentile
+        latency times margin, kept between minimum and maximum seconds.
+        budgets overrides defaultBudgets, by command code. A data packet may
+        take margin times its time on the wire plus dataSlack seconds.
+        """
+        self.percentile = percentile
+        self.margin = margin
+        self.minimum = minimum
+        self.maximum = maximum
+        self.minSamples = minSamples
+        self.budgets = dict(defaultBudgets)
+        if budgets:
+            self.budgets.update(budgets)
+        self.buckets = tuple(buckets)
+        self.dataSlack = dataSlack
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def budget(self, command):
+        """ Read timeout in seconds for command"""
+        stats = self._stats.get(command)
+        if stats is None or stats.count < self.minSamples:
+            return self.budgets.get(command, defaultBudget)
+        with self._lock:
+            latency = stats.percentile(self.buckets, self.percentile)
+        return min(self.maximum, max(self.minimum, latency * self.margin))
+
+    def dataBudget(self, frameSize, baudrate):
+        """ Read timeout in seconds for a data packet of frameSize bytes at baudrate
+        An unknown baudrate (None) is taken as the slowest, 9600.
+        """
+        seconds = frameSize * bitsPerByte / float(baudrate or 9600)
+        return min(self.maximum, seconds * self.margin + self.dataSlack)
+
+    def record(self, command, latency):
+        """ Learn from a command that got its acknowledge after latency seconds"""
+        with self._lock:
+            stats = self._stats.get(command)
+            if stats is None:
+                stats = self._stats[command] = CommandStats(self.buckets)
+            stats.count += 1
+            stats.totalLatency += latency
+            if latency > stats.maxLatency:
+                stats.maxLatency = latency
+            stats.histogram[bisect.bisect_left(self.buckets, latency)] += 1
+
+    def timedOut(self, command, budget):
+        """ Learn from a command whose acknowledge didn't come within budget seconds
+        It took at least that long, which pulls the percentile up once
+        timeouts are more than the percentile leaves out.
+        """
+        if budget is not None:
+            self.record(command, budget)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
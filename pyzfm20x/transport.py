@@ -0,0 +1,219 @@
+import struct
+import serial
+from .commands import *
+
+
+def openPort(port, baudrate, timeout=None):
+    """ Open a serial port by name, or use port as is if it's already a port object
+    Anything that behaves like serial.Serial can be used as a port: it needs
+    read(size), write(data), inWaiting(), close() and the port, baudrate and
+    timeout attributes. ZFM20xSimulator is one of those. timeout is the read
+    timeout in seconds, None blocks until the bytes arrive.
+    """
+    if hasattr(port, 'read') and hasattr(port, 'write'):
+        if timeout is not None:
+            port.timeout = timeout
+        return port
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+
+if str is bytes:
+    # Python 2 memoryviews iterate as one character strings
+    def _checksum(data):
+        return sum(bytearray(data))
+else:
+    _checksum = sum
+
+
+class TransportTimeout(IOError):
+    """Raised when the port stops delivering bytes in the middle of a frame"""
+    pass
+
+
+class DeadlineExceeded(TransportTimeout):
+    """Raised when a command can't be answered before the deadline it was sent under"""
+    pass
+
+
+class FrameError(IOError):
+    """Raised for a frame that was received in full but is corrupted"""
+
+    def __init__(self, message, frame=None):
+        IOError.__init__(self, message)
+        self.frame = frame
+
+
+class FramedTransport(object):
+    """Frame-at-a-time packet I/O over a serial-like port
+
+    A whole packet is encoded into a single buffer and sent with one write,
+    and every reply is read with two bulk reads: the fixed 9 byte header
+    (start code, address, packet id, length) and then length bytes of data
+    plus checksum.
+
+    A header with the wrong start code, address, packet id or length means
+    the stream is out of step: bytes are dropped up to the next start code
+    and the header is read again from there. A frame whose checksum doesn't
+    match is consumed and reported with a FrameError, so the next read starts
+    on the following frame. droppedBytes and corruptFrames count both.
+
+    A frame that lost a byte on the way is only given up on when a read
+    times out, so the port needs a finite read timeout (ZFM20x sets one by
+    default): without one the read waits forever for the missing byte.
+    """
+
+    headerSize = 9
+    startCode = b'\xef\x01'
+    replyTypes = (FINGERPRINT_ACKPACKET, FINGERPRINT_DATAPACKET, FINGERPRINT_ENDDATAPACKET)
+    # Largest data package plus the checksum
+    maxLength = 256 + 2
+
+    def __init__(self, port, address=0xFFFFFFFF):
+        self.port = port
+        self.address = address
+        self.droppedBytes = 0
+        self.corruptFrames = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    @property
+    def address(self):
+        return self._address
+
+    @address.setter
+    def address(self, address):
+        """ The start code + address prefix is the same for every packet, so cache it"""
+        self._address = address
+        self._prefix = struct.pack('>HI', FINGERPRINT_STARTCODE, address & 0xFFFFFFFF)
+
+    def encode(self, packetType, packet):
+        """ Encode a packet into a complete frame, checksum included"""
+        length = len(packet) + 2
+        frame = bytearray(self._prefix)
+        frame.append(packetType & 0xFF)
+        frame.append((length >> 8) & 0xFF)
+        frame.append(length & 0xFF)
+        frame.extend(packet)
+        # Checksum covers packet id, length and data
+        chksum = sum(frame[6:])
+        frame.append((chksum >> 8) & 0xFF)
+        frame.append(chksum & 0xFF)
+        return frame
+
+    def writePacket(self, packetType, packet):
+        """ Write a packet to the port with a single write"""
+        self._write(self.encode(packetType, packet))
+
+    def send(self, packet):
+        """ Write a Packet"""
+        self._write(self.encode(packet.packetType, packet.payload))
+
+    def _write(self, frames):
+        self.bytesSent += len(frames)
+        self.port.write(bytes(frames))
+
+    def writeData(self, data, packetSize):
+        """ Send data split in data packets of packetSize, the last one as an end packet
+        All the frames go out in a single write.
+        """
+        view = memoryview(data)
+        frames = bytearray()
+        for offset in range(0, len(view), packetSize):
+            last = offset + packetSize >= len(view)
+            packetType = FINGERPRINT_ENDDATAPACKET if last else FINGERPRINT_DATAPACKET
+            frames.extend(self.encode(packetType, view[offset:offset + packetSize]))
+        self._write(frames)
+
+    def read(self, size):
+        """ Read exactly size bytes from the port"""
+        data = bytearray()
+        # Every read that comes back short waited a whole timeout, give up on the first empty one
+        while len(data) < size:
+            chunk = self.port.read(size - len(data))
+            if not chunk:
+                self.bytesReceived += len(data)
+                raise TransportTimeout('Expected %d bytes from %s, got %d' % (size, self.port.port, len(data)))
+            data.extend(chunk)
+        self.bytesReceived += size
+        return data
+
+    def readInto(self, view):
+        """ Fill a writable memoryview from the port without building temporary lists"""
+        size = len(view)
+        got = 0
+        readinto = getattr(self.port, 'readinto', None)
+        while got < size:
+            if readinto is not None:
+                n = readinto(view[got:])
+            else:
+                chunk = self.port.read(size - got)
+                n = len(chunk)
+                view[got:got + n] = chunk
+            if not n:
+                self.bytesReceived += got
+                raise TransportTimeout('Expected %d bytes from %s, got %d' % (size, self.port.port, got))
+            got += n
+        self.bytesReceived += got
+        return got
+
+    def validHeader(self, header):
+        """ Whether header can start a reply to us"""
+        return (header[:6] == self._prefix and header[6] in self.replyTypes and
+                2 < (header[7] << 8) + header[8] <= self.maxLength)
+
+    def resyncOffset(self, header):
+        """ Number of bytes of a bad header to drop to get to the next possible start code"""
+        start = header.find(self.startCode, 1)
+        if start >= 0:
+            return start
+        # The start code may be split across this read and the next
+        return len(header) - 1 if header[-1] == 0xEF else len(header)
+
+    def checkFrame(self, frame):
+        """ Raise FrameError if the checksum of a complete frame doesn't match"""
+        if _checksum(memoryview(frame)[6:-2]) & 0xFFFF != (frame[-2] << 8) + frame[-1]:
+            self._corrupt(frame)
+
+    def _corrupt(self, frame):
+        self.corruptFrames += 1
+        raise FrameError('Bad checksum in a frame from %s' % getattr(self.port, 'port', self.port), frame)
+
+    def readHeader(self):
+        """ Read the header of the next frame, resynchronizing on the start code if needed"""
+        header = self.read(self.headerSize)
+        while not self.validHeader(header):
+            drop = self.resyncOffset(header)
+            self.droppedBytes += drop
+            del header[:drop]
+            header.extend(self.read(self.headerSize - len(header)))
+        return header
+
+    def readPacketInto(self, view):
+        """ Read one frame, writing its data straight into view
+        Returns the packet id and the number of data bytes written. A bad
+        checksum raises FrameError once the frame has been read.
+        """
+        header = self.readHeader()
+        size = (header[7] << 8) + header[8] - 2
+        if size > len(view):
+            raise ValueError('Packet of %d bytes does not fit in a %d byte buffer' % (size, len(view)))
+        self.readInto(view[:size])
+        chksum = self.read(2)
+        if (_checksum(header[6:]) + _checksum(view[:size])) & 0xFFFF != (chksum[0] << 8) + chksum[1]:
+            self._corrupt(header + bytearray(view[:size]) + chksum)
+        return header[6], size
+
+    def readPacket(self):
+        """ Read one frame: header first, then data and checksum"""
+        reply = self.readHeader()
+        length = (reply[7] << 8) + reply[8]
+        reply.extend(self.read(length))
+        self.checkFrame(reply)
+        return reply
+
+    def discardInput(self):
+        """ Drop whatever is left of a reply that won't be read"""
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+        else:
+            self.port.flushInput()
@@ -0,0 +1,261 @@
+""" Record the traffic with a sensor and replay it later
+
+TraceRecorder sits between ZFM20x and its port and logs every write and
+every read with its time into a compact binary trace:
+
+    recorder = TraceRecorder('/dev/ttyUSB0', 'session.zfmw')
+    board = ZFM20x(recorder)
+    ...
+    recorder.close()
+
+ReplayPort plays a trace back as if it were the sensor, at the original
+speed or faster, so a production session (enrollments, image uploads, error
+bursts) can be profiled offline and different library versions can be run
+against identical traffic:
+
+    board = ZFM20x(ReplayPort('session.zfmw', speed=10))
+
+Bytes are recorded as they cross the port, before any framing, so garbled
+frames and resynchronizations replay exactly as they happened.
+
+File format (little endian): a 16 byte header (magic 'ZFMW', version, start
+time as a double) followed by one event per read, write or input flush:
+
+    time since start (8 double) | kind (1) | length (4) | length bytes
+"""
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from .transport import openPort
+
+WRITE = 0
+READ = 1
+FLUSH = 2
+
+
+class TraceEvent(namedtuple('TraceEvent', 'time kind data')):
+    """One port operation: seconds since the start of the trace, WRITE/READ/FLUSH and the bytes"""
+    __slots__ = ()
+
+
+class TraceMismatch(IOError):
+    """Raised by a strict ReplayPort when the host writes something else than the trace holds"""
+    pass
+
+
+_header = struct.Struct('<4sHxxd')
+_event = struct.Struct('<dBI')
+magic = b'ZFMW'
+formatVersion = 1
+
+
+def readTrace(filename):
+    """ The start time and events of a trace file"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < _header.size:
+        raise ValueError('%s is not a wire trace' % filename)
+    fileMagic, version, started = _header.unpack_from(data)
+    if fileMagic != magic or version != formatVersion:
+        raise ValueError('%s is not a version %d wire trace' % (filename, formatVersion))
+    events = []
+    offset = _header.size
+    # A trace cut short by a crash ends on the last complete event
+    while offset + _event.size <= len(data):
+        at, kind, length = _event.unpack_from(data, offset)
+        offset += _event.size
+        if offset + length > len(data):
+            break
+        events.append(TraceEvent(at, kind, bytes(data[offset:offset + length])))
+        offset += length
+    return started, events
+
+
+class TraceRecorder(object):
+    """Serial-like port that logs everything going through another port"""
+
+    def __init__(self, port, filename, baudrate=57600, timeout=None):
+        """ port is a port name or an open port object, as for ZFM20x"""
+        self.sp = openPort(port, baudrate, timeout)
+        self._lock = threading.Lock()
+        self._file = open(filename, 'wb')
+        self.started = time.time()
+        self._file.write(_header.pack(magic, formatVersion, self.started))
+
+    def _log(self, kind, data):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(_event.pack(time.time() - self.started, kind, len(data)))
+                self._file.write(data)
+
+    @property
+    def port(self):
+        return self.sp.port
+
+    @property
+    def baudrate(self):
+        return self.sp.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self.sp.baudrate = baudrate
+
+    @property
+    def timeout(self):
+        return self.sp.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.sp.timeout = timeout
+
+    def write(self, data):
+        self._log(WRITE, bytes(data))
+        return self.sp.write(data)
+
+    def read(self, size=1):
+        data = self.sp.read(size)
+        # Short and empty reads are kept too, they are timeouts
+        self._log(READ, bytes(data))
+        return data
+
+    def inWaiting(self):
+        return self.sp.inWaiting()
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def reset_input_buffer(self):
+        self._log(FLUSH, b'')
+        if hasattr(self.sp, 'reset_input_buffer'):
+            self.sp.reset_input_buffer()
+        else:
+            self.sp.flushInput()
+
+    flushInput = reset_input_buffer
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """ Close the trace and the port"""
+        with self._lock:
+            self._file.close()
+        self.sp.close()
+
+
+class ReplayPort(object):
+    """Serial-like port that answers the host with the reads of a trace
+
+    Every write of the host moves the replay to the matching write of the
+    trace, and the reads recorded after it are served, each one once as much
+    time has passed since the write as in the recording, divided by speed.
+    With speed None they are served at once. Reads stop at the next recorded
+    write: like a port with a timeout, they return fewer bytes.
+
+    Writes are compared with the trace, differences are counted in
+    mismatches, or raise TraceMismatch when strict.
+    """
+
+    def __init__(self, trace, speed=1.0, strict=False, port=None):
+        """ trace is a trace file name or a list of TraceEvents"""
+        if isinstance(trace, (list, tuple)):
+            self.events = list(trace)
+            self.port = port or 'replay'
+        else:
+            self.events = readTrace(trace)[1]
+            self.port = port or 'replay://%s' % trace
+        self.speed = speed
+        self.strict = strict
+        self.baudrate = None
+        self.timeout = None
+        self.mismatches = 0
+        self._position = 0
+        self._pending = b''
+        # Wall time and trace time of the last write, reads are timed from it
+        self._anchor = (time.time(), 0.0)
+
+    def _due(self, event):
+        """ Wall clock time at which a recorded read is available"""
+        if not self.speed:
+            return 0
+        now, at = self._anchor
+        return now + (event.time - at) / self.speed
+
+    def write(self, data):
+        events = self.events
+        # Reads the host didn't make this time are dropped, up to the next write
+        while self._position < len(events) and events[self._position].kind != WRITE:
+            self._position += 1
+        self._pending = b''
+        if self._position >= len(events):
+            self._mismatch('Write past the end of the trace')
+            return len(data)
+        event = events[self._position]
+        self._position += 1
+        self._anchor = (time.time(), event.time)
+        if bytes(data) != event.data:
+            self._mismatch('Write at %.3fs differs from the trace' % event.time)
+        return len(data)
+
+    def _mismatch(self, message):
+        self.mismatches += 1
+        if self.strict:
+            raise TraceMismatch(message)
+
+    def read(self, size=1):
+        data = bytearray()
+        events = self.events
+        while len(data) < size:
+            if not self._pending:
+                while self._position < len(events) and events[self._position].kind == FLUSH:
+                    self._position += 1
+                if self._position >= len(events) or events[self._position].kind != READ:
+                    break
+                event = events[self._position]
+                self._position += 1
+                wait = self._due(event) - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                if not event.data:
+                    # A read that timed out in the recording
+                    break
+                self._pending = event.data
+            take = size - len(data)
+            data.extend(self._pending[:take])
+            self._pending = self._pending[take:]
+        return bytes(data)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def inWaiting(self):
+        """ Bytes of the recorded reads that are due, up to the next write"""
+        count = len(self._pending)
+        now = time.time()
+        for event in self.events[self._position:]:
+            if event.kind == WRITE or (event.kind == READ and self._due(event) > now):
+                break
+            count += len(event.data)
+        return count
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def reset_input_buffer(self):
+        self._pending = b''
+
+    flushInput = reset_input_buffer
+
+    def done(self):
+        """ Whether every recorded write was replayed"""
+        return all(event.kind != WRITE for event in self.events[self._position:])
+
+    def close(self):
+        pass
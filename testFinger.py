@@ -1,11 +1,5 @@
 from pyzfm20x import *
-from hextobmp import *
-
-def removeHeader(lista):
-    newlist = []
-    for row in lista:
-        newlist.append(row[9:-2])
-    return newlist
+from pyzfm20x.image import unpackImage, writeBMP
 
 myAddress = 0xFFFFFFFF
 myPassword = 0x00000000
@@ -49,10 +43,9 @@ def getImage():
 def uploadImage():
     getImage()
     print 'Upload finger image',
-    ack, fingerImg = board.uploadImage()
+    ack, fingerImg = board.uploadImageInto()
     print 'ACK=%d' % ack
-    removed =  removeHeader(fingerImg)
-    print 'Finger image stored as ' + hextobmp.hexToBMP(removed, 'finger1')
+    print 'Finger image stored as ' + writeBMP('finger1.bmp', unpackImage(fingerImg))
 
 def downloadImage():
     print 'Download finger image',
@@ -81,8 +74,11 @@ def downloadChar():
 
 def storeTemplate():
     print 'Store finger template',
-    ack, count = board.getTemplateCount()
-    print 'ACK=%d' % board.store(count)
+    pageID = board.freePage()
+    if pageID == -1:
+        print 'Library full'
+        return
+    print 'ACK=%d' % board.store(pageID)
 
 def loadChar():
     print 'Read finger template',
@@ -120,8 +116,7 @@ def readNotepad():
     print data
 
 def fingerPresentTest():
-    while not board.fingerPresent():
-        continue
+    board.detector.waitPlaced()
     print 'Finger detected'
 
 
@@ -130,16 +125,14 @@ def searchFingerTest():
     print response
 
 def enrollTest():
-    ack, count = board.getTemplateCount()
-    print board.fingerEnroll(count)
-
-    # FingerPresent test
-    while not board.fingerPresent():
-        continue
-    print 'Finger detected'
+    pageID = board.freePage()
+    if pageID == -1:
+        print 'Library full'
+        return
+    print board.fingerEnroll(pageID)
 
     # Process to search for a fingerprint
-    response = board.searchFinger()
+    response = board.searchFinger(timeout=30)
     print response
 
 board = pyzfm20x.ZFM20x('/dev/ttyACM0', baudrate=115200, address=myAddress, password=myPassword)
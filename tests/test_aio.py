@@ -0,0 +1,64 @@
+""" AsyncZFM20x against the simulator (Python 3.5+)"""
+import unittest
+
+try:
+    import asyncio
+    from pyzfm20x.aio import AsyncZFM20x
+except (ImportError, SyntaxError):
+    AsyncZFM20x = None
+
+from pyzfm20x.commands import *
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+@unittest.skipIf(AsyncZFM20x is None, 'the asyncio client needs Python 3.5+')
+class AsyncDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sim = ZFM20xSimulator()
+        self.board = self.wait(AsyncZFM20x.open(self.sim))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_download_image(self):
+        image = ZFM20xSimulator.makeFinger(3)
+        self.assertEqual(self.wait(self.board.downloadImage(image, timeout=5)), FINGERPRINT_OK)
+        self.assertEqual(self.sim.imageBuffer, image)
+        ack, uploaded = self.wait(self.board.uploadImage(timeout=5))
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertEqual(uploaded, image)
+
+    def test_download_char(self):
+        template = bytearray(range(256)) * 2
+        self.assertEqual(self.wait(self.board.downloadChar(2, template, timeout=5)), FINGERPRINT_OK)
+        self.assertEqual(self.sim.charBuffers[2], template)
+        # The module is in step for the next command
+        self.assertEqual(self.wait(self.board.getTemplateCount(timeout=5)).ack, FINGERPRINT_OK)
+
+    def test_upload_char_round_trip(self):
+        template = bytearray(range(256)) * 2
+        self.sim.charBuffers[1][:] = template
+        ack, uploaded = self.wait(self.board.uploadChar(1, timeout=5))
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertEqual(uploaded, template)
+        # Straight back into the other buffer
+        self.assertEqual(self.wait(self.board.downloadChar(2, uploaded, timeout=5)), FINGERPRINT_OK)
+        self.assertEqual(self.sim.charBuffers[2], template)
+
+    def test_timed_out_command_leaves_the_stream_in_step(self):
+        self.sim.latency[FINGERPRINT_GETIMAGE] = 0.3
+        with self.assertRaises(asyncio.TimeoutError):
+            self.wait(self.board.getImage(timeout=0.05))
+        # Let the late acknowledge arrive, it is flushed before the next command
+        self.wait(asyncio.sleep(0.3))
+        self.sim.latency = {}
+        self.assertEqual(self.wait(self.board.getTemplateCount(timeout=5)).ack, FINGERPRINT_OK)
+
+
+if __name__ == '__main__':
+    unittest.main()
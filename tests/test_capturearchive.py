@@ -0,0 +1,77 @@
+""" Capture archive of simulated finger images"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pyzfm20x.capturearchive import CaptureArchive
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+@unittest.skipIf(sys.version_info[0] < 3, 'the capture archive needs Python 3')
+class CaptureArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'door.zfmc')
+        self.sim = ZFM20xSimulator(port='sim://door')
+        self.board = ZFM20x(self.sim)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def capture(self, archive, seed):
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(seed))
+        self.board.getImage()
+        return archive.appendUpload(self.board, self.board.searchFinger())
+
+    def test_reopen(self):
+        with CaptureArchive(self.filename) as archive:
+            self.assertEqual([self.capture(archive, seed) for seed in (1, 2)], [0, 1])
+            images = [bytes(archive.image(index)) for index in range(2)]
+        self.assertEqual(images[1], bytes(self.sim.imageBuffer))
+        with CaptureArchive(self.filename, readOnly=True) as archive:
+            self.assertEqual(len(archive), 2)
+            self.assertEqual([bytes(image) for _, image in archive], images)
+            record = archive.record(-1)
+            self.assertEqual((record.index, record.device, record.ack), (1, 'sim://door', FINGERPRINT_NOTFOUND))
+            self.assertTrue(archive.verify(0))
+            self.assertEqual(archive.asArray().shape, (2, CaptureArchive.imageSize))
+            self.assertRaises(IOError, archive.append, images[0])
+        # Appending goes on after the existing records
+        with CaptureArchive(self.filename) as archive:
+            self.assertEqual(self.capture(archive, 3), 2)
+            self.assertEqual(len(archive), 3)
+
+    def test_image_without_record_is_dropped(self):
+        with CaptureArchive(self.filename) as archive:
+            self.capture(archive, 1)
+        # A crash between writing an image and its index record
+        with open(self.filename, 'ab') as f:
+            f.write(bytearray(CaptureArchive.imageSize))
+        with CaptureArchive(self.filename) as archive:
+            self.assertEqual(len(archive), 1)
+            self.assertEqual(self.capture(archive, 2), 1)
+        self.assertEqual(os.path.getsize(self.filename), 16 + 2 * CaptureArchive.imageSize)
+
+    def test_filters(self):
+        with CaptureArchive(self.filename) as archive:
+            archive.append(bytearray(CaptureArchive.imageSize), device='front', timestamp=10)
+            archive.append(bytearray(CaptureArchive.imageSize), device='back', timestamp=20)
+            archive.append(bytearray(CaptureArchive.imageSize), device='front', timestamp=30)
+            self.assertEqual([record.index for record, _ in archive.iterRange(device='front')], [0, 2])
+            self.assertEqual([record.index for record, _ in archive.iterRange(since=15, until=30)], [1])
+            self.assertRaises(ValueError, archive.append, bytearray(10))
+
+    def test_not_an_archive(self):
+        for filename in (self.filename, self.filename + '.idx'):
+            with open(filename, 'wb') as f:
+                f.write(b'something else entirely')
+        self.assertRaises(ValueError, CaptureArchive, self.filename, readOnly=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+""" Prioritized command queue in front of a simulated sensor"""
+import threading
+import unittest
+
+from pyzfm20x.commandqueue import IDENTIFY, MAINTENANCE, NORMAL, CommandQueue
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class CommandQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = ZFM20xSimulator()
+        self.commands = CommandQueue(ZFM20x(self.sim))
+
+    def tearDown(self):
+        self.commands.close()
+
+    def blockWorker(self):
+        """ Keep the I/O thread busy until the returned event is set"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(board):
+            started.set()
+            release.wait(5)
+        self.commands.submit(block)
+        started.wait(5)
+        return release
+
+    def test_board_methods(self):
+        self.assertEqual(self.commands.getTemplateCount().result(5).count, 0)
+        self.assertEqual(self.commands.getImage().result(5), FINGERPRINT_NOFINGER)
+        # Properties would run outside of the I/O thread
+        self.assertRaises(AttributeError, getattr, self.commands, 'info')
+        self.assertRaises(AttributeError, getattr, self.commands, '_transact')
+
+    def test_priorities(self):
+        ran = []
+        release = self.blockWorker()
+        futures = [self.commands.submitAt(priority, lambda board, label=label: ran.append(label))
+                   for priority, label in ((MAINTENANCE, 'export'), (NORMAL, 'count'), (IDENTIFY, 'search1'),
+                                           (IDENTIFY, 'search2'))]
+        self.assertEqual(self.commands.pending(), 4)
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(ran, ['search1', 'search2', 'count', 'export'])
+
+    def test_errors_reach_the_caller(self):
+        self.assertRaises(ValueError, self.commands.writeNotepad(0, b'x' * 64).result, 5)
+
+    def test_close_cancels_pending(self):
+        release = self.blockWorker()
+        pending = self.commands.getTemplateCount()
+        self.commands.close(cancelPending=True, wait=False)
+        release.set()
+        self.assertTrue(pending.cancelled())
+        self.assertRaises(RuntimeError, self.commands.getTemplateCount)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+""" Sensor daemon protocol and a client round trip over a Unix socket"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.daemon import SensorClient, SensorDaemon, _decode, _encode
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.results import DataResult, SearchResult
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class EncodingTest(unittest.TestCase):
+
+    def roundTrip(self, value):
+        data = _encode(value, bytearray())
+        decoded, offset = _decode(data)
+        self.assertEqual(offset, len(data))
+        return decoded
+
+    def test_scalars(self):
+        for value in (None, True, False, 0, -1, 1 << 40, 0.5, u'caf\xe9', b'\x00\xff'):
+            decoded = self.roundTrip(value)
+            self.assertEqual(decoded, value)
+            self.assertEqual(type(decoded), type(value))
+
+    def test_containers(self):
+        self.assertEqual(self.roundTrip([1, [u'a', None], {u'k': b'v'}]), [1, [u'a', None], {u'k': b'v'}])
+        # Plain tuples come back as lists
+        self.assertEqual(self.roundTrip((1, 2)), [1, 2])
+
+    def test_results(self):
+        result = self.roundTrip(SearchResult(FINGERPRINT_OK, 3, 200))
+        self.assertIsInstance(result, SearchResult)
+        self.assertEqual(result, (FINGERPRINT_OK, 3, 200))
+        result = self.roundTrip(DataResult(FINGERPRINT_OK, bytearray(b'abc')))
+        self.assertIsInstance(result, DataResult)
+        self.assertEqual(result.data, b'abc')
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, _encode, object(), bytearray())
+        self.assertRaises(ValueError, _decode, bytearray(b'?'))
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sim = ZFM20xSimulator()
+        self.daemon = SensorDaemon(ZFM20x(self.sim), os.path.join(self.directory, 'zfm20x.sock'))
+        self.daemon.start()
+        self.client = SensorClient(self.daemon.path, timeout=5)
+
+    def tearDown(self):
+        self.client.exit()
+        self.daemon.close()
+        shutil.rmtree(self.directory)
+
+    def test_commands(self):
+        self.assertEqual(self.client.getTemplateCount().count, 0)
+        self.assertEqual(self.client.databaseCount, self.sim.librarySize)
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(4))
+        self.assertEqual(self.client.getImage(), FINGERPRINT_OK)
+        self.assertEqual(self.client.image2Tz(1), FINGERPRINT_OK)
+        self.assertEqual(self.client.store(7), FINGERPRINT_OK)
+        self.assertEqual(self.client.searchFinger(), SearchResult(FINGERPRINT_OK, 7, 200))
+
+    def test_upload_into(self):
+        self.sim.charBuffers[1][:] = bytearray(range(256)) * 2
+        chrBuffer = bytearray(self.client.chrBufferSize)
+        ack, data = self.client.uploadCharInto(1, chrBuffer)
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertIs(data, chrBuffer)
+        self.assertEqual(chrBuffer, self.sim.charBuffers[1])
+
+    def test_errors_are_raised_again(self):
+        self.assertRaises(ValueError, self.client.writeNotepad, 0, b'x' * 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+""" Device info cache (DeviceInfoCache, ZFM20x.info)"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pyzfm20x.deviceinfo import DeviceInfoCache
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class CountingCache(DeviceInfoCache):
+
+    puts = 0
+
+    def put(self, port, address, info):
+        self.puts += 1
+        DeviceInfoCache.put(self, port, address, info)
+
+
+class DeviceInfoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'info.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _board(self, cache):
+        board = ZFM20x(ZFM20xSimulator(), handshake=False, infoCache=cache)
+        # Simulators aren't cached by default, they don't identify a device
+        board._cacheable = True
+        return board
+
+    def test_info_is_saved_once(self):
+        cache = CountingCache(self.filename)
+        info = self._board(cache).info
+        self.assertEqual(cache.puts, 1)
+        # A later process finds it in the file and doesn't write it again
+        cache = CountingCache(self.filename)
+        self.assertEqual(self._board(cache).info, info)
+        self.assertEqual(cache.puts, 0)
+
+    def test_concurrent_saves(self):
+        errors = []
+
+        def save(i):
+            try:
+                for j in range(20):
+                    DeviceInfoCache(self.filename).put('port%d' % i, j, {'baudrate': 6})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.directory), ['info.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
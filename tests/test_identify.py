@@ -0,0 +1,76 @@
+""" Continuous identification on a simulated sensor"""
+import threading
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.identify import IdentificationLoop
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class IdentificationLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = ZFM20xSimulator(librarySize=100)
+        self.board = ZFM20x(self.sim)
+        self.loop = IdentificationLoop(self.board)
+
+    def enroll(self, pageID, seed):
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(seed))
+        self.board.getImage()
+        self.board.image2Tz(1)
+        self.assertEqual(self.board.store(pageID), FINGERPRINT_OK)
+        self.sim.removeFinger()
+
+    def test_once_per_touch(self):
+        self.enroll(5, 1)
+        self.enroll(8, 2)
+        self.assertIsNone(self.loop.step())
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(2))
+        result = self.loop.step()
+        self.assertEqual((result.ack, result.pageID), (FINGERPRINT_OK, 8))
+        # Only the pages holding templates are searched
+        self.assertEqual((result.startPage, result.pageNumber), (5, 4))
+        self.assertIsNone(self.loop.step())
+        self.sim.removeFinger()
+        self.assertIsNone(self.loop.step())
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(3))
+        self.assertEqual(self.loop.step().ack, FINGERPRINT_NOTFOUND)
+
+    def test_empty_library(self):
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        result = self.loop.step()
+        self.assertEqual((result.ack, result.pageNumber), (FINGERPRINT_NOTFOUND, 0))
+
+    def test_refresh_after_changes_from_elsewhere(self):
+        self.enroll(5, 1)
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        self.assertEqual(self.loop.step().pageID, 5)
+        self.sim.removeFinger()
+        self.loop.step()
+        # Another host moved the template to page 50
+        self.sim.library[50] = self.sim.library.pop(5)
+        self.assertEqual(self.loop.refresh(), FINGERPRINT_OK)
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        self.assertEqual(self.loop.step().pageID, 50)
+
+    def test_background(self):
+        self.enroll(5, 1)
+        identified = threading.Event()
+        results = []
+
+        def onResult(result):
+            results.append(result)
+            identified.set()
+        loop = IdentificationLoop(self.board, onResult=onResult)
+        loop.start()
+        try:
+            self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+            self.assertTrue(identified.wait(5))
+        finally:
+            loop.stop(5)
+        self.assertEqual(results[0].pageID, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+""" SensorManager against simulated sensors"""
+import time
+import unittest
+
+from pyzfm20x.manager import SensorEvent, SensorManager
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+def _enroll(sim, pageID, seed):
+    finger = ZFM20xSimulator.makeFinger(seed)
+    sim.library[pageID] = bytearray(sim._features(finger))
+    return finger
+
+
+class ManagerTest(unittest.TestCase):
+
+    def test_wedged_sensors_dont_stall_healthy_ones(self):
+        healthy = ZFM20xSimulator(port='sim://healthy')
+        finger = _enroll(healthy, 3, 7)
+        # Every frame is lost on these cables, the sensors never answer
+        ports = {'healthy': healthy,
+                 'wedged1': ZFM20xSimulator(port='sim://wedged1', maxLinkBaudrate=9600),
+                 'wedged2': ZFM20xSimulator(port='sim://wedged2', maxLinkBaudrate=9600)}
+        manager = SensorManager(ports, maxWorkers=2, readTimeout=0.3, pollInterval=0.02, idleInterval=0.02,
+                                retryInterval=0.01, maxRetryInterval=0.01, offlineAfter=2)
+        manager.start()
+        try:
+            # Both wedged sensors are being retried
+            time.sleep(1.0)
+            self.assertNotEqual(manager.health()['wedged1']['state'], SensorManager.OK)
+            placed = time.time()
+            healthy.placeFinger(finger)
+            for event in manager.iterEvents(timeout=2):
+                if event.kind == SensorEvent.IDENTIFIED:
+                    break
+            else:
+                self.fail('the finger was never identified')
+            self.assertEqual(event.name, 'healthy')
+            self.assertEqual(event.pageID, 3)
+            self.assertLess(event.time - placed, 0.15)
+        finally:
+            manager.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
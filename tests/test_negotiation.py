@@ -0,0 +1,75 @@
+""" Baud rate and package size negotiation against the simulator"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.negotiation import LinkLost, negotiateLink, setBaudrate
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class DeferredSimulator(ZFM20xSimulator):
+    """Module that only applies a new baud rate after a power cycle"""
+
+    def _setSystemParameter(self, args):
+        if args[0] == FINGERPRINT_PARAM_BAUDRATE:
+            self._ack(FINGERPRINT_OK)
+        else:
+            ZFM20xSimulator._setSystemParameter(self, args)
+
+
+class SilentSimulator(ZFM20xSimulator):
+    """Module that never acknowledges setSystemParameter"""
+
+    def _setSystemParameter(self, args):
+        pass
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def _board(self, sim):
+        return ZFM20x(sim, baudrate=sim.baudrate, timeout=0.5)
+
+    def test_raises_rate_and_package_size(self):
+        sim = ZFM20xSimulator(baudrate=19200, packageSize=0)
+        board = self._board(sim)
+        self.assertEqual(negotiateLink(board, timeout=0.1), {'baudrate': 115200, 'packageSize': 256})
+        self.assertEqual(sim.deviceBaudrate, 115200)
+        self.assertEqual(board.baudrate, 12)
+        self.assertEqual(board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_keeps_the_rate_of_a_module_that_does_not_switch(self):
+        sim = DeferredSimulator(baudrate=19200)
+        board = self._board(sim)
+        self.assertEqual(negotiateLink(board, timeout=0.1)['baudrate'], 19200)
+        self.assertEqual(board.baudrate, 2)
+        self.assertEqual(board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_unanswered_switch_is_rolled_back(self):
+        sim = SilentSimulator(baudrate=19200)
+        board = self._board(sim)
+        self.assertEqual(setBaudrate(board, 4, timeout=0.1), FINGERPRINT_PACKETRESPONSEFAIL)
+        self.assertEqual(board.sp.baudrate, 19200)
+        self.assertEqual(board.baudrate, 2)
+        self.assertEqual(board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_steps_up_to_the_cable_limit(self):
+        sim = ZFM20xSimulator(baudrate=19200, maxLinkBaudrate=57600)
+        board = self._board(sim)
+        tried = []
+        setSystemParameter = board.setSystemParameter
+
+        def record(parameterNumber, content):
+            if parameterNumber == FINGERPRINT_PARAM_BAUDRATE:
+                tried.append(content)
+            return setSystemParameter(parameterNumber, content)
+        board.setSystemParameter = record
+        # The first rate over the limit loses the module for good
+        with self.assertRaises(LinkLost):
+            negotiateLink(board, timeout=0.1)
+        self.assertEqual(tried[:4], [4, 6, 8, 6])
+        self.assertEqual(board.sp.baudrate, 57600)
+        self.assertIsNone(board._info)
+
+
+if __name__ == '__main__':
+    unittest.main()
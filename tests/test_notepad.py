@@ -0,0 +1,85 @@
+""" Key-value store in the notepad of a simulated sensor"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.notepad import NotepadStore, decodeEntries, encodeEntries
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class CountingSimulator(ZFM20xSimulator):
+    """Remembers which notepad pages were written"""
+
+    def __init__(self, *args, **kwargs):
+        ZFM20xSimulator.__init__(self, *args, **kwargs)
+        self.written = []
+
+    def _writeNotepad(self, args):
+        self.written.append(args[0])
+        ZFM20xSimulator._writeNotepad(self, args)
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        entries = {u'small': 5, u'negative': -129, u'big': 1 << 40, u'ratio': 0.25,
+                   u'site': u'caf\xe9', u'raw': b'\x00\xff'}
+        self.assertEqual(decodeEntries(encodeEntries(entries)), entries)
+
+    def test_unformatted(self):
+        self.assertIsNone(decodeEntries(bytearray(32)))
+
+    def test_corrupted(self):
+        image = encodeEntries({u'site': u'lab'})
+        image[-1] ^= 0xFF
+        self.assertRaises(ValueError, decodeEntries, image)
+
+    def test_invalid_values(self):
+        self.assertRaises(ValueError, encodeEntries, {u'flag': True})
+        self.assertRaises(ValueError, encodeEntries, {u'': 1})
+        self.assertRaises(ValueError, encodeEntries, {u'blob': b'x' * 256})
+
+
+class NotepadStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = CountingSimulator()
+        self.board = ZFM20x(self.sim)
+
+    def test_unformatted_notepad_is_empty(self):
+        self.assertEqual(len(NotepadStore(self.board)), 0)
+
+    def test_flush_and_reload(self):
+        store = NotepadStore(self.board)
+        store[u'site'] = u'front door'
+        store[u'watermark'] = 1234
+        self.assertTrue(store.dirty)
+        self.assertEqual(store.flush(), FINGERPRINT_OK)
+        self.assertFalse(store.dirty)
+        reloaded = NotepadStore(ZFM20x(self.sim))
+        self.assertEqual(sorted(reloaded.items()), [(u'site', u'front door'), (u'watermark', 1234)])
+
+    def test_flush_writes_only_changed_pages(self):
+        store = NotepadStore(self.board)
+        store[u'a' * 40] = b'x' * 40
+        store[u'watermark'] = 1
+        store.flush()
+        # The header page goes last
+        self.assertEqual(self.sim.written, [1, 2, 3, 0])
+        del self.sim.written[:]
+        store[u'watermark'] = 2
+        store.flush()
+        self.assertEqual(self.sim.written, [3, 0])
+        del self.sim.written[:]
+        # Nothing changed, nothing written
+        self.assertEqual(store.flush(), FINGERPRINT_OK)
+        self.assertEqual(self.sim.written, [])
+
+    def test_full(self):
+        store = NotepadStore(self.board, pageCount=1)
+        self.assertRaises(ValueError, store.update, {u'blob': b'x' * 32})
+        self.assertEqual(len(store), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+""" Host side occupancy map (OccupancyMap, ZFM20x.freePage)"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.occupancy import OccupancyMap
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class OccupancyMapTest(unittest.TestCase):
+
+    def test_free_pages_in_order(self):
+        occupancy = OccupancyMap(10)
+        for pageID in range(10):
+            self.assertEqual(occupancy.nextFree(), pageID)
+            occupancy.mark(pageID)
+        self.assertIsNone(occupancy.nextFree())
+        self.assertEqual(len(occupancy), 10)
+
+    def test_load_index(self):
+        occupancy = OccupancyMap(300)
+        occupancy.loadIndex(0, bytearray([0xFF, 0x05]) + bytearray(30))
+        self.assertEqual(occupancy.count, 10)
+        self.assertEqual(occupancy.nextFree(), 9)
+        self.assertEqual(occupancy.span(), (0, 11))
+
+    def test_store_clear_store(self):
+        occupancy = OccupancyMap(10)
+        for pageID in range(3):
+            occupancy.mark(pageID)
+        # Page 1 is pushed again while it may still be on the heap
+        for _ in range(5):
+            occupancy.clear(1)
+            self.assertEqual(occupancy.nextFree(), 1)
+            occupancy.mark(1)
+            self.assertEqual(occupancy.nextFree(), 3)
+        # Every page is handed out once
+        handedOut = []
+        while occupancy.nextFree() is not None:
+            handedOut.append(occupancy.nextFree())
+            occupancy.mark(handedOut[-1])
+        self.assertEqual(handedOut, list(range(3, 10)))
+        occupancy.clear(0, 10)
+        self.assertEqual(len(occupancy), 0)
+        self.assertEqual(occupancy.nextFree(), 0)
+
+
+class FreePageTest(unittest.TestCase):
+
+    def test_store_delete_store(self):
+        sim = ZFM20xSimulator(librarySize=20)
+        board = ZFM20x(sim)
+        sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        board.getImage()
+        board.image2Tz(1)
+        stored = []
+        for _ in range(3):
+            pageID = board.freePage()
+            self.assertEqual(board.store(pageID), FINGERPRINT_OK)
+            stored.append(pageID)
+            self.assertEqual(board.deleteChar(pageID, 1), FINGERPRINT_OK)
+            pageID = board.freePage()
+            self.assertEqual(board.store(pageID), FINGERPRINT_OK)
+            stored.append(pageID)
+        self.assertEqual(stored, [0, 0, 1, 1, 2, 2])
+        self.assertEqual(sorted(sim.library), [0, 1, 2])
+        self.assertEqual(board.occupiedCount(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
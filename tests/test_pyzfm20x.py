@@ -0,0 +1,35 @@
+""" ZFM20x commands against the simulator"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class TransferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = ZFM20xSimulator()
+        self.board = ZFM20x(self.sim)
+
+    def test_download_image(self):
+        image = ZFM20xSimulator.makeFinger(3)
+        self.assertEqual(self.board.downloadImage(image), FINGERPRINT_OK)
+        self.assertEqual(self.sim.imageBuffer, image)
+        ack, uploaded = self.board.uploadImageInto()
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertEqual(uploaded, image)
+        # In step for the next command
+        self.assertEqual(self.board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_download_char(self):
+        template = bytearray(range(256)) * 2
+        self.assertEqual(self.board.downloadChar(2, template), FINGERPRINT_OK)
+        self.assertEqual(self.sim.charBuffers[2], template)
+        ack, uploaded = self.board.uploadCharInto(2)
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertEqual(uploaded, template)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+""" Template replication between simulated sensors"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.replication import Replicator
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class NoIndexSimulator(ZFM20xSimulator):
+    """Module whose index table can't be read"""
+
+    def _readContList(self, args):
+        self._ack(FINGERPRINT_PACKETRECIEVEERR)
+
+
+def _enroll(sim, board, pageID, seed):
+    sim.placeFinger(ZFM20xSimulator.makeFinger(seed))
+    board.getImage()
+    board.image2Tz(1)
+    return board.store(pageID)
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sourceSim = ZFM20xSimulator(port='sim://source', librarySize=100)
+        self.source = ZFM20x(self.sourceSim)
+        for pageID in (0, 5):
+            _enroll(self.sourceSim, self.source, pageID, pageID + 1)
+        self.events = []
+
+    def _replicator(self, targets):
+        return Replicator(targets, progress=lambda *event: self.events.append(event))
+
+    def test_only_missing_pages_are_pushed(self):
+        sim = ZFM20xSimulator(port='sim://target', librarySize=100)
+        target = ZFM20x(sim)
+        _enroll(sim, target, 5, 1)
+        self.assertEqual(self._replicator([target]).sync(self.source), {'sim://target': {0: FINGERPRINT_OK}})
+        self.assertEqual(sim.library[0], self.sourceSim.library[0])
+
+    def test_target_without_index_is_skipped(self):
+        sim = NoIndexSimulator(port='sim://blind', librarySize=100)
+        target = ZFM20x(sim)
+        _enroll(sim, target, 0, 9)
+        kept = bytes(sim.library[0])
+        self.assertEqual(self._replicator([target]).sync(self.source), {'sim://blind': {}})
+        self.assertEqual(bytes(sim.library[0]), kept)
+        self.assertEqual(self.events, [('sim://blind', None, Replicator.FAILED, 0)])
+
+    def test_source_without_index_raises(self):
+        sim = NoIndexSimulator(port='sim://source2', librarySize=100)
+        target = ZFM20x(ZFM20xSimulator(librarySize=100))
+        self.assertRaises(IOError, self._replicator([target]).sync, ZFM20x(sim))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+""" A library sharded across simulated sensors"""
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.sharding import ShardedLibrary
+from pyzfm20x.simulator import ZFM20xSimulator
+
+
+class ShardedLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sims = [ZFM20xSimulator(port='sim://shard%d' % i, librarySize=10) for i in range(2)]
+        self.boards = [ZFM20x(sim, timeout=0.2) for sim in self.sims]
+        self.library = ShardedLibrary(self.boards)
+        self.finger = ZFM20xSimulator.makeFinger(5)
+        sim = ZFM20xSimulator()
+        sim.placeFinger(self.finger)
+        board = ZFM20x(sim)
+        board.getImage()
+        board.image2Tz(1)
+        self.template = bytes(board.uploadCharInto(1).data)
+
+    def identify(self):
+        self.sims[0].placeFinger(self.finger)
+        return self.library.searchFinger(self.boards[0], timeout=1)
+
+    def test_global_pages(self):
+        self.assertEqual(self.library.capacity, 20)
+        self.assertEqual(self.library.store(13, self.template), FINGERPRINT_OK)
+        self.assertEqual(list(self.sims[1].library), [3])
+        self.assertEqual(self.identify(), (FINGERPRINT_OK, 13, 200, 'sim://shard1'))
+        self.assertEqual(self.library.store(20, self.template), FINGERPRINT_BADLOCATION)
+        self.assertEqual(self.library.delete(13), FINGERPRINT_OK)
+        self.assertEqual(self.identify().ack, FINGERPRINT_NOTFOUND)
+
+    def test_free_page_on_the_emptiest_shard(self):
+        self.library.store(0, self.template)
+        self.assertEqual(self.library.freePage(), 10)
+        self.library.store(10, self.template)
+        self.library.store(11, self.template)
+        self.assertEqual(self.library.freePage(), 1)
+
+    def test_failed_shard_is_left_out(self):
+        self.library.store(3, self.template)
+        # Every frame to and from the second shard is lost
+        self.sims[1].maxLinkBaudrate = 9600
+        self.assertEqual(self.identify(), (FINGERPRINT_OK, 3, 200, 'sim://shard0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
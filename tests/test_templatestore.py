@@ -0,0 +1,65 @@
+""" Template store, exported from and imported into simulated sensors"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+from pyzfm20x.templatestore import TemplateStore, exportLibrary, importLibrary
+
+
+@unittest.skipIf(sys.version_info[0] < 3, 'the template store needs Python 3')
+class TemplateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'site.zfmt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reopen(self):
+        template = bytearray(range(256)) * 2
+        with TemplateStore(self.filename, capacity=10) as store:
+            store.put(3, template, label='front', stored=100.0)
+            store.put(4, template)
+            store.delete(4)
+        with TemplateStore(self.filename) as store:
+            self.assertEqual(store.capacity, 10)
+            self.assertEqual(list(store.pages()), [3])
+            self.assertEqual(store.get(3), bytes(template))
+            self.assertIsNone(store.get(4))
+            self.assertEqual(store.meta(3)['label'], 'front')
+            self.assertEqual(store.meta(3)['stored'], 100.0)
+            self.assertTrue(store.verify(3))
+            self.assertIsNone(store.get(10))
+            self.assertRaises(IndexError, store.templateView, 10)
+            self.assertRaises(ValueError, store.put, 5, bytearray(10))
+
+    def test_not_a_store(self):
+        with open(self.filename, 'wb') as f:
+            f.write(bytearray(64))
+        self.assertRaises(ValueError, TemplateStore, self.filename)
+
+    def test_export_and_import(self):
+        sim = ZFM20xSimulator(port='sim://old', librarySize=50)
+        board = ZFM20x(sim)
+        for pageID, seed in ((2, 1), (7, 2)):
+            sim.placeFinger(ZFM20xSimulator.makeFinger(seed))
+            board.getImage()
+            board.image2Tz(1)
+            self.assertEqual(board.store(pageID), FINGERPRINT_OK)
+        with TemplateStore(self.filename, capacity=board.databaseCount) as store:
+            self.assertEqual(exportLibrary(board, store), 2)
+        newSim = ZFM20xSimulator(port='sim://new', librarySize=50)
+        with TemplateStore(self.filename) as store:
+            self.assertEqual(store.meta(7)['label'], 'sim://old')
+            self.assertEqual(importLibrary(ZFM20x(newSim), store), 2)
+        self.assertEqual(newSim.library, sim.library)
+
+
+if __name__ == '__main__':
+    unittest.main()
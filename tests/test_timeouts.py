@@ -0,0 +1,146 @@
+""" Retries, deadlines and learned read timeouts (ZFM20x, TimeoutPolicy)"""
+import time
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+from pyzfm20x.timeouts import TimeoutPolicy
+from pyzfm20x.transport import DeadlineExceeded, TransportTimeout
+
+
+class LossySimulator(ZFM20xSimulator):
+    """Simulator that loses the next `lose` acknowledges"""
+
+    lose = 0
+
+    def _ack(self, *args, **kwargs):
+        if self.lose:
+            self.lose -= 1
+            return
+        ZFM20xSimulator._ack(self, *args, **kwargs)
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = LossySimulator()
+        self.board = ZFM20x(self.sim, timeout=0.1)
+
+    def test_lost_reply_of_an_idempotent_command_is_retried(self):
+        self.sim.lose = 1
+        self.assertEqual(self.board.getTemplateCount().ack, FINGERPRINT_OK)
+        self.assertEqual(self.board.retransmissions, 1)
+
+    def test_retries_give_up(self):
+        self.sim.lose = self.board.retries + 1
+        self.assertRaises(TransportTimeout, self.board.getTemplateCount)
+        self.assertEqual(self.board.retransmissions, self.board.retries)
+        # The next command gets its own reply
+        self.assertEqual(self.board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_other_commands_are_not_sent_again(self):
+        self.sim.lose = 1
+        self.assertRaises(TransportTimeout, self.board.createModel)
+        self.assertEqual(self.board.retransmissions, 0)
+
+    def test_late_reply_is_not_taken_for_the_next_one(self):
+        self.sim.latency[FINGERPRINT_GETIMAGE] = 0.15
+        self.board.retries = 0
+        self.assertRaises(TransportTimeout, self.board.getImage)
+        time.sleep(0.1)
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        self.sim.latency = {}
+        # The late NOFINGER acknowledge of the first getImage is dropped
+        self.assertEqual(self.board.getImage(), FINGERPRINT_OK)
+
+    def test_default_timeout_is_finite(self):
+        board = ZFM20x(ZFM20xSimulator())
+        self.assertIsNotNone(board.timeout)
+        self.assertEqual(board.sp.timeout, board.timeout)
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = ZFM20xSimulator()
+        self.board = ZFM20x(self.sim, timeout=2.0)
+
+    def test_deadline_cuts_the_read_timeout(self):
+        self.sim.latency[FINGERPRINT_GETIMAGE] = 1.0
+        started = time.time()
+        with self.assertRaises(DeadlineExceeded):
+            with self.board.deadline(0.2):
+                self.board.getImage()
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(self.board.retransmissions, 0)
+
+    def test_no_command_is_sent_after_the_deadline(self):
+        with self.board.deadline(0.05):
+            time.sleep(0.1)
+            self.assertRaises(DeadlineExceeded, self.board.getTemplateCount)
+
+    def test_nested_deadlines_keep_the_earliest(self):
+        with self.board.deadline(0.5):
+            outer = self.board._deadline
+            with self.board.deadline(5):
+                self.assertEqual(self.board._deadline, outer)
+        self.assertIsNone(self.board._deadline)
+
+    def test_search_finger_deadline_includes_waiting(self):
+        started = time.time()
+        self.assertRaises(DeadlineExceeded, self.board.searchFinger, timeout=5, deadline=0.3)
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_enroll_timeout(self):
+        self.sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        # The finger never comes off the sensor
+        self.assertEqual(self.board.fingerEnroll(3, timeout=0.3), -5)
+
+    def test_enroll_deadline_includes_waiting(self):
+        started = time.time()
+        self.assertRaises(DeadlineExceeded, self.board.fingerEnroll, 3, timeout=5, deadline=0.3)
+        self.assertLess(time.time() - started, 1.0)
+
+
+class TimeoutPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = LossySimulator()
+        self.board = ZFM20x(self.sim)
+        self.policy = self.board.timeoutPolicy = TimeoutPolicy(minSamples=3)
+
+    def test_budget_is_learned_from_acknowledges(self):
+        self.assertEqual(self.policy.budget(FINGERPRINT_TEMPLATECOUNT), 0.5)
+        for _ in range(3):
+            self.board.getTemplateCount()
+        self.assertEqual(self.policy.budget(FINGERPRINT_TEMPLATECOUNT), self.policy.minimum)
+
+    def test_transfers_outlast_a_short_acknowledge_budget(self):
+        sim = ZFM20xSimulator(baudrate=9600, packageSize=3, throttle=True)
+        board = ZFM20x(sim, baudrate=9600)
+        board.timeoutPolicy = self.policy
+        for _ in range(5):
+            ack, packets = board.uploadChar(1)
+            self.assertEqual(ack, FINGERPRINT_OK)
+            self.assertEqual(len(packets), board.chrBufferSize // 256)
+        self.assertEqual(self.policy.budget(FINGERPRINT_UPCHAR), self.policy.minimum)
+
+    def test_data_budget_scales_with_packet_and_baud_rate(self):
+        small = self.policy.dataBudget(43, 115200)
+        self.assertLess(small, self.policy.dataBudget(267, 115200))
+        self.assertLess(self.policy.dataBudget(267, 115200), self.policy.dataBudget(267, 9600))
+        self.assertGreater(self.policy.dataBudget(267, 9600), 267 * 10 / 9600.0)
+
+    def test_timeouts_widen_the_budget(self):
+        for _ in range(3):
+            self.board.getTemplateCount()
+        learned = self.policy.budget(FINGERPRINT_TEMPLATECOUNT)
+        self.sim.lose = self.board.retries + 1
+        self.assertRaises(TransportTimeout, self.board.getTemplateCount)
+        self.assertGreater(self.policy.budget(FINGERPRINT_TEMPLATECOUNT), learned)
+        self.assertEqual(self.board.getTemplateCount().ack, FINGERPRINT_OK)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+""" Frame validation and resynchronization (FramedTransport, on ZFM20xSimulator)"""
+import time
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+from pyzfm20x.transport import FramedTransport, FrameError, TransportTimeout
+
+
+class BytesPort(object):
+    """Serial-like port serving fixed bytes, then short reads like a port that timed out"""
+
+    port = 'bytes'
+    timeout = 0
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    def read(self, size=1):
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        return data
+
+    def write(self, data):
+        return len(data)
+
+
+def _frame(packetType, payload, address=0xFFFFFFFF):
+    return FramedTransport(None, address).encode(packetType, bytearray(payload))
+
+
+class FrameTest(unittest.TestCase):
+
+    def test_garbage_before_a_frame_is_dropped(self):
+        frame = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_OK, 0x00, 0x05])
+        transport = FramedTransport(BytesPort(b'\x12\xef\x34\xef' + bytes(frame)))
+        self.assertEqual(transport.readPacket(), frame)
+        self.assertEqual(transport.droppedBytes, 4)
+
+    def test_bad_checksum_raises_and_keeps_the_stream_in_step(self):
+        bad = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_OK])
+        bad[-1] ^= 0xFF
+        good = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_NOFINGER])
+        transport = FramedTransport(BytesPort(bytes(bad) + bytes(good)))
+        with self.assertRaises(FrameError) as raised:
+            transport.readPacket()
+        self.assertEqual(raised.exception.frame, bad)
+        self.assertEqual(transport.corruptFrames, 1)
+        self.assertEqual(transport.readPacket(), good)
+
+    def test_frame_cut_short_times_out(self):
+        frame = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_OK, 0x00, 0x05])
+        transport = FramedTransport(BytesPort(frame[:-1]))
+        self.assertRaises(TransportTimeout, transport.readPacket)
+
+    def test_reply_for_another_address_is_skipped(self):
+        other = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_OK], address=0x12345678)
+        mine = _frame(FINGERPRINT_ACKPACKET, [FINGERPRINT_NOFINGER])
+        transport = FramedTransport(BytesPort(bytes(other) + bytes(mine)))
+        self.assertEqual(transport.readPacket(), mine)
+        self.assertEqual(transport.droppedBytes, len(other))
+
+
+class SimulatorPortTest(unittest.TestCase):
+
+    def test_no_timeout_blocks_until_the_reply_is_complete(self):
+        sim = ZFM20xSimulator(latency={FINGERPRINT_TEMPLATECOUNT: 0.05})
+        sim.write(bytes(_frame(FINGERPRINT_COMMANDPACKET, [FINGERPRINT_TEMPLATECOUNT])))
+        reply = sim.read(14)
+        self.assertEqual(len(reply), 14)
+
+    def test_zero_timeout_returns_what_is_there(self):
+        sim = ZFM20xSimulator(latency={FINGERPRINT_TEMPLATECOUNT: 0.5})
+        sim.timeout = 0
+        sim.write(bytes(_frame(FINGERPRINT_COMMANDPACKET, [FINGERPRINT_TEMPLATECOUNT])))
+        started = time.time()
+        self.assertEqual(sim.read(14), b'')
+        self.assertLess(time.time() - started, 0.1)
+
+    def test_timeout_returns_short(self):
+        sim = ZFM20xSimulator()
+        sim.timeout = 0.05
+        started = time.time()
+        self.assertEqual(sim.read(9), b'')
+        self.assertGreaterEqual(time.time() - started, 0.04)
+
+
+class ResyncTest(unittest.TestCase):
+
+    def test_commands_survive_line_noise(self):
+        sim = ZFM20xSimulator()
+        board = ZFM20x(sim, timeout=0.1)
+        board.retries = 3
+        sim.lineNoise = 0.1
+        answered = 0
+        for _ in range(100):
+            try:
+                if board.getTemplateCount().ack == FINGERPRINT_OK:
+                    answered += 1
+            except (FrameError, TransportTimeout):
+                pass
+        self.assertGreaterEqual(answered, 97)
+        self.assertGreater(board.retransmissions, 0)
+        self.assertGreater(board.transport.droppedBytes + board.transport.corruptFrames, 0)
+        # Back in step once the line is clean
+        sim.lineNoise = 0
+        for _ in range(10):
+            self.assertEqual(board.getTemplateCount().ack, FINGERPRINT_OK)
+
+    def test_image_upload_under_noise_ends_in_step(self):
+        sim = ZFM20xSimulator()
+        board = ZFM20x(sim, timeout=0.1)
+        sim.placeFinger(ZFM20xSimulator.makeFinger(1))
+        self.assertEqual(board.getImage(), FINGERPRINT_OK)
+        sim.lineNoise = 0.01
+        for _ in range(5):
+            try:
+                board.uploadImageInto()
+            except (FrameError, TransportTimeout):
+                pass
+        sim.lineNoise = 0
+        ack, image = board.uploadImageInto()
+        self.assertEqual(ack, FINGERPRINT_OK)
+        self.assertEqual(image, sim.imageBuffer)
+
+
+if __name__ == '__main__':
+    unittest.main()
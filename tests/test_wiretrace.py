@@ -0,0 +1,55 @@
+""" Recording the traffic with a simulated sensor and replaying it"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyzfm20x.commands import *
+from pyzfm20x.pyzfm20x import ZFM20x
+from pyzfm20x.simulator import ZFM20xSimulator
+from pyzfm20x.wiretrace import READ, WRITE, ReplayPort, TraceMismatch, TraceRecorder, readTrace
+
+
+def _session(board):
+    """ The same commands, recorded then replayed"""
+    return [board.getTemplateCount(), board.getImage(), board.image2Tz(1), board.store(4),
+            board.searchFinger(), board.uploadCharInto(1)]
+
+
+class WireTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.zfmw')
+        sim = ZFM20xSimulator()
+        sim.placeFinger(ZFM20xSimulator.makeFinger(2))
+        recorder = TraceRecorder(sim, self.filename)
+        self.recorded = _session(ZFM20x(recorder))
+        recorder.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        port = ReplayPort(self.filename, speed=None, strict=True)
+        self.assertEqual(_session(ZFM20x(port)), self.recorded)
+        self.assertTrue(port.done())
+        self.assertEqual(port.mismatches, 0)
+
+    def test_mismatch(self):
+        board = ZFM20x(ReplayPort(self.filename, speed=None, strict=True))
+        self.assertRaises(TraceMismatch, board.getImage)
+        port = ReplayPort(self.filename, speed=None)
+        ZFM20x(port).getImage()
+        self.assertEqual(port.mismatches, 1)
+
+    def test_truncated_trace(self):
+        started, events = readTrace(self.filename)
+        self.assertEqual(set(event.kind for event in events) & set([READ, WRITE]), set([READ, WRITE]))
+        with open(self.filename, 'rb+') as f:
+            f.truncate(os.path.getsize(self.filename) - 1)
+        self.assertEqual(readTrace(self.filename), (started, events[:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()